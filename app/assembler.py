@@ -0,0 +1,319 @@
+import argparse
+import re
+from string import hexdigits
+from time import perf_counter
+from typing import NamedTuple, Union
+from app.constants import MEMORY_PROGRAM_START, STACK_SIZE
+
+# Instruction templates by mnemonic, the names of the CPU.opcode_* handlers. X and Y are registers,
+# N, NN and NNN numbers or labels, in the order they appear. Quirk variants share their encoding
+INSTRUCTIONS: dict[str, str] = {
+    'CLR': '00E0',
+    'RET': '00EE',
+    'JMP': '1NNN',
+    'CALL': '2NNN',
+    'SE_byte': '3XNN',
+    'SNE_byte': '4XNN',
+    'SE_reg': '5XY0',
+    'LD_range_to_mem': '5XY2',
+    'LD_mem_to_range': '5XY3',
+    'LD_byte': '6XNN',
+    'ADD_byte': '7XNN',
+    'LD_reg': '8XY0',
+    'OR': '8XY1',
+    'AND': '8XY2',
+    'XOR': '8XY3',
+    'ADD_reg': '8XY4',
+    'SUB': '8XY5',
+    'SHR': '8XY6',
+    'SUBN': '8XY7',
+    'SHL': '8XYE',
+    'SNE_reg': '9XY0',
+    'LDI': 'ANNN',
+    'JMP_v0': 'BNNN',
+    'RND': 'CXNN',
+    'DRW': 'DXYN',
+    'SKP': 'EX9E',
+    'SKNP': 'EXA1',
+    'LD_i_long': 'F000NNNN',
+    'PLANE': 'FN01',
+    'LD_audio': 'F002',
+    'LD_dt_in_reg': 'FX07',
+    'LD_key': 'FX0A',
+    'LD_reg_in_dt': 'FX15',
+    'LD_reg_in_st': 'FX18',
+    'ADD_i': 'FX1E',
+    'LD_i_char_sprite': 'FX29',
+    'LD_bcd': 'FX33',
+    'PITCH': 'FX3A',
+    'LD_reg_to_mem': 'FX55',
+    'LD_mem_to_reg': 'FX65',
+}
+INSTRUCTION_ALIASES: dict[str, str] = {
+    'OR_reset_vf': 'OR',
+    'AND_reset_vf': 'AND',
+    'XOR_reset_vf': 'XOR',
+    'SHR_vy': 'SHR',
+    'SHL_vy': 'SHL',
+    'JMP_vx': 'JMP_v0',
+    'DRW_clipped': 'DRW',
+    'LD_reg_to_mem_increment': 'LD_reg_to_mem',
+    'LD_mem_to_reg_increment': 'LD_mem_to_reg',
+}
+# Data directives and the size of their values in bytes
+DATA_DIRECTIVES: dict[str, int] = {'db': 1, 'dw': 2}
+
+LABEL_PATTERN = re.compile(r'^([A-Za-z_][A-Za-z0-9_]*):')
+REGISTER_PATTERN = re.compile(r'^[Vv]([0-9A-Fa-f])$')
+
+
+class AssemblerError(ValueError):
+    pass
+
+
+class Statement(NamedTuple):
+    line_number: int
+    line: str
+    mnemonic: str
+    operands: list[str]
+
+
+def _find_mnemonic(name: str) -> str:
+    """ Mnemonics are case insensitive """
+    for mnemonic in list(INSTRUCTIONS) + list(INSTRUCTION_ALIASES):
+        if mnemonic.lower() == name.lower():
+            return INSTRUCTION_ALIASES.get(mnemonic, mnemonic)
+    raise KeyError(name)
+
+
+def instruction_size(mnemonic: str) -> int:
+    return len(INSTRUCTIONS[mnemonic]) // 2
+
+
+class Assembler:
+    """
+        Two pass assembler of CHIP-8 programs loaded at MEMORY_PROGRAM_START. One statement per line:
+
+            loop:                   ; a label, usable wherever an address or number goes
+                LDI sprite
+                DRW V0, V1, 5
+                ADD_byte V0, 8
+                JMP loop
+            sprite:
+                db 0xF0, 0x90, 0xF0 ; data bytes, dw for 16-bit words
+
+        Numbers are decimal, 0x hexadecimal or 0b binary. Comments start with ';' or '#'.
+    """
+
+    def __init__(self, origin: int = MEMORY_PROGRAM_START) -> None:
+        self.origin = origin
+        self.labels: dict[str, int] = {}
+
+    def parse(self, source: str) -> list[Union[Statement, str]]:
+        """ Statements and label definitions, in order """
+        items: list[Union[Statement, str]] = []
+        for line_number, line in enumerate(source.splitlines(), 1):
+            text = re.split(r'[;#]', line, 1)[0].strip()
+            while True:
+                match = LABEL_PATTERN.match(text)
+                if match is None:
+                    break
+                items.append(match.group(1))
+                text = text[match.end():].strip()
+            if not text:
+                continue
+            fields = text.split(None, 1)
+            operands = [operand.strip() for operand in fields[1].split(',')] if len(fields) > 1 else []
+            items.append(Statement(line_number, line, fields[0], operands))
+        return items
+
+    def _size(self, statement: Statement) -> int:
+        directive = statement.mnemonic.lower()
+        if directive in DATA_DIRECTIVES:
+            return DATA_DIRECTIVES[directive] * len(statement.operands)
+        try:
+            return instruction_size(_find_mnemonic(statement.mnemonic))
+        except KeyError:
+            raise AssemblerError("Unknown instruction %r on line %d: %r" % (statement.mnemonic, statement.line_number, statement.line))
+
+    def _value(self, operand: str, bits: int, statement: Statement) -> int:
+        if operand in self.labels:
+            value = self.labels[operand]
+        else:
+            try:
+                value = int(operand, 0)
+            except ValueError:
+                raise AssemblerError("Unknown label or invalid number %r on line %d: %r" % (operand, statement.line_number, statement.line))
+        if not 0 <= value < 1 << bits:
+            raise AssemblerError("%s doesn't fit in %d bits on line %d: %r" % (operand, bits, statement.line_number, statement.line))
+        return value
+
+    def _register(self, operand: str, statement: Statement) -> int:
+        match = REGISTER_PATTERN.match(operand)
+        if match is None:
+            raise AssemblerError("Expected a register, got %r on line %d: %r" % (operand, statement.line_number, statement.line))
+        return int(match.group(1), 16)
+
+    def encode(self, statement: Statement) -> bytes:
+        directive = statement.mnemonic.lower()
+        if directive in DATA_DIRECTIVES:
+            size = DATA_DIRECTIVES[directive]
+            return b''.join(self._value(operand, 8 * size, statement).to_bytes(size, 'big') for operand in statement.operands)
+
+        mnemonic = _find_mnemonic(statement.mnemonic)
+        template = INSTRUCTIONS[mnemonic]
+        fields = list(re.finditer(r'X|Y|N+', template))
+        if len(statement.operands) != len(fields):
+            raise AssemblerError("%s takes %d operands, got %d on line %d: %r" % (
+                mnemonic, len(fields), len(statement.operands), statement.line_number, statement.line))
+        word = int(''.join(digit if digit in hexdigits else '0' for digit in template), 16)
+        for field, operand in zip(fields, statement.operands):
+            shift = 4 * (len(template) - field.end())
+            if field.group() in ('X', 'Y'):
+                value = self._register(operand, statement)
+            else:
+                value = self._value(operand, 4 * len(field.group()), statement)
+            word |= value << shift
+        return word.to_bytes(len(template) // 2, 'big')
+
+    def assemble(self, source: str) -> bytes:
+        items = self.parse(source)
+        # First pass: label addresses
+        self.labels = {}
+        address = self.origin
+        for item in items:
+            if isinstance(item, str):
+                if item in self.labels:
+                    raise AssemblerError("Label %r is defined twice" % item)
+                self.labels[item] = address
+            else:
+                address += self._size(item)
+        # Second pass: encoding, labels may be used before their definition
+        return b''.join(self.encode(item) for item in items if isinstance(item, Statement))
+
+
+def assemble(source: str) -> bytes:
+    return Assembler().assemble(source)
+
+
+###################
+# Stress programs #
+###################
+
+def draw_stress_source(sprites: int = 8, height: int = 15) -> str:
+    """ DRW heavy: sprites draws of height rows per loop, moving across the screen """
+    if not 1 <= height <= 15:
+        raise ValueError("Sprites are 1 to 15 rows high")
+    lines = ['    LDI sprite', 'loop:']
+    for _ in range(sprites):
+        lines += ['    DRW V0, V1, %d' % height, '    ADD_byte V0, 9', '    ADD_byte V1, 3']
+    lines += ['    JMP loop', 'sprite:', '    db ' + ', '.join(['0xA5', '0x5A'] * 8)]
+    return '\n'.join(lines)
+
+
+def math_stress_source(operations: int = 32) -> str:
+    """ ALU heavy: register arithmetic and logic with carries, shifts and borrows, no memory access """
+    cycle = ['ADD_reg', 'XOR', 'SUB', 'SHL', 'OR', 'SUBN', 'SHR', 'AND']
+    lines = ['    LD_byte V0, 0x37', '    LD_byte V1, 0x9B', '    LD_byte V2, 0x05', 'loop:']
+    for n in range(operations):
+        lines.append('    %s V%X, V%X' % (cycle[n % len(cycle)], n % 3, (n + 1) % 3))
+        if n % len(cycle) == len(cycle) - 1:
+            # Keeps the values from settling to 0
+            lines.append('    ADD_byte V%X, 0x3D' % (n % 3))
+    lines.append('    JMP loop')
+    return '\n'.join(lines)
+
+
+def call_stress_source(depth: int = STACK_SIZE) -> str:
+    """ Call heavy: a chain of depth nested subroutine calls and returns per loop """
+    if not 1 <= depth <= STACK_SIZE:
+        raise ValueError("The call depth is 1 to %d" % STACK_SIZE)
+    lines = ['loop:', '    CALL level1', '    ADD_byte V0, 1', '    JMP loop']
+    for level in range(1, depth + 1):
+        lines.append('level%d:' % level)
+        if level < depth:
+            lines.append('    CALL level%d' % (level + 1))
+        lines.append('    RET')
+    return '\n'.join(lines)
+
+
+def timer_stress_source(delay: int = 1) -> str:
+    """ Timer wait heavy: sets the delay timer and spins on it, the usual way games pace themselves """
+    return '\n'.join([
+        'loop:',
+        '    LD_byte V0, %d' % delay,
+        '    LD_reg_in_dt V0',
+        'wait:',
+        '    LD_dt_in_reg V0',
+        '    SE_byte V0, 0',
+        '    JMP wait',
+        '    ADD_byte V1, 1',
+        '    JMP loop',
+    ])
+
+
+STRESS_SOURCES = {
+    'draw': draw_stress_source,
+    'math': math_stress_source,
+    'calls': call_stress_source,
+    'timer': timer_stress_source,
+}
+
+
+def stress_rom(kind: str, **parameters: int) -> bytes:
+    if kind not in STRESS_SOURCES:
+        raise ValueError("Unknown stress ROM %r, expected one of %s" % (kind, ', '.join(STRESS_SOURCES)))
+    return assemble(STRESS_SOURCES[kind](**parameters))
+
+
+def benchmark(rom: bytes, frames: int = 600, cycles_per_frame: int = 1000, fusion: bool = True) -> float:
+    """
+        Instructions per second running rom headlessly. Without fusion every instruction runs on its own,
+        with it loops like the spin of the timer ROM run as a single superinstruction
+    """
+    from app.golden import GoldenRun
+    cpu = GoldenRun(rom, cycles_per_frame).cpu
+    cpu.fusion = fusion
+    start = perf_counter()
+    for _ in range(frames):
+        cpu.update()
+    return frames * cycles_per_frame / (perf_counter() - start)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="CHIP-8 assembler and stress ROM generator")
+    commands = parser.add_subparsers(dest='command', required=True)
+    assemble_parser = commands.add_parser('assemble', help="Assemble a source file")
+    assemble_parser.add_argument('source')
+    assemble_parser.add_argument('output')
+    generate_parser = commands.add_parser('generate', help="Write a stress ROM, or time it with --benchmark")
+    generate_parser.add_argument('kind', choices=sorted(STRESS_SOURCES))
+    generate_parser.add_argument('output', nargs='?')
+    generate_parser.add_argument('--param', metavar='NAME=VALUE', action='append', default=[],
+        help="Generator parameter, e.g. sprites=4 height=8 for draw, operations for math, depth for calls, delay for timer")
+    generate_parser.add_argument('--benchmark', metavar='FRAMES', type=int, help="Print the instructions per second over FRAMES frames")
+    generate_parser.add_argument('--cycles', type=int, default=1000, help="Cycles per frame of the benchmark")
+    generate_parser.add_argument('--fusion', choices=['both', 'on', 'off'], default='both',
+        help="Benchmark with superinstructions, without them, or both")
+    args = parser.parse_args()
+
+    if args.command == 'assemble':
+        with open(args.source, 'r') as f:
+            rom = assemble(f.read())
+        with open(args.output, 'wb') as f:
+            f.write(rom)
+        print("%d bytes written" % len(rom))
+    else:
+        try:
+            parameters = {name: int(value, 0) for name, value in (param.split('=', 1) for param in args.param)}
+        except ValueError:
+            parser.error("Parameters are NAME=VALUE pairs of integers")
+        rom = stress_rom(args.kind, **parameters)
+        if args.output:
+            with open(args.output, 'wb') as f:
+                f.write(rom)
+        if args.benchmark:
+            for fusion in (True, False):
+                if args.fusion in ('both', 'on' if fusion else 'off'):
+                    print("%s, fusion %s: %.0f instructions per second" % (args.kind, 'on' if fusion else 'off',
+                        benchmark(rom, args.benchmark, args.cycles, fusion)))
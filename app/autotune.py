@@ -0,0 +1,88 @@
+from typing import Optional
+
+DEFAULT_TARGET_IPS: int = 600 # 10 cycles per frame at 60 fps
+# Share of the frame budget the emulation may use, the rest is left to the engine and sleeping
+DEFAULT_BUDGET_SHARE: float = 0.8
+# Weight of the last frame in the moving averages of the measured costs
+SMOOTHING: float = 0.1
+# Renders are skipped at most this many frames in a row
+MAX_SKIPPED_RENDERS: int = 4
+
+
+class CycleTuner:
+    """
+        Picks how many CPU cycles run each frame to hold a target number of instructions per second.
+
+        The cost of a cycle and of a render are measured on every frame. While the target fits in the frame
+        budget every frame is rendered. When it doesn't, renders are skipped first, because timers and
+        game speed depend on frames while skipping a render only lowers the displayed frame rate.
+        Only when the cycles alone overrun the budget is the number of cycles per frame lowered.
+    """
+
+    def __init__(self,
+        target_ips: int = DEFAULT_TARGET_IPS,
+        fps: int = 60,
+        budget_share: float = DEFAULT_BUDGET_SHARE,
+        max_cycles_per_frame: int = 10000) -> None:
+        self.target_ips = target_ips
+        self.fps = fps
+        self.budget = budget_share / fps
+        self.target_cycles = max(1, round(target_ips / fps))
+        self.max_cycles_per_frame = max_cycles_per_frame
+
+        self.cycles_per_frame = min(self.target_cycles, max_cycles_per_frame)
+        self.cycle_cost: Optional[float] = None # Seconds per cycle
+        self.render_cost: Optional[float] = None # Seconds per render
+        self.render_interval = 1 # Render one frame out of render_interval
+
+        self.frames = 0
+        self.rendered_frames = 0
+        self.executed_cycles = 0
+        self._frames_since_render = 0
+
+    @staticmethod
+    def _average(average: Optional[float], value: float) -> float:
+        return value if average is None else average + SMOOTHING * (value - average)
+
+    def should_render(self) -> bool:
+        return self._frames_since_render + 1 >= self.render_interval
+
+    def record(self, cycles: int, cpu_time: float, render_time: Optional[float]) -> None:
+        """ Measurements of the last frame: render_time is None if the render was skipped """
+        self.frames += 1
+        self.executed_cycles += cycles
+        if cycles:
+            self.cycle_cost = self._average(self.cycle_cost, cpu_time / cycles)
+        if render_time is None:
+            self._frames_since_render += 1
+        else:
+            self.rendered_frames += 1
+            self._frames_since_render = 0
+            self.render_cost = self._average(self.render_cost, render_time)
+        self._adjust()
+
+    def _adjust(self) -> None:
+        if self.cycle_cost is None:
+            return
+        render_cost = self.render_cost or 0.0
+        cycles_time = self.target_cycles * self.cycle_cost
+
+        # Spread the renders over enough frames for the target cycles to fit
+        interval = 1
+        while interval < MAX_SKIPPED_RENDERS + 1 and cycles_time + render_cost / interval > self.budget:
+            interval += 1
+        self.render_interval = interval
+
+        available = self.budget - render_cost / interval
+        affordable = int(available / self.cycle_cost) if available > 0 else 1
+        self.cycles_per_frame = max(1, min(self.target_cycles, affordable, self.max_cycles_per_frame))
+
+    @property
+    def instructions_per_second(self) -> float:
+        """ Rate at which instructions currently run, when the host keeps up with the frame rate """
+        return self.cycles_per_frame * self.fps
+
+    def report(self) -> str:
+        skipped = 100 * (1 - self.rendered_frames / self.frames) if self.frames else 0
+        return "%d instructions/s (target %d), %d cycles/frame, %.0f%% renders skipped" % (
+            self.instructions_per_second, self.target_ips, self.cycles_per_frame, skipped)
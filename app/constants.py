@@ -1,11 +1,23 @@
+from typing import Tuple
 from app.engine.vector2 import Vector2
 
 SCREEN_SIZE: Vector2 = Vector2(64, 32)
-MEMORY_SIZE: int = 0x1000
+MEMORY_SIZE: int = 0x10000 # XO-CHIP extends the address space to 64 KB
 STACK_SIZE: int = 0x10
 MEMORY_PROGRAM_START: int = 0x200
 REGISTER_COUNT: int = 0x10
 
+# XO-CHIP extensions
+PLANE_COUNT: int = 2
+AUDIO_PATTERN_SIZE: int = 0x10
+AUDIO_DEFAULT_PITCH: int = 64
+DEFAULT_PALETTE: list[Tuple[int, int, int]] = [
+    (0, 0, 0),       # No plane set (background)
+    (200, 40, 40),   # Plane 1
+    (40, 200, 40),   # Plane 2
+    (230, 230, 230), # Both planes
+]
+
 SPRITE_BYTE_SIZE = 5
 DEFAULT_SPRITES: list[int] = [
     0xF0, 0x90, 0x90, 0x90, 0xF0, # 0
@@ -0,0 +1,231 @@
+import argparse
+import math
+import os
+from typing import NamedTuple, Sequence
+from app.constants import AUDIO_PATTERN_SIZE, MEMORY_PROGRAM_START, MEMORY_SIZE
+from app.cpu import CPU
+from app.debugger import memory_ranges, memory_write_ranges
+from app.golden import DEFAULT_CHECKPOINTS, DEFAULT_CYCLES_PER_FRAME, DEFAULT_SEED, GoldenRun, GoldenSuite, parse_input_script
+from app.recorder import encode_png
+
+# Heat map shades, one per power of ten of executions
+HEAT_SHADES: str = '.:-=+*#%@'
+UNTOUCHED_SHADE: str = ' '
+DATA_SHADE: str = 'd'
+HEAT_MAP_WIDTH: int = 32 # Bytes per heat map line or image row
+# Image palette: untouched, data only, then the heat shades from cold to hot
+HEAT_PALETTE: list[tuple[int, int, int]] = [(0, 0, 0), (40, 80, 200)] + [
+    (255, int(230 * (1 - level / (len(HEAT_SHADES) - 1))), 0) for level in range(len(HEAT_SHADES))
+]
+# Families of the instructions accessing memory through I
+_DATA_FAMILIES = frozenset([0x5, 0xD, 0xF])
+
+
+def memory_read_ranges(cpu: CPU, opcode: int) -> list[tuple[int, int]]:
+    """
+        Memory ranges read as data by opcode, for the instructions loading from memory (DXYN, FX65, 5XY3 and F002).
+        Loads wrap around the end of memory, sprites stop there
+    """
+    family, low = opcode >> 12, opcode & 0xFF
+    if family == 0xD and opcode & 0xF:
+        # One sprite per selected plane
+        planes = bin(cpu.renderer.plane_mask).count('1')
+        start = cpu.i
+        end = min(start + (opcode & 0xF) * planes, MEMORY_SIZE)
+        return [(start, end)] if start < end else []
+    if family == 0xF and low == 0x65:
+        return memory_ranges(cpu.i, ((opcode & 0xF00) >> 8) + 1)
+    if family == 0xF and opcode == 0xF002:
+        return memory_ranges(cpu.i, AUDIO_PATTERN_SIZE)
+    if family == 0x5 and opcode & 0xF == 0x3:
+        return memory_ranges(cpu.i, abs(((opcode & 0xF00) >> 8) - ((opcode & 0xF0) >> 4)) + 1)
+    return []
+
+
+def heat_level(count: int) -> int:
+    return min(len(HEAT_SHADES) - 1, int(math.log10(count)))
+
+
+class Hotspot(NamedTuple):
+    address: int
+    count: int
+    handler: str
+
+
+class CoverageTracker:
+    """
+        Counts the instructions executed at each address and the data read and written through I.
+        Like the debugger, it replaces CPU.run_cycles while attached, so the two can't be used together.
+    """
+
+    def __init__(self, cpu: CPU) -> None:
+        self.cpu = cpu
+        self.executions = [0] * MEMORY_SIZE
+        self.reads = [0] * MEMORY_SIZE
+        self.writes = [0] * MEMORY_SIZE
+
+    def attach(self) -> None:
+        self.cpu.run_cycles = self._run_cycles
+
+    def detach(self) -> None:
+        if 'run_cycles' in self.cpu.__dict__:
+            del self.cpu.run_cycles
+
+    def reset(self) -> None:
+        self.executions = [0] * MEMORY_SIZE
+        self.reads = [0] * MEMORY_SIZE
+        self.writes = [0] * MEMORY_SIZE
+
+    @staticmethod
+    def _count(counts: list[int], accesses: list[tuple[int, int]]) -> None:
+        for start, end in accesses:
+            for address in range(start, end):
+                counts[address] += 1
+
+    def _run_cycles(self, count: int) -> None:
+        """ Replacement of CPU.run_cycles counting executions and data accesses """
+        cpu = self.cpu
+        executions = self.executions
+        for _ in range(count):
+            pc = cpu.pc
+            opcode = cpu.opcode_at(pc)
+            executions[pc] += 1
+            if opcode >> 12 in _DATA_FAMILIES:
+                self._count(self.reads, memory_read_ranges(cpu, opcode))
+                self._count(self.writes, memory_write_ranges(cpu, opcode))
+            cpu.execute_cycle()
+
+    ###########
+    # Reports #
+    ###########
+
+    def byte_executions(self) -> list[int]:
+        """ Executions of the instruction covering each byte, F000 NNNN being 4 bytes long """
+        counts = [0] * MEMORY_SIZE
+        cpu = self.cpu
+        for address, count in enumerate(self.executions):
+            if count:
+                size = 4 if cpu.opcode_at(address) == 0xF000 else 2
+                for start, end in memory_ranges(address, size):
+                    for byte in range(start, end):
+                        counts[byte] = max(counts[byte], count)
+        return counts
+
+    def code_bytes(self) -> set[int]:
+        return {address for address, count in enumerate(self.byte_executions()) if count}
+
+    def data_bytes(self) -> set[int]:
+        return {address for address in range(MEMORY_SIZE) if self.reads[address] or self.writes[address]}
+
+    def uncovered_ranges(self, start: int, end: int) -> list[tuple[int, int]]:
+        """ Ranges (end exclusive) neither executed nor accessed as data between start and end """
+        covered = self.code_bytes() | self.data_bytes()
+        ranges = []
+        range_start = None
+        for address in range(start, end):
+            if address in covered:
+                if range_start is not None:
+                    ranges.append((range_start, address))
+                    range_start = None
+            elif range_start is None:
+                range_start = address
+        if range_start is not None:
+            ranges.append((range_start, end))
+        return ranges
+
+    def hotspots(self, count: int = 10) -> list[Hotspot]:
+        """ Most executed addresses, with the handler of their instruction """
+        addresses = sorted((a for a, n in enumerate(self.executions) if n), key=lambda a: -self.executions[a])[:count]
+        hotspots = []
+        for address in addresses:
+            entry = self.cpu.decoded.get(address)
+            hotspots.append(Hotspot(address, self.executions[address], entry[1].__name__ if entry else '?'))
+        return hotspots
+
+    def shades(self, start: int, end: int) -> list[int]:
+        """ Heat map index of each byte: 0 untouched, 1 data only, else 2 plus the heat level """
+        counts = self.byte_executions()
+        return [
+            2 + heat_level(counts[a]) if counts[a] else 1 if self.reads[a] or self.writes[a] else 0
+            for a in range(start, end)
+        ]
+
+    def heat_map_text(self, start: int, end: int) -> str:
+        characters = UNTOUCHED_SHADE + DATA_SHADE + HEAT_SHADES
+        shades = self.shades(start, end)
+        lines = []
+        for offset in range(0, end - start, HEAT_MAP_WIDTH):
+            line = ''.join(characters[shade] for shade in shades[offset:offset + HEAT_MAP_WIDTH])
+            lines.append("0x%04X |%s|" % (start + offset, line.ljust(HEAT_MAP_WIDTH)))
+        return '\n'.join(lines)
+
+    def heat_map_png(self, start: int, end: int, scale: int = 8) -> bytes:
+        """ One square of scale pixels per byte, HEAT_MAP_WIDTH bytes per row """
+        shades = self.shades(start, end)
+        rows = []
+        for offset in range(0, end - start, HEAT_MAP_WIDTH):
+            indices = shades[offset:offset + HEAT_MAP_WIDTH]
+            indices += [0] * (HEAT_MAP_WIDTH - len(indices))
+            row = bytes(index for index in indices for _ in range(scale))
+            rows.extend([row] * scale)
+        return encode_png(rows, HEAT_PALETTE)
+
+    def report(self, rom_size: int, hotspot_count: int = 10) -> str:
+        """ Coverage of the ROM image loaded at MEMORY_PROGRAM_START """
+        start, end = MEMORY_PROGRAM_START, MEMORY_PROGRAM_START + rom_size
+        in_rom = lambda addresses: sum(1 for a in addresses if start <= a < end)
+        code = in_rom(self.code_bytes())
+        read = in_rom(a for a in range(start, end) if self.reads[a])
+        written = in_rom(a for a in range(start, end) if self.writes[a])
+        uncovered = self.uncovered_ranges(start, end)
+        uncovered_size = sum(range_end - range_start for range_start, range_end in uncovered)
+        percent = lambda n: 100 * n / rom_size if rom_size else 0
+
+        lines = [
+            "ROM: %d bytes at 0x%04X-0x%04X" % (rom_size, start, end - 1),
+            "Executed: %d bytes (%.1f%%)" % (code, percent(code)),
+            "Data read: %d bytes, written: %d bytes" % (read, written),
+            "Not covered: %d bytes (%.1f%%)" % (uncovered_size, percent(uncovered_size)),
+        ]
+        lines.extend("  0x%04X-0x%04X" % (range_start, range_end - 1) for range_start, range_end in uncovered)
+        lines.append("Hottest instructions:")
+        lines.extend("  0x%04X %10d  %s" % hotspot for hotspot in self.hotspots(hotspot_count))
+        lines.append("Heat map (%r untouched, %r data, %r to %r executed 1 to 10^%d+ times):" % (
+            UNTOUCHED_SHADE, DATA_SHADE, HEAT_SHADES[0], HEAT_SHADES[-1], len(HEAT_SHADES) - 1))
+        lines.append(self.heat_map_text(start, end))
+        return '\n'.join(lines)
+
+
+def run_coverage(rom: bytes, frames: int, events: Sequence = (),
+    cycles_per_frame: int = DEFAULT_CYCLES_PER_FRAME, seed: int = DEFAULT_SEED) -> CoverageTracker:
+    """ Runs a ROM headlessly for a number of frames with scripted input, the way golden runs do """
+    run = GoldenRun(rom, cycles_per_frame, seed)
+    tracker = CoverageTracker(run.cpu)
+    tracker.attach()
+    run.run([frames], events)
+    tracker.detach()
+    return tracker
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Execution heat map and code coverage of a ROM")
+    parser.add_argument('rom_path')
+    parser.add_argument('--frames', type=int, default=max(DEFAULT_CHECKPOINTS), help="Frames to run")
+    parser.add_argument('--keys', metavar='SCRIPT', help="Input script, the golden one of the ROM by default")
+    parser.add_argument('--golden-directory', default=os.path.join('tests', 'golden'))
+    parser.add_argument('--heatmap', metavar='PNG', help="Also write the heat map as an image")
+    args = parser.parse_args()
+
+    with open(args.rom_path, 'rb') as f:
+        rom = f.read()
+    suite = GoldenSuite(args.golden_directory, os.path.dirname(args.rom_path))
+    if args.keys:
+        with open(args.keys) as f:
+            events = parse_input_script(f.read())
+    else:
+        events = suite.input_events(os.path.basename(args.rom_path))
+    tracker = run_coverage(rom, args.frames, events, suite.cycles_per_frame, suite.seed)
+    print(tracker.report(len(rom)))
+    if args.heatmap:
+        with open(args.heatmap, 'wb') as f:
+            f.write(tracker.heat_map_png(MEMORY_PROGRAM_START, MEMORY_PROGRAM_START + len(rom)))
@@ -1,13 +1,20 @@
+import copy
 import logging
 import random
-from typing import Optional
-from app.constants import DEFAULT_SPRITES, MEMORY_PROGRAM_START, MEMORY_SIZE, REGISTER_COUNT, SPRITE_BYTE_SIZE, STACK_SIZE
-from app.engine.vector2 import Vector2
+from typing import Any, Callable, NamedTuple, Optional, Sequence
+from app.constants import AUDIO_PATTERN_SIZE, DEFAULT_SPRITES, MEMORY_PROGRAM_START, MEMORY_SIZE, REGISTER_COUNT, SCREEN_SIZE, SPRITE_BYTE_SIZE, STACK_SIZE
+from app.decode_cache import DecodeCache, DecodedRom
+from app.engine.headless_engine_handler import HeadlessEngineHandler
+from app.quirks import Quirks
+from app.rom_library import rom_hash
+from app.superinstructions import SUPERINSTRUCTIONS, Superinstruction, fuse
 from app.key import Key
 from app.renderer import Renderer
 from app.keyboard import Keyboard
 from app.speaker import Speaker
 
+OpcodeHandler = Callable[[int], None]
+
 class CPUError(RuntimeError):
     pass
 
@@ -17,17 +24,52 @@ class StackOverflowError(CPUError):
 class StackUnderflowError(CPUError):
     pass
 
+class RomTooLargeError(CPUError):
+    pass
+
+
+class CPUState(NamedTuple):
+    """ Copy of the whole machine state, independent from the CPU it was taken from. See CPU.snapshot() """
+    memory: bytes
+    registers: tuple[int, ...]
+    i: int
+    pc: int
+    sp: int
+    stack: tuple[int, ...]
+    delay_timer: int
+    sound_timer: int
+    wait_for_key_reg: Optional[int]
+    planes: tuple[tuple[int, ...], ...]
+    plane_mask: int
+    audio_pattern: Optional[bytes]
+    pattern_pitch: int
+    rng_state: Any
+
 
 class CPU:
     PC_INCREMENT_SIZE = 2
 
-    def __init__(self, cycles_per_frame: int, renderer: Renderer, keyboard: Keyboard, speaker: Speaker) -> None:
+    def __init__(self, 
+        cycles_per_frame: int, 
+        renderer: Renderer, 
+        keyboard: Keyboard, 
+        speaker: Speaker, 
+        decode_cache: Optional[DecodeCache] = None,
+        seed: Optional[int] = None,
+        quirks: Quirks = Quirks(),
+        fusion: bool = True) -> None:
         self.renderer = renderer
         self.keyboard = keyboard
         self.speaker = speaker
         self.cycles_per_frame = cycles_per_frame
+        self.decode_cache = decode_cache
+        # Seed of the CXNN random numbers, None for a different sequence on each ROM load
+        self.seed = seed
+        self.rng = random.Random(seed)
 
         self.memory: bytearray = bytearray(MEMORY_SIZE)
+        # Memory is shared with clones until one of them writes to it, see clone()
+        self.memory_shared = False
         self.registers = [0] * REGISTER_COUNT
         self.i = 0 # Special I register
         self.delay_timer = 0
@@ -39,19 +81,87 @@ class CPU:
         # Special case for OpCode 0xFx0A which requires waiting for input
         self.wait_for_key_reg: Optional[int] = None
 
+        # Decoded instructions by address
+        self.decoded: dict[int, tuple[int, OpcodeHandler]] = {}
+        # Superinstructions by start address, None where the instructions don't form one. See run_cycles()
+        self.fusion = fusion
+        self.fused: dict[int, Optional[Superinstruction]] = {}
+        # Instructions executed by each kind of superinstruction
+        self.fusion_stats: dict[str, int] = dict.fromkeys(SUPERINSTRUCTIONS, 0)
+        self.rom_hash: Optional[str] = None
+
+        self.family_decoders = self._family_decoders()
+        self.set_quirks(quirks)
+
         self._load_default_sprites()
+
+    def _family_decoders(self) -> dict[int, Callable[[int], OpcodeHandler]]:
+        """ Decoders of the instruction families holding several instructions """
+        return {
+            0x0: self.decode_clear_or_return_op,
+            0x5: self.decode_register_range_op,
+            0x8: self.decode_math_op,
+            0xE: self.decode_key_op,
+            0xF: self.decode_misc_op,
+        }
     
     def _load_default_sprites(self) -> bytearray:
-        for i, byte in enumerate(DEFAULT_SPRITES):
-            self.memory[i] = byte
+        self._writable_memory()[:len(DEFAULT_SPRITES)] = bytes(DEFAULT_SPRITES)
+
+    def _writable_memory(self) -> bytearray:
+        """ Memory to write to, copied first if it is shared with clones """
+        if self.memory_shared:
+            self.memory = bytearray(self.memory)
+            self.memory_shared = False
+        return self.memory
+
+    def _store(self, address: int, values: Sequence[int]) -> None:
+        """ Writes values from address on, wrapping around the end of memory so that it never grows """
+        address %= MEMORY_SIZE
+        memory = self._writable_memory()
+        end = address + len(values)
+        if end <= MEMORY_SIZE:
+            memory[address:end] = bytes(values)
+        else:
+            split = MEMORY_SIZE - address
+            memory[address:] = bytes(values[:split])
+            memory[:end - MEMORY_SIZE] = bytes(values[split:])
+
+    def _load(self, address: int, count: int) -> bytes:
+        """ count bytes from address on, wrapping around the end of memory """
+        address %= MEMORY_SIZE
+        end = address + count
+        if end <= MEMORY_SIZE:
+            return self.memory[address:end]
+        return self.memory[address:] + self.memory[:end - MEMORY_SIZE]
+
+    def opcode_at(self, address: int) -> int:
+        """ Instruction at address, its second byte wrapping around the end of memory """
+        return (self.memory[address] << 8) | self.memory[(address + 1) % MEMORY_SIZE]
 
     def load_rom(self, rom_path: str) -> None:
-        random.seed()
         with open(rom_path, 'rb') as f:
-            for i, byte in enumerate(f.read()):
-                self.memory[MEMORY_PROGRAM_START + i] = byte
-        logging.info("CPU base memory after loading rom %s :" % rom_path)
-        logging.info(self.memory)
+            self.load_rom_bytes(f.read())
+        logging.info("Loaded rom %s" % rom_path)
+
+    def load_rom_bytes(self, rom: bytes) -> None:
+        """ Copies a ROM image (any bytes-like object, e.g. a memoryview) into memory at once """
+        max_size = MEMORY_SIZE - MEMORY_PROGRAM_START
+        if len(rom) > max_size:
+            raise RomTooLargeError("ROM is %d bytes long, at most %d bytes fit in memory" % (len(rom), max_size))
+
+        self.rng.seed(self.seed)
+        self._writable_memory()[MEMORY_PROGRAM_START:MEMORY_PROGRAM_START + len(rom)] = rom
+        self.decoded = {}
+        self.fused = {}
+        logging.debug("Loaded %d bytes of rom" % len(rom))
+
+        if self.decode_cache is not None:
+            self.rom_hash = rom_hash(rom)
+            decoded_rom = self.decode_cache.load(self._decode_cache_key())
+            if decoded_rom is not None:
+                kept = self.warm_start(decoded_rom)
+                logging.info("Warm start with %d cached instructions" % kept)
 
     def update(self) -> None:
         # Special case for OpCode 0xFx0A which requires waiting for input
@@ -65,9 +175,44 @@ class CPU:
         
         self.update_timers()
         self.handle_sound()
-            
-        for _ in range(self.cycles_per_frame):
-            self.execute_cycle()
+        self.run_cycles(self.cycles_per_frame)
+
+    def run_cycles(self, count: int) -> None:
+        """
+            Instruction loop, without any check. A debugger replaces it while it has breakpoints.
+            With fusion, common sequences of instructions run as a single superinstruction when
+            the whole sequence fits in the cycles left.
+        """
+        if not self.fusion:
+            for _ in range(count):
+                self.execute_cycle()
+            return
+
+        decoded = self.decoded
+        fused = self.fused
+        stats = self.fusion_stats
+        while count > 0:
+            pc = self.pc
+            superinstruction = fused.get(pc)
+            if superinstruction is not None and superinstruction.length <= count:
+                code = superinstruction.code
+                if self.memory[pc:pc+len(code)] == code:
+                    executed = superinstruction.handler(count)
+                    stats[superinstruction.name] += executed
+                    count -= executed
+                    continue
+                # Self-modifying code
+                fused[pc] = fuse(self, pc)
+
+            # execute_cycle(), inlined
+            memory = self.memory
+            opcode = (memory[pc] << 8) | memory[(pc+1) % MEMORY_SIZE]
+            entry = decoded.get(pc)
+            if entry is None or entry[0] != opcode:
+                entry = self._decode_at(pc, opcode)
+            self.pc = (pc + self.PC_INCREMENT_SIZE) % MEMORY_SIZE
+            entry[1](opcode)
+            count -= 1
     
     def update_timers(self) -> None:
         if self.delay_timer > 0:
@@ -82,94 +227,231 @@ class CPU:
             self.speaker.stop()
     
     def _increment_pc(self) -> None:
-        self.pc += self.PC_INCREMENT_SIZE
+        # The program counter wraps around the end of memory, like loads and stores
+        self.pc = (self.pc + self.PC_INCREMENT_SIZE) % MEMORY_SIZE
+
+    def _skip_next_instruction(self) -> None:
+        # XO-CHIP long load F000 NNNN is 4 bytes long and must be skipped as a whole
+        if self._load(self.pc, self.PC_INCREMENT_SIZE) == b'\xf0\x00':
+            self._increment_pc()
+        self._increment_pc()
         
     def execute_cycle(self) -> None:
-        opcode = int.from_bytes(self.memory[self.pc:self.pc+self.PC_INCREMENT_SIZE], 'big', signed=False)
-        self._increment_pc()
-        self.execute_opcode(opcode)
+        pc = self.pc
+        opcode = (self.memory[pc] << 8) | self.memory[(pc+1) % MEMORY_SIZE]
+        # Instructions are decoded once per address, the opcode check catches self-modifying code
+        entry = self.decoded.get(pc)
+        if entry is None or entry[0] != opcode:
+            entry = self._decode_at(pc, opcode)
+        self.pc = (pc + self.PC_INCREMENT_SIZE) % MEMORY_SIZE
+        entry[1](opcode)
+
+    def _decode_at(self, pc: int, opcode: int) -> tuple[int, OpcodeHandler]:
+        """ Decodes the instruction at pc, and the superinstruction starting there """
+        entry = (opcode, self.decode(opcode))
+        self.decoded[pc] = entry
+        if self.fusion:
+            self.fused[pc] = fuse(self, pc)
+        return entry
 
     def execute_opcode(self, opcode: int) -> None:
-        lookup_table = {
-            0x0: self.handle_clear_or_return_op,
-            0x1: self.opcode_JMP,
-            0x2: self.opcode_CALL,
-            0x3: self.opcode_SE_byte,
-            0x4: self.opcode_SNE_byte,
-            0x5: self.opcode_SE_reg,
-            0x6: self.opcode_LD_byte,
-            0x7: self.opcode_ADD_byte,
-            0x8: self.handle_math_op,
-            0x9: self.opcode_SNE_reg,
-            0xA: self.opcode_LDI,
-            0xB: self.opcode_JMP_v0,
-            0xC: self.opcode_RND,
-            0xD: self.opcode_DRW,
-            0xE: self.handle_key_op,
-            0xF: self.handle_misc_op,
+        self.decode(opcode)(opcode)
+
+    def set_quirks(self, quirks: Quirks) -> None:
+        """
+            Builds the handler tables of a quirks profile: each quirk picks a variant of the affected handlers
+            once here, so the handlers themselves never check the profile.
+            Tables hold handler names, resolved when an instruction is decoded.
+        """
+        self.quirks = quirks
+        self.family_handlers: dict[int, str] = {
+            0x1: 'opcode_JMP',
+            0x2: 'opcode_CALL',
+            0x3: 'opcode_SE_byte',
+            0x4: 'opcode_SNE_byte',
+            0x6: 'opcode_LD_byte',
+            0x7: 'opcode_ADD_byte',
+            0x9: 'opcode_SNE_reg',
+            0xA: 'opcode_LDI',
+            0xB: 'opcode_JMP_vx' if quirks.jump_uses_vx else 'opcode_JMP_v0',
+            0xC: 'opcode_RND',
+            0xD: 'opcode_DRW_clipped' if quirks.clip_sprites else 'opcode_DRW',
         }
-
-        lookup_byte = (opcode & 0xF000) >> 12
-        lookup_table[lookup_byte](opcode)
-        
+        self.math_handlers: dict[int, str] = {
+            0x0: 'opcode_LD_reg',
+            0x1: 'opcode_OR_reset_vf' if quirks.logic_resets_vf else 'opcode_OR',
+            0x2: 'opcode_AND_reset_vf' if quirks.logic_resets_vf else 'opcode_AND',
+            0x3: 'opcode_XOR_reset_vf' if quirks.logic_resets_vf else 'opcode_XOR',
+            0x4: 'opcode_ADD_reg',
+            0x5: 'opcode_SUB',
+            0x6: 'opcode_SHR_vy' if quirks.shift_uses_vy else 'opcode_SHR',
+            0x7: 'opcode_SUBN',
+            0xE: 'opcode_SHL_vy' if quirks.shift_uses_vy else 'opcode_SHL',
+        }
+        self.misc_handlers: dict[int, str] = {
+            0x01: 'opcode_PLANE',
+            0x02: 'opcode_LD_audio',
+            0x07: 'opcode_LD_dt_in_reg',
+            0x0A: 'opcode_LD_key',
+            0x15: 'opcode_LD_reg_in_dt',
+            0x18: 'opcode_LD_reg_in_st',
+            0x1E: 'opcode_ADD_i',
+            0x29: 'opcode_LD_i_char_sprite',
+            0x33: 'opcode_LD_bcd',
+            0x55: 'opcode_LD_reg_to_mem_increment' if quirks.load_store_increments_i else 'opcode_LD_reg_to_mem',
+            0x65: 'opcode_LD_mem_to_reg_increment' if quirks.load_store_increments_i else 'opcode_LD_mem_to_reg',
+            0x3A: 'opcode_PITCH',
+        }
+        # Instructions decoded with the previous profile
+        self.decoded = {}
+        self.fused = {}
+
+    def decode(self, opcode: int) -> OpcodeHandler:
+        """ Returns the function implementing opcode """
+        family = (opcode & 0xF000) >> 12
+        handler_name = self.family_handlers.get(family)
+        if handler_name is None:
+            return self.family_decoders[family](opcode)
+        return getattr(self, handler_name)
     
-    def handle_clear_or_return_op(self, opcode: int) -> None:
+    def decode_clear_or_return_op(self, opcode: int) -> OpcodeHandler:
         subop = opcode & 0xFF
         if subop == 0xE0:
-            self.opcode_CLR(opcode)
+            return self.opcode_CLR
         elif subop == 0xEE:
-            self.opcode_RET(opcode)
-        else:
-            self.nop(opcode)
-
-    def handle_math_op(self, opcode: int) -> None:
-        lookup_table = {
-            0x0: self.opcode_LD_reg,
-            0x1: self.opcode_OR,
-            0x2: self.opcode_AND,
-            0x3: self.opcode_XOR,
-            0x4: self.opcode_ADD_reg,
-            0x5: self.opcode_SUB,
-            0x6: self.opcode_SHR,
-            0x7: self.opcode_SUBN,
-            0xE: self.opcode_SHL,
-        }
+            return self.opcode_RET
+        return self.nop
 
-        lookup_byte = opcode & 0xF
-        if lookup_byte in lookup_table.keys():
-            lookup_table[lookup_byte](opcode)
-        else:
-            self.nop(opcode)
+    def decode_register_range_op(self, opcode: int) -> OpcodeHandler:
+        subop = opcode & 0xF
+        if subop == 0x2:
+            return self.opcode_LD_range_to_mem
+        elif subop == 0x3:
+            return self.opcode_LD_mem_to_range
+        return self.opcode_SE_reg
+
+    def decode_math_op(self, opcode: int) -> OpcodeHandler:
+        return getattr(self, self.math_handlers.get(opcode & 0xF, 'nop'))
 
-    def handle_key_op(self, opcode: int) -> None:
+    def decode_key_op(self, opcode: int) -> OpcodeHandler:
         subop = opcode & 0xFF
         if subop == 0x9E:
-            self.opcode_SKP(opcode)
+            return self.opcode_SKP
         elif subop == 0xA1:
-            self.opcode_SKNP(opcode)
-        else:
-            self.nop(opcode)
-
-    def handle_misc_op(self, opcode: int) -> None:
-        lookup_table = {
-            0x07: self.opcode_LD_dt_in_reg,
-            0x0A: self.opcode_LD_key,
-            0x15: self.opcode_LD_reg_in_dt,
-            0x18: self.opcode_LD_reg_in_st,
-            0x1E: self.opcode_ADD_i,
-            0x29: self.opcode_LD_i_char_sprite,
-            0x33: self.opcode_LD_bcd,
-            0x55: self.opcode_LD_reg_to_mem,
-            0x65: self.opcode_LD_mem_to_reg,
-        }
+            return self.opcode_SKNP
+        return self.nop
+
+    def decode_misc_op(self, opcode: int) -> OpcodeHandler:
+        if opcode == 0xF000:
+            return self.opcode_LD_i_long
 
         lookup_bytes = opcode & 0xFF
-        if lookup_bytes in lookup_table.keys():
-            lookup_table[lookup_bytes](opcode)
-        else:
-            self.nop(opcode)
+        if lookup_bytes not in self.misc_handlers:
             logging.warning("Ignoring unknown opcode %x" % opcode)
-    
+        return getattr(self, self.misc_handlers.get(lookup_bytes, 'nop'))
+
+    ###############
+    # Predecoding #
+    ###############
+
+    def decoded_rom(self) -> DecodedRom:
+        """ Instructions decoded so far, by address, with the name of their handler """
+        return DecodedRom({address: (opcode, handler.__name__) for address, (opcode, handler) in self.decoded.items()})
+
+    def warm_start(self, decoded_rom: DecodedRom) -> int:
+        """
+            Fills the decoded instructions table from a previous run.
+            Entries that don't match the current memory are ignored. Returns the number of entries kept.
+        """
+        kept = 0
+        for address, (opcode, handler_name) in decoded_rom.instructions.items():
+            handler = getattr(self, handler_name, None)
+            if address + 1 >= MEMORY_SIZE or handler is None or (self.memory[address] << 8 | self.memory[address+1]) != opcode:
+                continue
+            self.decoded[address] = (opcode, handler)
+            if self.fusion:
+                self.fused[address] = fuse(self, address)
+            kept += 1
+        return kept
+
+    def _decode_cache_key(self) -> str:
+        # Handlers depend on the quirks profile
+        return '%s-%s' % (self.rom_hash, self.quirks.key())
+
+    def save_decode_cache(self) -> None:
+        if self.decode_cache is not None and self.rom_hash is not None:
+            self.decode_cache.store(self._decode_cache_key(), self.decoded_rom())
+
+    ############
+    # Snapshot #
+    ############
+
+    def snapshot(self) -> CPUState:
+        renderer = self.renderer
+        return CPUState(
+            bytes(self.memory),
+            tuple(self.registers),
+            self.i,
+            self.pc,
+            self.sp,
+            tuple(self.stack),
+            self.delay_timer,
+            self.sound_timer,
+            self.wait_for_key_reg,
+            tuple(tuple(rows) for rows in renderer.planes),
+            renderer.plane_mask,
+            self.speaker.pattern,
+            self.speaker.pattern_pitch,
+            self.rng.getstate())
+
+    def restore(self, state: CPUState) -> None:
+        """ Puts the machine back in a snapshot state. Decoded instructions are kept, they check their opcode """
+        self.memory = bytearray(state.memory)
+        self.memory_shared = False
+        self.registers = list(state.registers)
+        self.i = state.i
+        self.pc = state.pc
+        self.sp = state.sp
+        self.stack = list(state.stack)
+        self.delay_timer = state.delay_timer
+        self.sound_timer = state.sound_timer
+        self.wait_for_key_reg = state.wait_for_key_reg
+        renderer = self.renderer
+        for rows, saved in zip(renderer.planes, state.planes):
+            rows[:] = saved
+        renderer.plane_mask = state.plane_mask
+        renderer.dirty = True
+        self.speaker.pattern = state.audio_pattern
+        self.speaker.pattern_pitch = state.pattern_pitch
+        self.rng.setstate(state.rng_state)
+
+    def clone(self) -> 'CPU':
+        """
+            Copy of the machine state detached from any engine, for exploring several futures of a game.
+            Memory is shared copy-on-write: the first instruction writing to it, in either CPU, copies it.
+            Memory must then only be written through the CPU. Decoded instructions are bound to
+            their CPU, the clone decodes its own.
+        """
+        engine = HeadlessEngineHandler(size=SCREEN_SIZE)
+        clone = copy.copy(self)
+        # Loop of a debugger or coverage tracker attached to this CPU
+        clone.__dict__.pop('run_cycles', None)
+        clone.renderer = self.renderer.detached_copy(engine)
+        clone.keyboard = self.keyboard.detached_copy(engine)
+        clone.speaker = copy.copy(self.speaker)
+        clone.speaker.engine = engine
+        clone.registers = self.registers[:]
+        clone.stack = self.stack[:]
+        # Without calling __init__, which would first seed the generator from the OS
+        clone.rng = random.Random.__new__(random.Random)
+        clone.rng.setstate(self.rng.getstate())
+        clone.decode_cache = None
+        clone.decoded = {}
+        clone.fused = {}
+        clone.fusion_stats = dict.fromkeys(SUPERINSTRUCTIONS, 0)
+        clone.family_decoders = clone._family_decoders()
+        self.memory_shared = clone.memory_shared = True
+        return clone
 
     @classmethod
     def get_all_opcodes(cls) -> list:
@@ -233,7 +515,7 @@ class CPU:
         reg = (opcode & 0xF00) >> 8
         byte = (opcode & 0xFF)
         if self.registers[reg] == byte:
-            self._increment_pc()
+            self._skip_next_instruction()
 
     def opcode_SNE_byte(self, opcode: int) -> None:
         """ 
@@ -243,7 +525,7 @@ class CPU:
         reg = (opcode & 0xF00) >> 8
         byte = (opcode & 0xFF)
         if self.registers[reg] != byte:
-            self._increment_pc()
+            self._skip_next_instruction()
 
     def opcode_SE_reg(self, opcode: int) -> None:
         """ 
@@ -253,7 +535,7 @@ class CPU:
         regx = (opcode & 0xF00) >> 8
         regy = (opcode & 0xF0) >> 4
         if self.registers[regx] == self.registers[regy]:
-            self._increment_pc()
+            self._skip_next_instruction()
 
     def opcode_LD_byte(self, opcode: int) -> None:
         """ 
@@ -374,7 +656,7 @@ class CPU:
         regx = (opcode & 0xF00) >> 8
         regy = (opcode & 0xF0) >> 4
         if self.registers[regx] != self.registers[regy]:
-            self._increment_pc()
+            self._skip_next_instruction()
 
     def opcode_LDI(self, opcode: int) -> None:
         """ 
@@ -398,7 +680,7 @@ class CPU:
         """
         reg = (opcode & 0xF00) >> 8
         byte = (opcode & 0xFF)
-        number = random.randint(0, 0xFF)
+        number = self.rng.randint(0, 0xFF)
         self.registers[reg] = byte & number
 
     def opcode_DRW(self, opcode: int) -> None:
@@ -409,7 +691,11 @@ class CPU:
             I value does not change after the execution of this instruction. 
             As described above, VF is set to 1 if any screen pixels are flipped from set to unset when the sprite is drawn, 
             and to 0 if that does not happen
+            (XO-CHIP) The sprite is drawn on every selected plane, the data for each plane following the previous one.
         """
+        self._draw(opcode, self.renderer.draw_sprite)
+
+    def _draw(self, opcode: int, draw_sprite: Callable[[int, int, bytes, list[int]], bool]) -> None:
         regx = (opcode & 0xF00) >> 8
         regy = (opcode & 0xF0) >> 4
         x = self.registers[regx]
@@ -418,12 +704,11 @@ class CPU:
         set_vf = False
 
         logging.debug("Draw sprite (located at 0x%04x) at pos %d/%d" % (self.i, x, y))
-        for i in range(0, n):
-            row = self.memory[self.i + i]
-            for j in range(1, 9):
-                if (row >> (j-1)) & 0x1:
-                    if self.renderer.toggle_pixel(Vector2(x+8-j, y+i)):
-                        set_vf = True
+        address = self.i
+        for rows in self.renderer.selected_planes():
+            if draw_sprite(x, y, self.memory[address:address+n], rows):
+                set_vf = True
+            address += n
         
         if set_vf:
             self.registers[0xF] = 1
@@ -437,7 +722,7 @@ class CPU:
         reg = (opcode & 0xF00) >> 8
         key: Key = Key(self.registers[reg])
         if self.keyboard.is_key_pressed(key):
-            self._increment_pc()
+            self._skip_next_instruction()
     
     def opcode_SKNP(self, opcode: int) -> None:
         """ 
@@ -447,7 +732,7 @@ class CPU:
         reg = (opcode & 0xF00) >> 8
         key: Key = Key(self.registers[reg])
         if not self.keyboard.is_key_pressed(key):
-            self._increment_pc()
+            self._skip_next_instruction()
 
     def opcode_LD_dt_in_reg(self, opcode: int) -> None:
         """ 
@@ -511,9 +796,7 @@ class CPU:
         """
         reg = (opcode & 0xF00) >> 8
         value = self.registers[reg]
-        self.memory[self.i] = int(value / 100) % 10
-        self.memory[self.i+1] = int(value / 10) % 10
-        self.memory[self.i+2] = value % 10
+        self._store(self.i, (int(value / 100) % 10, int(value / 10) % 10, value % 10))
 
     def opcode_LD_reg_to_mem(self, opcode: int) -> None:
         """ 
@@ -522,8 +805,7 @@ class CPU:
             The offset from I is increased by 1 for each value written, but I itself is left unmodified.
         """
         max_reg = (opcode & 0xF00) >> 8
-        for i in range(0, max_reg+1):
-            self.memory[self.i + i] = self.registers[i]
+        self._store(self.i, self.registers[:max_reg+1])
 
     def opcode_LD_mem_to_reg(self, opcode: int) -> None:
         """ 
@@ -532,5 +814,141 @@ class CPU:
             The offset from I is increased by 1 for each value written, but I itself is left unmodified
         """
         max_reg = (opcode & 0xF00) >> 8
-        for i in range(0, max_reg+1):
-            self.registers[i] = self.memory[self.i + i]
+        self.registers[:max_reg+1] = self._load(self.i, max_reg + 1)
+
+    ###################
+    # XO-CHIP opcodes #
+    ###################
+
+    def opcode_LD_range_to_mem(self, opcode: int) -> None:
+        """
+            OpCode 5XY2
+            Stores VX to VY (including VY) in memory, starting at address I. I is left unmodified.
+            Registers are stored in reverse order if X is greater than Y.
+        """
+        regx = (opcode & 0xF00) >> 8
+        regy = (opcode & 0xF0) >> 4
+        if regx <= regy:
+            values = self.registers[regx:regy+1]
+        else:
+            values = self.registers[regy:regx+1][::-1]
+        self._store(self.i, values)
+
+    def opcode_LD_mem_to_range(self, opcode: int) -> None:
+        """
+            OpCode 5XY3
+            Fills VX to VY (including VY) with values from memory, starting at address I. I is left unmodified.
+            Registers are loaded in reverse order if X is greater than Y.
+        """
+        regx = (opcode & 0xF00) >> 8
+        regy = (opcode & 0xF0) >> 4
+        count = abs(regx - regy) + 1
+        values = self._load(self.i, count)
+        if regx <= regy:
+            self.registers[regx:regy+1] = values
+        else:
+            self.registers[regy:regx+1] = values[::-1]
+
+    def opcode_LD_i_long(self, _: int) -> None:
+        """
+            OpCode F000 NNNN
+            Sets I to the 16 bits address NNNN stored in the next two bytes, then skips them.
+        """
+        self.i = int.from_bytes(self._load(self.pc, self.PC_INCREMENT_SIZE), 'big', signed=False)
+        self._increment_pc()
+
+    def opcode_PLANE(self, opcode: int) -> None:
+        """
+            OpCode FN01
+            Selects the drawing planes given by the bitmask N (0 to 3).
+        """
+        self.renderer.select_planes((opcode & 0xF00) >> 8)
+
+    def opcode_LD_audio(self, _: int) -> None:
+        """
+            OpCode F002
+            Loads the 16 bytes audio pattern buffer from memory, starting at address I and wrapping around the end of memory.
+        """
+        self.speaker.load_pattern(self._load(self.i, AUDIO_PATTERN_SIZE))
+
+    def opcode_PITCH(self, opcode: int) -> None:
+        """
+            OpCode FX3A
+            Sets the audio pattern playback pitch to VX.
+        """
+        reg = (opcode & 0xF00) >> 8
+        self.speaker.set_pattern_pitch(self.registers[reg])
+
+    ###########################
+    # Quirks handler variants #
+    ###########################
+
+    def opcode_OR_reset_vf(self, opcode: int) -> None:
+        """ OpCode 8XY1 resetting VF (quirk logic_resets_vf) """
+        regx = (opcode & 0xF00) >> 8
+        regy = (opcode & 0xF0) >> 4
+        self.registers[regx] |= self.registers[regy]
+        self.registers[0xF] = 0
+
+    def opcode_AND_reset_vf(self, opcode: int) -> None:
+        """ OpCode 8XY2 resetting VF (quirk logic_resets_vf) """
+        regx = (opcode & 0xF00) >> 8
+        regy = (opcode & 0xF0) >> 4
+        self.registers[regx] &= self.registers[regy]
+        self.registers[0xF] = 0
+
+    def opcode_XOR_reset_vf(self, opcode: int) -> None:
+        """ OpCode 8XY3 resetting VF (quirk logic_resets_vf) """
+        regx = (opcode & 0xF00) >> 8
+        regy = (opcode & 0xF0) >> 4
+        self.registers[regx] ^= self.registers[regy]
+        self.registers[0xF] = 0
+
+    def opcode_SHR_vy(self, opcode: int) -> None:
+        """
+            OpCode 8XY6 (quirk shift_uses_vy)
+            Stores VY shifted to the right by 1 in VX, then the bit shifted out in VF.
+        """
+        regx = (opcode & 0xF00) >> 8
+        regy = (opcode & 0xF0) >> 4
+        value = self.registers[regy]
+        self.registers[regx] = value >> 1
+        self.registers[0xF] = value & 0x1
+
+    def opcode_SHL_vy(self, opcode: int) -> None:
+        """
+            OpCode 8XYE (quirk shift_uses_vy)
+            Stores VY shifted to the left by 1 in VX, then the bit shifted out in VF.
+        """
+        regx = (opcode & 0xF00) >> 8
+        regy = (opcode & 0xF0) >> 4
+        value = self.registers[regy]
+        self.registers[regx] = (value << 1) & 0xFF
+        self.registers[0xF] = (value >> 7) & 0x1
+
+    def opcode_JMP_vx(self, opcode: int) -> None:
+        """
+            OpCode BXNN (quirk jump_uses_vx)
+            Jumps to the address XNN plus VX.
+        """
+        reg = (opcode & 0xF00) >> 8
+        self.pc = (opcode & 0xFFF) + self.registers[reg]
+
+    def opcode_DRW_clipped(self, opcode: int) -> None:
+        """
+            OpCode DXYN (quirk clip_sprites)
+            Draws like DXYN, the parts of the sprite beyond the screen edges being clipped instead of wrapped.
+        """
+        self._draw(opcode, self.renderer.draw_sprite_clipped)
+
+    def opcode_LD_reg_to_mem_increment(self, opcode: int) -> None:
+        """ OpCode FX55, leaving I after the last stored register (quirk load_store_increments_i) """
+        max_reg = (opcode & 0xF00) >> 8
+        self._store(self.i, self.registers[:max_reg+1])
+        self.i += max_reg + 1
+
+    def opcode_LD_mem_to_reg_increment(self, opcode: int) -> None:
+        """ OpCode FX65, leaving I after the last loaded register (quirk load_store_increments_i) """
+        max_reg = (opcode & 0xF00) >> 8
+        self.registers[:max_reg+1] = self._load(self.i, max_reg + 1)
+        self.i += max_reg + 1
@@ -0,0 +1,361 @@
+import cmd
+import operator
+import re
+from time import perf_counter, sleep
+from typing import Callable, NamedTuple, Optional
+from app.constants import MEMORY_SIZE
+from app.cpu import CPU
+from app.decode_cache import DecodeCache
+from app.emulator import Emulator
+from app.golden import dump_frame
+
+CONDITION_OPERATORS: dict[str, Callable[[int, int], bool]] = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
+_CONDITION_PATTERN = re.compile(r'^v([0-9a-f])\s*(==|!=|<=|>=|<|>)\s*(\w+)$', re.IGNORECASE)
+
+
+class DebuggerError(ValueError):
+    pass
+
+
+def parse_number(text: str) -> int:
+    """ Decimal, or hexadecimal with a 0x prefix """
+    try:
+        return int(text, 0)
+    except ValueError:
+        raise DebuggerError("Invalid number %r" % text)
+
+
+class RegisterCondition(NamedTuple):
+    register: int
+    operator: str
+    value: int
+
+    @classmethod
+    def parse(cls, text: str) -> 'RegisterCondition':
+        """ Parses conditions like `v3 == 0x10` """
+        match = _CONDITION_PATTERN.match(text.strip())
+        if match is None:
+            raise DebuggerError("Invalid condition %r, expected e.g. 'v3 == 0x10'" % text)
+        return cls(int(match.group(1), 16), match.group(2), parse_number(match.group(3)))
+
+    def matches(self, cpu: CPU) -> bool:
+        return CONDITION_OPERATORS[self.operator](cpu.registers[self.register], self.value)
+
+    def __str__(self) -> str:
+        return "V%X %s 0x%02X" % (self.register, self.operator, self.value)
+
+
+class Breakpoint(NamedTuple):
+    address: int
+    condition: Optional[RegisterCondition] = None
+
+
+class Watchpoint(NamedTuple):
+    start: int
+    end: int # Exclusive
+
+
+class BreakEvent(NamedTuple):
+    reason: str # 'breakpoint', 'watchpoint' or 'step'
+    pc: int
+    detail: str = ''
+
+    def __str__(self) -> str:
+        return "%s at 0x%04X%s" % (self.reason.capitalize(), self.pc, " (%s)" % self.detail if self.detail else '')
+
+
+def memory_ranges(address: int, count: int) -> list[tuple[int, int]]:
+    """ Ranges of the count bytes from address on, split in two where they wrap around the end of memory """
+    address %= MEMORY_SIZE
+    end = address + count
+    if end <= MEMORY_SIZE:
+        return [(address, end)]
+    return [(address, MEMORY_SIZE), (0, end - MEMORY_SIZE)]
+
+
+def memory_write_ranges(cpu: CPU, opcode: int) -> list[tuple[int, int]]:
+    """ Memory ranges written by opcode, for the instructions storing to memory (FX33, FX55 and 5XY2) """
+    family, low = opcode >> 12, opcode & 0xFF
+    if family == 0xF and low == 0x33:
+        return memory_ranges(cpu.i, 3)
+    if family == 0xF and low == 0x55:
+        return memory_ranges(cpu.i, ((opcode & 0xF00) >> 8) + 1)
+    if family == 0x5 and opcode & 0xF == 0x2:
+        return memory_ranges(cpu.i, abs(((opcode & 0xF00) >> 8) - ((opcode & 0xF0) >> 4)) + 1)
+    return []
+
+
+class Debugger:
+    """
+        Breakpoints and memory watchpoints for a CPU.
+        The CPU keeps running its own instruction loop until a breakpoint or watchpoint is set:
+        only then is CPU.run_cycles replaced by a loop checking them before and after every instruction.
+    """
+
+    def __init__(self, cpu: CPU) -> None:
+        self.cpu = cpu
+        self.breakpoints: dict[int, Breakpoint] = {}
+        self.watchpoints: list[Watchpoint] = []
+        self.paused = False
+        self.last_event: Optional[BreakEvent] = None
+        # Breakpoint already reported at this address, skipped when resuming from it
+        self._resume_pc: Optional[int] = None
+        # Return address and stack depth of a step over a subroutine call
+        self._step_over: Optional[tuple[int, int]] = None
+
+    @property
+    def checking(self) -> bool:
+        return 'run_cycles' in self.cpu.__dict__
+
+    def _update_loop(self) -> None:
+        needs_checks = bool(self.breakpoints or self.watchpoints or self._step_over)
+        if needs_checks and not self.checking:
+            self.cpu.run_cycles = self._run_cycles
+        elif not needs_checks and self.checking:
+            del self.cpu.run_cycles
+
+    def detach(self) -> None:
+        self.breakpoints.clear()
+        self.watchpoints.clear()
+        self._step_over = None
+        self.paused = False
+        self._update_loop()
+
+    def add_breakpoint(self, address: int, condition: Optional[RegisterCondition] = None) -> Breakpoint:
+        point = Breakpoint(address, condition)
+        self.breakpoints[address] = point
+        self._update_loop()
+        return point
+
+    def remove_breakpoint(self, address: int) -> None:
+        if self.breakpoints.pop(address, None) is None:
+            raise DebuggerError("No breakpoint at 0x%04X" % address)
+        self._update_loop()
+
+    def add_watchpoint(self, start: int, end: Optional[int] = None) -> Watchpoint:
+        watchpoint = Watchpoint(start, start + 1 if end is None else end)
+        if watchpoint.end <= watchpoint.start:
+            raise DebuggerError("Empty watch range 0x%04X-0x%04X" % watchpoint)
+        self.watchpoints.append(watchpoint)
+        self._update_loop()
+        return watchpoint
+
+    def remove_watchpoint(self, start: int) -> None:
+        kept = [watchpoint for watchpoint in self.watchpoints if watchpoint.start != start]
+        if len(kept) == len(self.watchpoints):
+            raise DebuggerError("No watchpoint at 0x%04X" % start)
+        self.watchpoints = kept
+        self._update_loop()
+
+    def pause(self, event: BreakEvent) -> None:
+        self.paused = True
+        self.last_event = event
+
+    def resume(self) -> None:
+        self._resume_pc = self.cpu.pc
+        self.paused = False
+
+    def step(self) -> BreakEvent:
+        """ Executes a single instruction, stopping on watchpoints too """
+        cpu = self.cpu
+        if cpu.wait_for_key_reg is not None:
+            event = BreakEvent('step', cpu.pc, "waiting for a key press")
+        else:
+            event = self._execute() or BreakEvent('step', cpu.pc)
+        self.pause(event)
+        return event
+
+    def step_over(self) -> Optional[BreakEvent]:
+        """ Steps over subroutine calls: returns None if the call needs to run before pausing again """
+        cpu = self.cpu
+        if cpu.opcode_at(cpu.pc) >> 12 != 0x2:
+            return self.step()
+        self._step_over = ((cpu.pc + CPU.PC_INCREMENT_SIZE) % MEMORY_SIZE, cpu.sp)
+        self._update_loop()
+        self.resume()
+        return None
+
+    def _should_break(self, pc: int) -> Optional[BreakEvent]:
+        if self._step_over is not None and self._step_over == (pc, self.cpu.sp):
+            self._step_over = None
+            self._update_loop()
+            return BreakEvent('step', pc)
+        point = self.breakpoints.get(pc)
+        if point is None or (point.condition is not None and not point.condition.matches(self.cpu)):
+            return None
+        return BreakEvent('breakpoint', pc, str(point.condition) if point.condition else '')
+
+    def _execute(self) -> Optional[BreakEvent]:
+        """ Executes the instruction at PC, returning an event if it wrote to a watched range """
+        cpu = self.cpu
+        pc = cpu.pc
+        written = memory_write_ranges(cpu, cpu.opcode_at(pc)) if self.watchpoints else []
+        # Part of a written range in a watched range
+        watched = next(((max(w.start, start), min(w.end, end)) for start, end in written
+            for w in self.watchpoints if w.start < end and start < w.end), None)
+        if watched is None:
+            cpu.execute_cycle()
+            return None
+
+        start, end = watched
+        before = bytes(cpu.memory[start:end])
+        cpu.execute_cycle()
+        after = bytes(cpu.memory[start:end])
+        return BreakEvent('watchpoint', pc, "0x%04X-0x%04X: %s -> %s" % (start, end - 1, before.hex(' '), after.hex(' ')))
+
+    def _run_cycles(self, count: int) -> None:
+        """ Replacement of CPU.run_cycles checking breakpoints and watchpoints """
+        for _ in range(count):
+            if self.paused:
+                return
+            pc = self.cpu.pc
+            if pc != self._resume_pc:
+                event = self._should_break(pc)
+                if event is not None:
+                    self.pause(event)
+                    return
+            self._resume_pc = None
+            event = self._execute()
+            if event is not None:
+                self.pause(event)
+                return
+
+
+class DebuggerConsole(cmd.Cmd):
+    """ Interactive debugger driving an emulator frame by frame """
+
+    intro = "Chip8 debugger, type help or ? to list commands"
+    prompt = '(chip8) '
+
+    def __init__(self, emulator: Emulator) -> None:
+        super().__init__()
+        self.emulator = emulator
+        self.cpu = emulator.cpu
+        self.debugger = Debugger(emulator.cpu)
+        self.running = True
+
+    def onecmd(self, line: str) -> bool:
+        try:
+            return super().onecmd(line)
+        except DebuggerError as e:
+            print(e)
+            return False
+
+    def _where(self) -> str:
+        cpu = self.cpu
+        opcode = cpu.opcode_at(cpu.pc)
+        return "0x%04X: %04X  %s" % (cpu.pc, opcode, cpu.decode(opcode).__name__)
+
+    def _run(self, frames: Optional[int]) -> None:
+        """ Runs frames until the debugger pauses, the window is closed or Ctrl-C """
+        step = 1.0 / self.emulator.fps
+        count = 0
+        previous_event = self.debugger.last_event
+        try:
+            while self.running and not self.debugger.paused and (frames is None or count < frames):
+                start = perf_counter()
+                self.running = self.emulator.run_frame()
+                count += 1
+                if not self.emulator.engine.headless:
+                    sleep(max(0, step - (perf_counter() - start)))
+        except KeyboardInterrupt:
+            pass
+        self.debugger.paused = True
+        if self.debugger.last_event is not previous_event and self.debugger.last_event.reason != 'step':
+            print(self.debugger.last_event)
+        print(self._where())
+
+    def do_break(self, arg: str) -> None:
+        """ break ADDRESS [if vX OP VALUE]: pause before executing the instruction at ADDRESS """
+        address, _, condition = arg.partition(' if ')
+        point = self.debugger.add_breakpoint(parse_number(address.strip()), RegisterCondition.parse(condition) if condition else None)
+        print("Breakpoint at 0x%04X%s" % (point.address, " if %s" % point.condition if point.condition else ''))
+
+    def do_delete(self, arg: str) -> None:
+        """ delete ADDRESS: remove the breakpoint at ADDRESS """
+        self.debugger.remove_breakpoint(parse_number(arg))
+
+    def do_watch(self, arg: str) -> None:
+        """ watch START [END]: pause after instructions writing to memory from START to END (included) """
+        bounds = arg.split()
+        if not bounds:
+            raise DebuggerError("watch needs a start address")
+        start = parse_number(bounds[0])
+        watchpoint = self.debugger.add_watchpoint(start, parse_number(bounds[1]) + 1 if len(bounds) > 1 else None)
+        print("Watching 0x%04X-0x%04X" % (watchpoint.start, watchpoint.end - 1))
+
+    def do_unwatch(self, arg: str) -> None:
+        """ unwatch START: remove the watchpoint starting at START """
+        self.debugger.remove_watchpoint(parse_number(arg))
+
+    def do_info(self, _: str) -> None:
+        """ info: list breakpoints and watchpoints """
+        for point in self.debugger.breakpoints.values():
+            print("break 0x%04X%s" % (point.address, " if %s" % point.condition if point.condition else ''))
+        for watchpoint in self.debugger.watchpoints:
+            print("watch 0x%04X-0x%04X" % (watchpoint.start, watchpoint.end - 1))
+
+    def do_step(self, _: str) -> None:
+        """ step: execute one instruction """
+        event = self.debugger.step()
+        if event.reason != 'step' or event.detail:
+            print(event)
+        print(self._where())
+
+    def do_next(self, _: str) -> None:
+        """ next: execute one instruction, running subroutine calls until they return """
+        event = self.debugger.step_over()
+        if event is None:
+            self._run(None)
+        else:
+            print(self._where())
+
+    def do_continue(self, arg: str) -> None:
+        """ continue [FRAMES]: run until a breakpoint or watchpoint, at most FRAMES frames """
+        self.debugger.resume()
+        self._run(parse_number(arg) if arg else None)
+
+    def do_regs(self, _: str) -> None:
+        """ regs: show the registers """
+        cpu = self.cpu
+        print(' '.join("V%X=%02X" % (index, value) for index, value in enumerate(cpu.registers)))
+        print("I=%04X PC=%04X SP=%X DT=%02X ST=%02X" % (cpu.i, cpu.pc, cpu.sp, cpu.delay_timer, cpu.sound_timer))
+
+    def do_mem(self, arg: str) -> None:
+        """ mem ADDRESS [LENGTH]: dump memory """
+        fields = arg.split()
+        if not fields:
+            raise DebuggerError("mem needs an address")
+        address = parse_number(fields[0])
+        length = parse_number(fields[1]) if len(fields) > 1 else 0x40
+        for offset in range(address, address + length, 0x10):
+            print("%04X: %s" % (offset, self.cpu.memory[offset:min(offset + 0x10, address + length)].hex(' ')))
+
+    def do_screen(self, _: str) -> None:
+        """ screen: print the framebuffer """
+        print(dump_frame(self.cpu.renderer.planes))
+
+    def do_quit(self, _: str) -> bool:
+        """ quit: stop debugging """
+        self.debugger.detach()
+        return True
+
+    do_b, do_s, do_n, do_c, do_q = do_break, do_step, do_next, do_continue, do_quit
+    do_EOF = do_quit
+
+
+def debug(rom_path: str, cpu_cycles_per_frame: int, engine: str = 'pyglet', quirks: Optional[str] = None) -> None:
+    emulator = Emulator(cpu_cycles_per_frame, decode_cache=DecodeCache(), engine=engine, quirks=quirks)
+    emulator.load_rom(rom_path)
+    emulator.engine.start()
+    try:
+        DebuggerConsole(emulator).cmdloop()
+    finally:
+        emulator.cpu.save_decode_cache()
@@ -0,0 +1,94 @@
+import json
+import logging
+import os
+from typing import NamedTuple, Optional
+from app import __version__
+
+DEFAULT_CACHE_DIRECTORY: str = os.path.join(os.path.expanduser('~'), '.cache', 'pychip8', 'decoded')
+DEFAULT_CACHE_MAX_SIZE: int = 16 * 1024 * 1024 # bytes
+
+
+class DecodedRom(NamedTuple):
+    # address -> (opcode, handler name)
+    instructions: dict[int, tuple[int, str]]
+
+
+class DecodeCache:
+    """
+        Persistent cache of the instructions decoded while running a ROM, keyed by ROM SHA-1 and emulator version.
+        Files are evicted least recently used first once the directory grows over max_size bytes.
+        Decoding an instruction is cheap: warm starting from an entry takes about as long as decoding the
+        instructions again, the entry mostly records which addresses of the ROM ran as instructions.
+    """
+
+    def __init__(self, 
+        directory: str = DEFAULT_CACHE_DIRECTORY, 
+        max_size: int = DEFAULT_CACHE_MAX_SIZE, 
+        version: str = __version__) -> None:
+        self.directory = directory
+        self.max_size = max_size
+        self.version = version
+
+    def path(self, sha1: str) -> str:
+        return os.path.join(self.directory, '%s-%s.json' % (sha1, self.version))
+
+    def load(self, sha1: str) -> Optional[DecodedRom]:
+        path = self.path(sha1)
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+            if data['sha1'] != sha1 or data['version'] != self.version:
+                raise ValueError("cache entry doesn't match its key")
+            instructions = {int(address): (int(opcode), str(name)) for address, opcode, name in data['instructions']}
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logging.warning("Dropping invalid decode cache entry %s: %s" % (path, e))
+            self._remove(path)
+            return None
+
+        # Mark as recently used for the LRU eviction. Another process may have evicted it since it was read
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return DecodedRom(instructions)
+
+    def store(self, sha1: str, decoded_rom: DecodedRom) -> None:
+        data = {
+            'sha1': sha1,
+            'version': self.version,
+            'instructions': [[address, opcode, name] for address, (opcode, name) in sorted(decoded_rom.instructions.items())],
+        }
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(sha1)
+        # Write then rename so concurrent workers never read a partial file
+        temporary_path = '%s.%d.tmp' % (path, os.getpid())
+        with open(temporary_path, 'w') as f:
+            json.dump(data, f, separators=(',', ':'))
+        os.replace(temporary_path, path)
+        self.evict()
+
+    def evict(self) -> None:
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.json'):
+                path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            self._remove(path)
+            total_size -= size
+
+    def _remove(self, path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
@@ -1,10 +1,16 @@
-from time import sleep, time
-from typing import Tuple
+from time import perf_counter, sleep, time
+from typing import Optional, Tuple
+from app.autotune import CycleTuner
 from app.constants import SCREEN_SIZE
 from app.cpu import CPU
+from app.decode_cache import DecodeCache
+from app.engine import create_engine_handler
 from app.engine.engine_handler import EngineHandler
-from app.engine.pyglet_engine_handler import PygletEngineHandler
+from app.input_recording import InputRecorder
 from app.keyboard import Keyboard
+from app.metrics import EmulatorMetrics
+from app.quirks import get_quirks, load_quirks_database, profile_for_rom
+from app.recorder import FrameRecorder
 from app.renderer import Renderer
 
 import logging
@@ -19,41 +25,157 @@ class Emulator:
         scale: int = 10, 
         color: Tuple[int, int, int] = (200, 40, 40), 
         sound: int = 440, 
-        fps: int = 60) -> None:
+        fps: int = 60,
+        decode_cache: Optional[DecodeCache] = None,
+        engine: str = 'pyglet',
+        recorder: Optional[FrameRecorder] = None,
+        quirks: Optional[str] = None,
+        target_ips: Optional[int] = None,
+        metrics: Optional[EmulatorMetrics] = None,
+        input_recorder: Optional[InputRecorder] = None) -> None:
 
-        logging.basicConfig(level=logging.INFO)
-        
         self.fps = fps
-        self.engine: EngineHandler = PygletEngineHandler(size=SCREEN_SIZE * scale)
+        self.recorder = recorder
+        self.input_recorder = input_recorder
+        # Quirks profile name, None to pick it from each ROM
+        if quirks is not None:
+            get_quirks(quirks)
+        self.quirks = quirks
+        # Cycles per frame are tuned to hold target_ips instructions per second when set
+        self.tuner: Optional[CycleTuner] = CycleTuner(target_ips, fps) if target_ips else None
+        self.metrics = metrics
+        # Startup durations in seconds, see startup_report()
+        self.timings: dict[str, float] = {}
+
+        start = perf_counter()
+        self.engine: EngineHandler = create_engine_handler(engine, SCREEN_SIZE * scale)
+        self.timings['engine'] = perf_counter() - start
         
         renderer: Renderer = Renderer(self.engine, scale, color)
         keyboard: Keyboard = Keyboard(self.engine)
         speaker: Speaker = Speaker(self.engine, sound)
 
-        self.cpu: CPU = CPU(cpu_cycles_per_frame, renderer, keyboard, speaker)
+        self.cpu: CPU = CPU(cpu_cycles_per_frame, renderer, keyboard, speaker, decode_cache)
+
+        if metrics is not None:
+            self.engine.keydown(metrics.record_input)
+            self.engine.keyup(metrics.record_input)
+            metrics.fusion_stats = self.cpu.fusion_stats
 
 
     def run_rom(self, rom_path: str) -> None:
         logging.info('Running rom %s' % rom_path)
-        self.cpu.load_rom(rom_path)
+        start = perf_counter()
+        self.load_rom(rom_path)
+        self.timings['rom_load'] = perf_counter() - start
         self.engine.start()
-        self.main_loop()
+        try:
+            self.main_loop()
+        finally:
+            self.cpu.save_decode_cache()
+            if self.recorder is not None:
+                self.recorder.close()
+            if self.input_recorder is not None:
+                self.input_recorder.close()
+
+    def load_rom(self, rom_path: str) -> None:
+        with open(rom_path, 'rb') as f:
+            rom = f.read()
+        profile = self.quirks_profile(rom)
+        logging.info("Using %s quirks" % profile)
+        self.cpu.set_quirks(get_quirks(profile))
+        self.cpu.load_rom_bytes(rom)
+        if self.input_recorder is not None:
+            self.input_recorder.start(self.cpu, rom)
+        logging.info("Loaded rom %s" % rom_path)
+
+    def quirks_profile(self, rom: bytes) -> str:
+        """ Profile given to the emulator, else the one picked for the ROM """
+        return self.quirks or profile_for_rom(rom, load_quirks_database())
+
+    def startup_report(self) -> str:
+        labels = {
+            'import': 'Import',
+            'engine': 'Engine creation',
+            'rom_load': 'ROM load',
+            'first_frame': 'First frame',
+        }
+        lines = ["%-16s %8.2f ms" % (label, self.timings[key] * 1000) for key, label in labels.items() if key in self.timings]
+        lines.append("%-16s %8.2f ms" % ('Total', sum(self.timings.values()) * 1000))
+        return '\n'.join(lines)
+
+    def run_frame(self) -> bool:
+        """ Runs the logic of one frame, returns False once the engine wants to quit """
+        start = perf_counter()
+        running = self.engine.update()
+        engine_time = perf_counter() - start
+        if self.input_recorder is not None:
+            self.input_recorder.capture()
+        if self.tuner is None:
+            cycles, cpu_time, render_time = self._run_cpu_frame()
+        else:
+            cycles, cpu_time, render_time = self._run_tuned_frame(self.tuner)
+        if self.recorder is not None:
+            self.recorder.capture(self.cpu.renderer.planes)
+        if self.metrics is not None:
+            self.metrics.record_frame(cycles, engine_time, cpu_time, render_time or 0.0, self.cpu.sound_timer > 0)
+        return running
+
+    def _run_cpu_frame(self) -> Tuple[int, float, Optional[float]]:
+        """ Returns the cycles run, and the CPU and render times of the frame """
+        cpu = self.cpu
+        waiting = cpu.wait_for_key_reg is not None
+        start = perf_counter()
+        cpu.update()
+        cpu_time = perf_counter() - start
+        start = perf_counter()
+        cpu.renderer.render()
+        return 0 if waiting else cpu.cycles_per_frame, cpu_time, perf_counter() - start
+
+    def _run_tuned_frame(self, tuner: CycleTuner) -> Tuple[int, float, Optional[float]]:
+        cpu = self.cpu
+        cpu.cycles_per_frame = tuner.cycles_per_frame
+        waiting = cpu.wait_for_key_reg is not None
+        start = perf_counter()
+        cpu.update()
+        cpu_time = perf_counter() - start
+
+        render_time = None
+        if tuner.should_render():
+            start = perf_counter()
+            cpu.renderer.render()
+            render_time = perf_counter() - start
+        cycles = 0 if waiting else cpu.cycles_per_frame
+        tuner.record(cycles, cpu_time, render_time)
+        return cycles, cpu_time, render_time
 
     def main_loop(self) -> None:
         step = 1.0 / self.fps
 
         running = True
+        first_frame = True
+        frame = 0
+        last_report = None
         while running:
             start = time()
 
-            # Do logic
-            running = self.engine.update()
-            self.cpu.update()
-            self.cpu.renderer.render()
+            running = self.run_frame()
 
             end = time()
             elapsed = end - start
+            if first_frame:
+                self.timings['first_frame'] = elapsed
+                logging.info("Startup times:\n%s" % self.startup_report())
+                first_frame = False
+            frame += 1
+            if self.tuner is not None and frame % self.fps == 0:
+                # Report the tuned rate once per second when it changed
+                report = (self.tuner.cycles_per_frame, self.tuner.render_interval)
+                if report != last_report:
+                    logging.info("Auto-tune: %s" % self.tuner.report())
+                    last_report = report
             wait = step - elapsed
             if wait > 0:
                 sleep(wait)
-    
\ No newline at end of file
+        if self.cpu.fusion:
+            logging.info("Fused instructions: %s" % ', '.join('%s %d' % item for item in self.cpu.fusion_stats.items()))
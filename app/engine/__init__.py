@@ -0,0 +1,28 @@
+import importlib
+from typing import Type
+from app.engine.engine_handler import EngineHandler
+from app.engine.vector2 import Vector2
+
+# Backends are only imported when requested, so the core never pulls in a GUI library
+ENGINE_BACKENDS: dict[str, str] = {
+    'pyglet': 'app.engine.pyglet_engine_handler:PygletEngineHandler',
+    'headless': 'app.engine.headless_engine_handler:HeadlessEngineHandler',
+    'terminal': 'app.engine.terminal_engine_handler:TerminalEngineHandler',
+    'terminal-quadrant': 'app.engine.terminal_engine_handler:QuadrantTerminalEngineHandler',
+    'terminal-braille': 'app.engine.terminal_engine_handler:BrailleTerminalEngineHandler',
+}
+
+
+class UnknownEngineError(ValueError):
+    pass
+
+
+def get_engine_handler_class(name: str) -> Type[EngineHandler]:
+    if name not in ENGINE_BACKENDS:
+        raise UnknownEngineError("Unknown engine %s, available engines: %s" % (name, ', '.join(ENGINE_BACKENDS)))
+    module_name, class_name = ENGINE_BACKENDS[name].split(':')
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def create_engine_handler(name: str, size: Vector2) -> EngineHandler:
+    return get_engine_handler_class(name)(size=size)
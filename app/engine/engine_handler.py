@@ -6,6 +6,9 @@ from app.key import Key
 KeyPressedFunc = Callable[[Key], None]
 
 class EngineHandler(ABC):
+    # Engines that never display anything, the renderer skips building shapes for them
+    headless: bool = False
+
     def __init__(self, size: Vector2) -> None:
         self.size = size
         self.keydown_callbacks: list[KeyPressedFunc] = []
@@ -31,6 +34,13 @@ class EngineHandler(ABC):
     def play_sound(self, frequency: int) -> None:
         pass
     
+    def play_pattern(self, pattern: bytes, sample_rate: float) -> None:
+        """
+            Plays a XO-CHIP 1-bit audio pattern in loop, sampled at sample_rate bits per second.
+            Engines without sample playback fall back to a plain square wave.
+        """
+        self.play_sound(int(sample_rate / 16))
+
     @abstractmethod
     def stop_sound(self) -> None:
         pass
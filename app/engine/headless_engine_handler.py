@@ -0,0 +1,40 @@
+from typing import Tuple
+from app.engine.engine_handler import EngineHandler
+from app.engine.vector2 import Vector2
+from app.key import Key
+
+class HeadlessEngineHandler(EngineHandler):
+    """ Engine without any window or sound, for batch runs and tests. Input is injected with press/release """
+    headless = True
+
+    def __init__(self, size: Vector2) -> None:
+        super().__init__(size=size)
+        self.open: bool = True
+        self.sound_playing: bool = False
+
+    def start(self) -> None:
+        pass
+
+    def clear_window(self) -> None:
+        pass
+
+    def draw_rect(self, pos: Vector2, size: Vector2, color: Tuple[int, int, int]) -> None:
+        pass
+
+    def draw(self) -> None:
+        pass
+
+    def play_sound(self, frequency: int) -> None:
+        self.sound_playing = True
+
+    def stop_sound(self) -> None:
+        self.sound_playing = False
+
+    def update(self) -> bool:
+        return self.open
+
+    def press(self, key: Key) -> None:
+        self._handle_key_press(key)
+
+    def release(self, key: Key) -> None:
+        self._handle_key_press(key, down=False)
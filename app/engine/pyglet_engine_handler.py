@@ -1,8 +1,9 @@
 
-from typing import Tuple
+from typing import Optional, Tuple
 import pyglet
 import logging
 
+from pyglet.media.codecs.base import AudioFormat, StaticMemorySource
 from pyglet.media.player import Player
 
 from app.engine.engine_handler import EngineHandler
@@ -47,6 +48,7 @@ class PygletEngineHandler(EngineHandler):
         self.sound_player.loop = True
         self.shapes: list = []
         self.open: bool = True
+        self.pattern: Optional[Tuple[bytes, float]] = None
 
         @self.window.event
         def on_key_press(symbol, _):
@@ -80,6 +82,7 @@ class PygletEngineHandler(EngineHandler):
 
     def draw(self) -> None:
         logging.debug("Drawing shapes")
+        self.window.clear()
         self.batch.draw()
 
     def play_sound(self, frequency: int) -> None:
@@ -88,8 +91,22 @@ class PygletEngineHandler(EngineHandler):
         if not self.sound_player.playing:
             self.sound_player.queue(sound)
             self.sound_player.play()
+
+    def play_pattern(self, pattern: bytes, sample_rate: float) -> None:
+        """ Plays a 1-bit pattern in loop, each bit being one 8-bit unsigned sample """
+        if self.sound_player.playing and self.pattern == (pattern, sample_rate):
+            return
+
+        if self.sound_player.playing:
+            self.stop_sound()
+        samples = bytes(0xFF if (byte >> (7 - bit)) & 1 else 0x00 for byte in pattern for bit in range(8))
+        sound = StaticMemorySource(samples, AudioFormat(channels=1, sample_size=8, sample_rate=int(sample_rate)))
+        self.pattern = (pattern, sample_rate)
+        self.sound_player.queue(sound)
+        self.sound_player.play()
     
     def stop_sound(self) -> None:
+        self.pattern = None
         self.sound_player.next_source()
         self.sound_player.pause()
     
@@ -0,0 +1,252 @@
+import atexit
+import logging
+import os
+import select
+import sys
+from time import monotonic
+from typing import Optional, TextIO, Tuple
+from app.constants import SCREEN_SIZE
+from app.engine.engine_handler import EngineHandler
+from app.engine.vector2 import Vector2
+from app.key import Key
+
+try:
+    import termios
+    import tty
+except ImportError: # Not a Unix system
+    termios = tty = None
+
+Color = Tuple[int, int, int]
+Cell = Tuple[str, Optional[Color], Color] # Character, foreground and background colors
+
+BACKGROUND: Color = (0, 0, 0)
+UPPER_HALF_BLOCK: str = '▀'
+BRAILLE_BASE: int = 0x2800
+# Braille dot bits by (x, y) position in a 2x4 cell
+BRAILLE_DOTS: dict[Tuple[int, int], int] = {
+    (0, 0): 0x01, (0, 1): 0x02, (0, 2): 0x04, (0, 3): 0x40,
+    (1, 0): 0x08, (1, 1): 0x10, (1, 2): 0x20, (1, 3): 0x80,
+}
+# Quadrant block characters by the pixels they light: 1 top left, 2 top right, 4 bottom left, 8 bottom right
+QUADRANT_BLOCKS: str = ' ▘▝▀▖▌▞▛▗▚▐▜▄▙▟█'
+# Terminals only report key presses, repeated while a key is held: after the first press, a key is released once
+# no press of it came for longer than the delay before the terminal repeats keys (250 to 600 ms usually).
+# Once it repeats, presses come every 30 to 50 ms and the key is released after a shorter time
+KEY_REPEAT_DELAY: float = 0.65 # Seconds
+KEY_HOLD_TIME: float = 0.15 # Seconds
+# Pixels per cell of each mode
+CELL_SIZES: dict[str, Vector2] = {'half': Vector2(1, 2), 'quadrant': Vector2(2, 2), 'braille': Vector2(2, 4)}
+QUIT_CHARACTER: str = '\x1b' # Escape, on its own
+
+# Usual CHIP-8 layout on a QWERTY keyboard
+TERMINAL_KEYS: dict[str, Key] = {
+    '1': Key.ONE, '2': Key.TWO, '3': Key.THREE, '4': Key.C,
+    'q': Key.FOUR, 'w': Key.FIVE, 'e': Key.SIX, 'r': Key.D,
+    'a': Key.SEVEN, 's': Key.EIGHT, 'd': Key.NINE, 'f': Key.E,
+    'z': Key.A, 'x': Key.ZERO, 'c': Key.B, 'v': Key.F,
+}
+
+
+def _foreground(color: Color) -> str:
+    return '\x1b[38;2;%d;%d;%dm' % color
+
+
+def _background(color: Color) -> str:
+    return '\x1b[48;2;%d;%d;%dm' % color
+
+
+class TerminalEngineHandler(EngineHandler):
+    """
+        Draws the screen in a terminal with 24-bit ANSI colors, for SSH sessions and boxes without a display.
+        In 'half' mode a cell holds two pixels stacked with a half block (64x16 cells), in 'quadrant' mode
+        2x2 pixels with a quadrant block (32x16 cells), in 'braille' mode a 2x4 pixels braille pattern (32x8 cells).
+        Quadrant and braille cells have one color.
+        Each frame only the changed cells are written, as a single write of cursor moves and characters.
+        Keys are read from stdin in cbreak mode.
+    """
+
+    def __init__(self,
+        size: Vector2,
+        mode: str = 'half',
+        output: Optional[TextIO] = None,
+        input_fd: Optional[int] = None,
+        key_repeat_delay: float = KEY_REPEAT_DELAY,
+        key_hold_time: float = KEY_HOLD_TIME) -> None:
+        super().__init__(size=size)
+        if mode not in CELL_SIZES:
+            raise ValueError("Unknown terminal mode %r, expected one of %s" % (mode, ', '.join(CELL_SIZES)))
+        self.mode = mode
+        self.cell_size = CELL_SIZES[mode]
+        self.columns = SCREEN_SIZE.x // self.cell_size.x
+        self.lines = SCREEN_SIZE.y // self.cell_size.y
+        self.scale = max(1, size.x // SCREEN_SIZE.x)
+        self.output: TextIO = output or sys.stdout
+        self.input_fd = input_fd
+        self.key_repeat_delay = key_repeat_delay
+        self.key_hold_time = key_hold_time
+
+        self.pixels: list[list[Optional[Color]]] = [[None] * SCREEN_SIZE.x for _ in range(SCREEN_SIZE.y)]
+        self.cells: list[list[Optional[Cell]]] = [[None] * self.columns for _ in range(self.lines)]
+        self.changed = True
+        self.open: bool = True
+        self.sound_playing: bool = False
+        self.bytes_written = 0
+        # Time of the last press of each held key, and whether the terminal repeats it already
+        self._held_keys: dict[Key, Tuple[float, bool]] = {}
+        self._terminal_attributes: Optional[list] = None
+
+    def start(self) -> None:
+        if termios is None:
+            logging.warning("No keyboard input, terminal input needs a Unix system")
+        else:
+            try:
+                if self.input_fd is None:
+                    self.input_fd = sys.stdin.fileno()
+                self._terminal_attributes = termios.tcgetattr(self.input_fd)
+                tty.setcbreak(self.input_fd)
+            except (OSError, termios.error) as e:
+                logging.warning("No keyboard input, stdin is not a terminal: %s" % e)
+        atexit.register(self.restore_terminal)
+        # Hide the cursor and clear the screen
+        self._write('\x1b[?25l\x1b[2J')
+
+    def restore_terminal(self) -> None:
+        if self._terminal_attributes is not None:
+            termios.tcsetattr(self.input_fd, termios.TCSADRAIN, self._terminal_attributes)
+            self._terminal_attributes = None
+        self._write('\x1b[0m\x1b[%d;1H\x1b[?25h\n' % (self.lines + 1))
+
+    def _write(self, text: str) -> None:
+        self.output.write(text)
+        self.output.flush()
+        self.bytes_written += len(text.encode())
+
+    def clear_window(self) -> None:
+        for row in self.pixels:
+            row[:] = [None] * SCREEN_SIZE.x
+        self.changed = True
+
+    def draw_rect(self, pos: Vector2, size: Vector2, color: Tuple[int, int, int]) -> None:
+        # The renderer scales its rectangles to the window size, back to pixels
+        x, y = pos.x // self.scale, pos.y // self.scale
+        row = self.pixels[y]
+        row[x:x + size.x // self.scale] = [color] * (size.x // self.scale)
+        self.changed = True
+
+    def _cell(self, column: int, line: int) -> Cell:
+        x, y = column * self.cell_size.x, line * self.cell_size.y
+        if self.mode == 'half':
+            top, bottom = self.pixels[y][x], self.pixels[y+1][x]
+            if top == bottom:
+                return (' ', None, top or BACKGROUND)
+            return (UPPER_HALF_BLOCK, top or BACKGROUND, bottom or BACKGROUND)
+
+        if self.mode == 'quadrant':
+            quadrants = 0
+            color = None
+            for bit, (dx, dy) in enumerate(((0, 0), (1, 0), (0, 1), (1, 1))):
+                pixel = self.pixels[y+dy][x+dx]
+                if pixel is not None:
+                    quadrants |= 1 << bit
+                    color = color or pixel
+            if not quadrants:
+                return (' ', None, BACKGROUND)
+            return (QUADRANT_BLOCKS[quadrants], color, BACKGROUND)
+
+        dots = 0
+        color = None
+        for (dx, dy), bit in BRAILLE_DOTS.items():
+            pixel = self.pixels[y+dy][x+dx]
+            if pixel is not None:
+                dots |= bit
+                color = color or pixel
+        if not dots:
+            return (' ', None, BACKGROUND)
+        return (chr(BRAILLE_BASE + dots), color, BACKGROUND)
+
+    def frame_update(self) -> str:
+        """ Escape sequences and characters redrawing the cells changed since the last call """
+        parts = []
+        cursor = None
+        foreground = background = None
+        for line in range(self.lines):
+            previous_cells = self.cells[line]
+            for column in range(self.columns):
+                cell = self._cell(column, line)
+                if cell == previous_cells[column]:
+                    continue
+                previous_cells[column] = cell
+                if cursor != (line, column):
+                    parts.append('\x1b[%d;%dH' % (line + 1, column + 1))
+                character, cell_foreground, cell_background = cell
+                if cell_foreground is not None and cell_foreground != foreground:
+                    parts.append(_foreground(cell_foreground))
+                    foreground = cell_foreground
+                if cell_background != background:
+                    parts.append(_background(cell_background))
+                    background = cell_background
+                parts.append(character)
+                cursor = (line, column + 1)
+        if parts:
+            parts.append('\x1b[0m')
+        return ''.join(parts)
+
+    def draw(self) -> None:
+        if not self.changed:
+            return
+        self.changed = False
+        update = self.frame_update()
+        if update:
+            self._write(update)
+
+    def play_sound(self, frequency: int) -> None:
+        # Terminals can only ring their bell, once when the sound starts
+        if not self.sound_playing:
+            self._write('\a')
+        self.sound_playing = True
+
+    def stop_sound(self) -> None:
+        self.sound_playing = False
+
+    def read_input(self, characters: str, now: float) -> None:
+        if characters == QUIT_CHARACTER:
+            self.open = False
+            return
+        for character in characters.lower():
+            key = TERMINAL_KEYS.get(character)
+            if key is None:
+                continue
+            if key not in self._held_keys:
+                self._handle_key_press(key)
+                self._held_keys[key] = (now, False)
+            else:
+                self._held_keys[key] = (now, True)
+
+    def release_keys(self, now: float) -> None:
+        for key, (pressed, repeating) in list(self._held_keys.items()):
+            if now - pressed > (self.key_hold_time if repeating else self.key_repeat_delay):
+                del self._held_keys[key]
+                self._handle_key_press(key, down=False)
+
+    def update(self) -> bool:
+        if not self.open:
+            return False
+        now = monotonic()
+        if self._terminal_attributes is not None and select.select([self.input_fd], [], [], 0)[0]:
+            self.read_input(os.read(self.input_fd, 64).decode(errors='ignore'), now)
+        self.release_keys(now)
+        return self.open
+
+
+class QuadrantTerminalEngineHandler(TerminalEngineHandler):
+    """ Terminal engine drawing 2x2 pixels per cell, for terminals smaller than 64 columns """
+
+    def __init__(self, size: Vector2) -> None:
+        super().__init__(size=size, mode='quadrant')
+
+
+class BrailleTerminalEngineHandler(TerminalEngineHandler):
+    """ Terminal engine drawing 2x4 pixels per cell, for terminals smaller than 16 lines """
+
+    def __init__(self, size: Vector2) -> None:
+        super().__init__(size=size, mode='braille')
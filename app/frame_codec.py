@@ -0,0 +1,94 @@
+import struct
+from itertools import groupby
+from typing import Optional, Sequence
+from app.constants import PLANE_COUNT, SCREEN_SIZE
+
+FrameRows = Sequence[Sequence[int]] # Renderer.planes layout: rows of packed pixels for each plane
+
+DELTA_FRAME: int = 0x01 # Only the rows that changed since the previous frame
+KEY_FRAME: int = 0x02   # Every row, sent to clients that have no previous frame
+
+# Message type, frame number, number of encoded rows
+FRAME_HEADER = struct.Struct('>BIH')
+# Plane, row index, number of runs
+ROW_HEADER = struct.Struct('>BBB')
+
+
+class FrameCodecError(ValueError):
+    pass
+
+
+def encode_row(row: int) -> bytes:
+    """
+        Run-length encodes a packed row as alternating run lengths, starting with unset pixels.
+        A row starting with a set pixel therefore starts with an empty run.
+    """
+    bits = format(row, '0%db' % SCREEN_SIZE.x)
+    runs = [len(list(group)) for _, group in groupby(bits)]
+    if bits[0] == '1':
+        runs.insert(0, 0)
+    return bytes(runs)
+
+
+def decode_row(runs: bytes) -> int:
+    row = 0
+    value = 0
+    for length in runs:
+        row = (row << length) | (((1 << length) - 1) if value else 0)
+        value ^= 1
+    return row
+
+
+def copy_frame(planes: FrameRows) -> list[list[int]]:
+    return [list(rows) for rows in planes]
+
+
+def empty_frame() -> list[list[int]]:
+    return [[0] * SCREEN_SIZE.y for _ in range(PLANE_COUNT)]
+
+
+def encode_frame(frame_number: int, planes: FrameRows, previous: Optional[FrameRows] = None) -> bytes:
+    """ Encodes the rows of planes that differ from previous, or a key frame when previous is None """
+    chunks = []
+    for plane, rows in enumerate(planes):
+        for y, row in enumerate(rows):
+            if previous is None or previous[plane][y] != row:
+                runs = encode_row(row)
+                chunks.append(ROW_HEADER.pack(plane, y, len(runs)) + runs)
+
+    message_type = KEY_FRAME if previous is None else DELTA_FRAME
+    return FRAME_HEADER.pack(message_type, frame_number, len(chunks)) + b''.join(chunks)
+
+
+class FrameDecoder:
+    """ Rebuilds frames from a stream of encoded messages """
+
+    def __init__(self) -> None:
+        self.planes = empty_frame()
+        self.frame_number: Optional[int] = None
+
+    def apply(self, message: bytes) -> int:
+        """ Applies a message and returns its frame number """
+        if len(message) < FRAME_HEADER.size:
+            raise FrameCodecError("Truncated frame header")
+        message_type, frame_number, count = FRAME_HEADER.unpack_from(message, 0)
+        if message_type == KEY_FRAME:
+            self.planes = empty_frame()
+        elif message_type != DELTA_FRAME:
+            raise FrameCodecError("Unknown frame type %d" % message_type)
+        elif self.frame_number is None:
+            raise FrameCodecError("Delta frame received before any key frame")
+
+        offset = FRAME_HEADER.size
+        for _ in range(count):
+            if offset + ROW_HEADER.size > len(message):
+                raise FrameCodecError("Truncated row header")
+            plane, y, run_count = ROW_HEADER.unpack_from(message, offset)
+            offset += ROW_HEADER.size
+            if plane >= PLANE_COUNT or y >= SCREEN_SIZE.y or offset + run_count > len(message):
+                raise FrameCodecError("Invalid row %d of plane %d" % (y, plane))
+            self.planes[plane][y] = decode_row(message[offset:offset + run_count])
+            offset += run_count
+
+        self.frame_number = frame_number
+        return frame_number
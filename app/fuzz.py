@@ -0,0 +1,570 @@
+import argparse
+import logging
+import random
+from abc import ABC, abstractmethod
+from concurrent.futures import ProcessPoolExecutor
+from string import hexdigits
+from time import perf_counter
+from typing import Iterator, NamedTuple, Optional, Sequence
+from app.constants import AUDIO_DEFAULT_PITCH, AUDIO_PATTERN_SIZE, DEFAULT_SPRITES, MEMORY_PROGRAM_START, MEMORY_SIZE, PLANE_COUNT, REGISTER_COUNT, SCREEN_SIZE, SPRITE_BYTE_SIZE, STACK_SIZE
+from app.cpu import CPU, StackOverflowError, StackUnderflowError
+from app.engine.headless_engine_handler import HeadlessEngineHandler
+from app.frame_codec import empty_frame
+from app.key import Key
+from app.keyboard import Keyboard
+from app.renderer import Renderer
+from app.speaker import Speaker
+
+# Generated data is loaded after the program, which is at most MAX_PROGRAM_LENGTH words long
+DATA_START: int = 0x300
+MAX_PROGRAM_LENGTH: int = 0x40
+MAX_DATA_SIZE: int = 0x40
+# Every case runs for this many steps per program word, loops are common
+STEPS_PER_WORD: int = 2
+
+# X and Y are registers, N operands. The instruction set is covered uniformly and '????' is any word
+INSTRUCTION_TEMPLATES: list[str] = [
+    '00E0', '00EE', '1NNN', '2NNN', '3XNN', '4XNN', '5XY0', '5XY2', '5XY3', '6XNN', '7XNN',
+    '8XY0', '8XY1', '8XY2', '8XY3', '8XY4', '8XY5', '8XY6', '8XY7', '8XYE', '9XY0', 'ANNN', 'BNNN', 'CXNN', 'DXYN',
+    'EX9E', 'EXA1', 'F000', 'FN01', 'F002', 'FX07', 'FX0A', 'FX15', 'FX18', 'FX1E', 'FX29', 'FX33', 'FX55', 'FX65', 'FX3A',
+    '????', '????',
+]
+
+# Compared after every step, in the order returned by FuzzEngine.state()
+STATE_FIELDS: list[str] = [
+    'pc', 'i', 'sp', 'registers', 'stack', 'delay_timer', 'sound_timer',
+    'wait_for_key_reg', 'plane_mask', 'audio_pattern', 'pattern_pitch',
+]
+
+
+class FuzzCase(NamedTuple):
+    """ Initial machine state and instruction stream, loaded at MEMORY_PROGRAM_START """
+    program: tuple[int, ...]
+    registers: tuple[int, ...]
+    i: int
+    stack: tuple[int, ...]
+    delay_timer: int
+    sound_timer: int
+    keys: int # Bitmask of the pressed keys
+    plane_mask: int
+    seed: int
+    data: bytes
+    screen: tuple[tuple[int, ...], ...]
+
+    def memory_image(self) -> bytearray:
+        memory = bytearray(MEMORY_SIZE)
+        memory[:len(DEFAULT_SPRITES)] = bytes(DEFAULT_SPRITES)
+        program = b''.join(word.to_bytes(2, 'big') for word in self.program)
+        memory[MEMORY_PROGRAM_START:MEMORY_PROGRAM_START + len(program)] = program
+        memory[DATA_START:DATA_START + len(self.data)] = self.data
+        return memory
+
+
+class Divergence(NamedTuple):
+    case: FuzzCase
+    step: int
+    opcode: int
+    differences: list[str]
+
+    def report(self) -> str:
+        program = ' '.join('%04X' % word for word in self.case.program)
+        return "Engines diverge at step %d (opcode %04X):\n  %s\nProgram: %s\nCase: %r" % (
+            self.step, self.opcode, '\n  '.join(self.differences), program, self.case)
+
+
+class FuzzEngine(ABC):
+    """ One way of executing instructions. Engines are reused from one case to the next """
+
+    memory: bytearray
+    planes: list[list[int]]
+
+    @abstractmethod
+    def load(self, case: FuzzCase) -> None:
+        pass
+
+    @abstractmethod
+    def step(self) -> None:
+        pass
+
+    @abstractmethod
+    def state(self) -> tuple:
+        """ Values of STATE_FIELDS """
+        pass
+
+
+class ReferenceEngine(FuzzEngine):
+    """
+        Independent model of the interpreter, written for clarity rather than speed:
+        a single decoder over the opcode nibbles and sprites drawn one pixel at a time.
+        It follows the documented behaviour of CPU, including how it handles memory edges.
+    """
+
+    def __init__(self) -> None:
+        self.memory = bytearray(MEMORY_SIZE)
+        self.planes = empty_frame()
+        self.rng = random.Random()
+
+    def load(self, case: FuzzCase) -> None:
+        self.memory = case.memory_image()
+        self.planes = [list(rows) for rows in case.screen]
+        self.v = list(case.registers)
+        self.pc = MEMORY_PROGRAM_START
+        self.i = case.i
+        self.stack = list(case.stack) + [0] * (STACK_SIZE - len(case.stack))
+        self.sp = len(case.stack)
+        self.delay_timer = case.delay_timer
+        self.sound_timer = case.sound_timer
+        self.keys = case.keys
+        self.plane_mask = case.plane_mask
+        self.wait_for_key_reg: Optional[int] = None
+        self.audio_pattern: Optional[bytes] = None
+        self.pattern_pitch = AUDIO_DEFAULT_PITCH
+        self.rng.seed(case.seed)
+
+    def state(self) -> tuple:
+        return (self.pc, self.i, self.sp, tuple(self.v), tuple(self.stack), self.delay_timer, self.sound_timer,
+            self.wait_for_key_reg, self.plane_mask, self.audio_pattern, self.pattern_pitch)
+
+    def _read(self, address: int, count: int) -> list[int]:
+        """ Addresses wrap around the end of memory """
+        return [self.memory[(address + offset) % MEMORY_SIZE] for offset in range(count)]
+
+    def _write(self, address: int, values: Sequence[int]) -> None:
+        for offset, value in enumerate(values):
+            self.memory[(address + offset) % MEMORY_SIZE] = value
+
+    def _skip(self) -> None:
+        if self._read(self.pc, 2) == [0xF0, 0x00]:
+            self.pc = (self.pc + 2) % MEMORY_SIZE
+        self.pc = (self.pc + 2) % MEMORY_SIZE
+
+    def _key_pressed(self, value: int) -> bool:
+        if not 0 <= value <= 0xF:
+            raise ValueError("%d is not a valid Key" % value)
+        return bool(self.keys & (1 << value))
+
+    def _draw(self, x: int, y: int, n: int) -> None:
+        erased = False
+        address = self.i
+        for plane in range(PLANE_COUNT):
+            if not self.plane_mask & (1 << plane):
+                continue
+            rows = self.planes[plane]
+            for row in range(n):
+                byte = self.memory[address + row] if address + row < len(self.memory) else 0
+                for column in range(8):
+                    if not byte & (0x80 >> column):
+                        continue
+                    bit = 1 << (SCREEN_SIZE.x - 1 - (x + column) % SCREEN_SIZE.x)
+                    py = (y + row) % SCREEN_SIZE.y
+                    erased = erased or bool(rows[py] & bit)
+                    rows[py] ^= bit
+            address += n
+        if erased:
+            self.v[0xF] = 1
+
+    def step(self) -> None:
+        v = self.v
+        high, low = self._read(self.pc, 2)
+        opcode = high << 8 | low
+        self.pc = (self.pc + 2) % MEMORY_SIZE
+        family = opcode >> 12
+        x, y, n = (opcode >> 8) & 0xF, (opcode >> 4) & 0xF, opcode & 0xF
+        nn, nnn = opcode & 0xFF, opcode & 0xFFF
+
+        if family == 0x0:
+            if nn == 0xE0:
+                for plane in range(PLANE_COUNT):
+                    if self.plane_mask & (1 << plane):
+                        self.planes[plane] = [0] * SCREEN_SIZE.y
+            elif nn == 0xEE:
+                if self.sp == 0:
+                    raise StackUnderflowError()
+                self.sp -= 1
+                self.pc = self.stack[self.sp]
+                self.stack[self.sp] = 0
+        elif family == 0x1:
+            self.pc = nnn
+        elif family == 0x2:
+            if self.sp >= STACK_SIZE:
+                raise StackOverflowError()
+            self.stack[self.sp] = self.pc
+            self.sp += 1
+            self.pc = nnn
+        elif family == 0x3:
+            if v[x] == nn:
+                self._skip()
+        elif family == 0x4:
+            if v[x] != nn:
+                self._skip()
+        elif family == 0x5:
+            if n == 0x2:
+                values = v[x:y + 1] if x <= y else v[y:x + 1][::-1]
+                self._write(self.i, values)
+            elif n == 0x3:
+                values = self._read(self.i, abs(x - y) + 1)
+                if x <= y:
+                    v[x:y + 1] = values
+                else:
+                    v[y:x + 1] = values[::-1]
+            elif v[x] == v[y]:
+                self._skip()
+        elif family == 0x6:
+            v[x] = nn
+        elif family == 0x7:
+            v[x] = (v[x] + nn) & 0xFF
+        elif family == 0x8:
+            # VF is written before VX, which matters when X is F
+            if n == 0x0:
+                v[x] = v[y]
+            elif n == 0x1:
+                v[x] |= v[y]
+            elif n == 0x2:
+                v[x] &= v[y]
+            elif n == 0x3:
+                v[x] ^= v[y]
+            elif n == 0x4:
+                total = v[x] + v[y]
+                v[0xF] = int(total > 0xFF)
+                v[x] = total & 0xFF
+            elif n == 0x5:
+                v[0xF] = int(v[x] >= v[y])
+                v[x] = (v[x] - v[y]) % 0x100
+            elif n == 0x6:
+                v[0xF] = v[x] & 0x1
+                v[x] = v[x] >> 1
+            elif n == 0x7:
+                v[0xF] = int(v[y] >= v[x])
+                v[x] = (v[y] - v[x]) % 0x100
+            elif n == 0xE:
+                v[0xF] = v[x] >> 7
+                v[x] = (v[x] << 1) & 0xFF
+        elif family == 0x9:
+            if v[x] != v[y]:
+                self._skip()
+        elif family == 0xA:
+            self.i = nnn
+        elif family == 0xB:
+            self.pc = nnn + v[0]
+        elif family == 0xC:
+            v[x] = nn & self.rng.randint(0, 0xFF)
+        elif family == 0xD:
+            self._draw(v[x], v[y], n)
+        elif family == 0xE:
+            if nn == 0x9E and self._key_pressed(v[x]):
+                self._skip()
+            elif nn == 0xA1 and not self._key_pressed(v[x]):
+                self._skip()
+        elif opcode == 0xF000:
+            high, low = self._read(self.pc, 2)
+            self.i = high << 8 | low
+            self.pc = (self.pc + 2) % MEMORY_SIZE
+        elif nn == 0x01:
+            self.plane_mask = x & 0x3
+        elif nn == 0x02:
+            self.audio_pattern = bytes(self._read(self.i, AUDIO_PATTERN_SIZE))
+        elif nn == 0x07:
+            v[x] = self.delay_timer
+        elif nn == 0x0A:
+            self.wait_for_key_reg = x
+        elif nn == 0x15:
+            self.delay_timer = v[x]
+        elif nn == 0x18:
+            self.sound_timer = v[x]
+        elif nn == 0x1E:
+            self.i += v[x]
+        elif nn == 0x29:
+            self.i = v[x] * SPRITE_BYTE_SIZE
+        elif nn == 0x33:
+            self._write(self.i, [v[x] // 100, v[x] // 10 % 10, v[x] % 10])
+        elif nn == 0x55:
+            self._write(self.i, v[:x + 1])
+        elif nn == 0x65:
+            v[:x + 1] = self._read(self.i, x + 1)
+        elif nn == 0x3A:
+            self.pattern_pitch = v[x]
+
+
+class CPUEngine(FuzzEngine):
+    """ The interpreter itself, running from its per-address decoded instructions """
+
+    def __init__(self) -> None:
+        engine = HeadlessEngineHandler(size=SCREEN_SIZE)
+        self.cpu = CPU(1, Renderer(engine, 1, (255, 255, 255)), Keyboard(engine), Speaker(engine, 440))
+
+    @property
+    def memory(self) -> bytearray:
+        return self.cpu.memory
+
+    @property
+    def planes(self) -> list[list[int]]:
+        return self.cpu.renderer.planes
+
+    def load(self, case: FuzzCase) -> None:
+        # The decoded instructions are kept from the previous case on purpose: memory changes under them
+        cpu = self.cpu
+        cpu.memory[:] = case.memory_image()
+        cpu.registers = list(case.registers)
+        cpu.pc = MEMORY_PROGRAM_START
+        cpu.i = case.i
+        cpu.stack = list(case.stack) + [0] * (STACK_SIZE - len(case.stack))
+        cpu.sp = len(case.stack)
+        cpu.delay_timer = case.delay_timer
+        cpu.sound_timer = case.sound_timer
+        cpu.wait_for_key_reg = None
+        cpu.rng.seed(case.seed)
+        cpu.keyboard.pressed_keys = {Key(value): True for value in range(0x10) if case.keys & (1 << value)}
+        cpu.renderer.plane_mask = case.plane_mask
+        for rows, screen_rows in zip(cpu.renderer.planes, case.screen):
+            rows[:] = screen_rows
+        cpu.speaker.pattern = None
+        cpu.speaker.pattern_pitch = AUDIO_DEFAULT_PITCH
+
+    def step(self) -> None:
+        self.cpu.execute_cycle()
+
+    def state(self) -> tuple:
+        cpu = self.cpu
+        return (cpu.pc, cpu.i, cpu.sp, tuple(cpu.registers), tuple(cpu.stack), cpu.delay_timer, cpu.sound_timer,
+            cpu.wait_for_key_reg, cpu.renderer.plane_mask, cpu.speaker.pattern, cpu.speaker.pattern_pitch)
+
+
+class DirectCPUEngine(CPUEngine):
+    """ The interpreter decoding every instruction again through CPU.execute_opcode """
+
+    def step(self) -> None:
+        cpu = self.cpu
+        opcode = cpu.opcode_at(cpu.pc)
+        cpu.pc = (cpu.pc + CPU.PC_INCREMENT_SIZE) % MEMORY_SIZE
+        cpu.execute_opcode(opcode)
+
+
+FUZZ_ENGINES: dict[str, type[FuzzEngine]] = {
+    'reference': ReferenceEngine,
+    'cpu': CPUEngine,
+    'direct': DirectCPUEngine,
+}
+DEFAULT_ENGINES: list[str] = ['reference', 'cpu']
+
+
+def compare(a: FuzzEngine, b: FuzzEngine, state_a: Optional[tuple] = None) -> list[str]:
+    differences = []
+    state_a, state_b = state_a or a.state(), b.state()
+    if state_a != state_b:
+        differences.extend("%s: %r != %r" % (name, value_a, value_b)
+            for name, value_a, value_b in zip(STATE_FIELDS, state_a, state_b) if value_a != value_b)
+    if a.memory != b.memory:
+        address = next((address for address, (byte_a, byte_b) in enumerate(zip(a.memory, b.memory)) if byte_a != byte_b), None)
+        if address is None:
+            differences.append("memory size: %d != %d" % (len(a.memory), len(b.memory)))
+        else:
+            differences.append("memory[0x%04X]: 0x%02X != 0x%02X" % (address, a.memory[address], b.memory[address]))
+    if a.planes != b.planes:
+        differences.extend("plane %d row %d: %016X != %016X" % (plane, y, row_a, row_b)
+            for plane, (rows_a, rows_b) in enumerate(zip(a.planes, b.planes))
+            for y, (row_a, row_b) in enumerate(zip(rows_a, rows_b)) if row_a != row_b)
+    return differences
+
+
+def _compile_template(template: str) -> tuple[int, int]:
+    """ Fixed bits and operand mask of a template """
+    base = mask = 0
+    for digit in template:
+        base = (base << 4) | (int(digit, 16) if digit in hexdigits else 0)
+        mask = (mask << 4) | (0 if digit in hexdigits else 0xF)
+    return base, mask
+
+
+_COMPILED_TEMPLATES: list[tuple[int, int]] = [_compile_template(template) for template in INSTRUCTION_TEMPLATES]
+
+
+def random_instruction(rng: random.Random, length: int) -> list[int]:
+    """ Words of a random instruction, jumps mostly landing inside the program and I near the data """
+    base, mask = _COMPILED_TEMPLATES[rng.getrandbits(16) % len(_COMPILED_TEMPLATES)]
+    word = base | (rng.getrandbits(16) & mask)
+    family = word >> 12
+    if word == 0xF000:
+        return [word, DATA_START + rng.randrange(MAX_DATA_SIZE) if rng.getrandbits(1) else rng.getrandbits(16)]
+    if family in (0x1, 0x2, 0xB) and mask == 0xFFF and rng.random() < 0.8:
+        word = (word & 0xF000) | (MEMORY_PROGRAM_START + 2 * rng.randrange(length))
+    elif family == 0xA and mask == 0xFFF and rng.random() < 0.8:
+        word = 0xA000 | (DATA_START + rng.randrange(MAX_DATA_SIZE))
+    return [word]
+
+
+def random_register(rng: random.Random) -> int:
+    # Small values are valid keys and sprite characters
+    return rng.choice((0, 1, 0xFF, rng.randrange(0x10), rng.randrange(0x100)))
+
+
+def random_case(rng: random.Random) -> FuzzCase:
+    length = rng.randint(1, MAX_PROGRAM_LENGTH)
+    program: list[int] = []
+    while len(program) < length:
+        program.extend(random_instruction(rng, length))
+
+    i = rng.choice((DATA_START + rng.randrange(MAX_DATA_SIZE), rng.randrange(0x1000), rng.randrange(MEMORY_SIZE)))
+    depth = rng.choice((0, 0, 1, 2, rng.randint(0, STACK_SIZE)))
+    screen = tuple(
+        tuple(rng.getrandbits(SCREEN_SIZE.x) if rng.getrandbits(2) == 0 else 0 for _ in range(SCREEN_SIZE.y))
+        for _ in range(PLANE_COUNT)
+    )
+    return FuzzCase(
+        program=tuple(program[:MAX_PROGRAM_LENGTH]),
+        registers=tuple(random_register(rng) for _ in range(REGISTER_COUNT)),
+        i=i,
+        stack=tuple(MEMORY_PROGRAM_START + 2 * rng.randrange(length) for _ in range(depth)),
+        delay_timer=rng.randrange(0x100),
+        sound_timer=rng.randrange(0x100),
+        keys=rng.getrandbits(0x10),
+        plane_mask=rng.choice((1, 1, 2, 3, 0)),
+        seed=rng.getrandbits(32),
+        data=rng.randbytes(rng.randrange(MAX_DATA_SIZE)),
+        screen=screen,
+    )
+
+
+class Fuzzer:
+    """ Runs generated cases through several engines, comparing their whole state after every step """
+
+    def __init__(self, engine_names: Sequence[str] = DEFAULT_ENGINES, seed: int = 0) -> None:
+        if len(engine_names) < 2:
+            raise ValueError("At least two engines are needed to compare them")
+        self.engines = [FUZZ_ENGINES[name]() for name in engine_names]
+        self.rng = random.Random(seed)
+        self.cases = 0
+        self.steps = 0
+
+    def run_case(self, case: FuzzCase) -> Optional[Divergence]:
+        """ Returns the first divergence between the engines. Raising the same error ends the case """
+        self.cases += 1
+        engines = self.engines
+        for engine in engines:
+            engine.load(case)
+
+        reference = engines[0]
+        others = engines[1:]
+        pc = MEMORY_PROGRAM_START
+        for step in range(len(case.program) * STEPS_PER_WORD):
+            self.steps += 1
+            errors = []
+            for engine in engines:
+                try:
+                    engine.step()
+                    errors.append(None)
+                except Exception as e:
+                    errors.append(type(e).__name__)
+
+            if any(errors):
+                if len(set(errors)) == 1:
+                    return None
+                return Divergence(case, step, self._opcode_at(case, pc), ["error: %s" % ' != '.join(str(error) for error in errors)])
+            state = reference.state()
+            for engine in others:
+                differences = compare(reference, engine, state)
+                if differences:
+                    return Divergence(case, step, self._opcode_at(case, pc), differences)
+            pc = state[0]
+        return None
+
+    @staticmethod
+    def _opcode_at(case: FuzzCase, pc: int) -> int:
+        """ Opcode of the initial program at pc, memory may have changed since """
+        memory = case.memory_image()
+        return memory[pc] << 8 | memory[(pc + 1) % MEMORY_SIZE]
+
+    def _simplifications(self, case: FuzzCase, step: int) -> Iterator[FuzzCase]:
+        program = case.program
+        for length in range(1, min(len(program), step + 1)):
+            yield case._replace(program=program[:length])
+        for index in range(len(program)):
+            yield case._replace(program=program[:index] + program[index + 1:])
+        if case.data:
+            yield case._replace(data=b'')
+            yield case._replace(data=case.data[:len(case.data) // 2])
+        if any(any(rows) for rows in case.screen):
+            yield case._replace(screen=tuple(tuple(rows) for rows in empty_frame()))
+        if case.stack:
+            yield case._replace(stack=())
+        for index, value in enumerate(case.registers):
+            if value:
+                yield case._replace(registers=case.registers[:index] + (0,) + case.registers[index + 1:])
+        yield case._replace(delay_timer=0, sound_timer=0)
+        yield case._replace(keys=0)
+        yield case._replace(plane_mask=1)
+        yield case._replace(seed=0)
+        yield case._replace(i=DATA_START)
+
+    def minimise(self, divergence: Divergence) -> Divergence:
+        """ Greedily shrinks a failing case while the engines still diverge """
+        improved = True
+        while improved:
+            improved = False
+            for candidate in self._simplifications(divergence.case, divergence.step):
+                if candidate == divergence.case or not candidate.program:
+                    continue
+                smaller = self.run_case(candidate)
+                if smaller is not None:
+                    divergence = smaller
+                    improved = True
+                    break
+        return divergence
+
+    def run(self, cases: int, max_failures: int = 1) -> list[Divergence]:
+        """ Runs a batch of random cases and returns the minimised divergences """
+        failures = []
+        # Random programs are full of unknown opcodes, which the CPU logs
+        previous_level = logging.root.manager.disable
+        logging.disable(logging.WARNING)
+        try:
+            for _ in range(cases):
+                divergence = self.run_case(random_case(self.rng))
+                if divergence is not None:
+                    failures.append(self.minimise(divergence))
+                    if len(failures) >= max_failures:
+                        break
+        finally:
+            logging.disable(previous_level)
+        return failures
+
+
+class FuzzReport(NamedTuple):
+    cases: int
+    steps: int
+    failures: list[Divergence]
+
+
+def _fuzz_worker(engine_names: Sequence[str], seed: int, cases: int, max_failures: int) -> FuzzReport:
+    fuzzer = Fuzzer(engine_names, seed)
+    failures = fuzzer.run(cases, max_failures)
+    return FuzzReport(fuzzer.cases, fuzzer.steps, failures)
+
+
+def fuzz(cases: int, seed: int = 0, engine_names: Sequence[str] = DEFAULT_ENGINES, jobs: int = 1, max_failures: int = 1) -> FuzzReport:
+    """ Splits the cases over jobs processes, each one seeded from seed """
+    if jobs <= 1:
+        return _fuzz_worker(engine_names, seed, cases, max_failures)
+    with ProcessPoolExecutor(jobs) as executor:
+        futures = [executor.submit(_fuzz_worker, engine_names, seed + job, cases // jobs + (job < cases % jobs), max_failures)
+            for job in range(jobs)]
+        reports = [future.result() for future in futures]
+    return FuzzReport(sum(r.cases for r in reports), sum(r.steps for r in reports), [f for r in reports for f in r.failures])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Differential fuzzing of the execution engines")
+    parser.add_argument('--cases', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--jobs', type=int, default=1)
+    parser.add_argument('--engines', nargs='+', default=DEFAULT_ENGINES, choices=sorted(FUZZ_ENGINES))
+    parser.add_argument('--max-failures', type=int, default=1)
+    args = parser.parse_args()
+
+    start = perf_counter()
+    report = fuzz(args.cases, args.seed, args.engines, args.jobs, args.max_failures)
+    elapsed = perf_counter() - start
+    for failure in report.failures:
+        print(failure.report())
+    print("%d cases, %d steps in %.1f s (%d cases per minute), %d divergences" % (
+        report.cases, report.steps, elapsed, report.cases * 60 / elapsed, len(report.failures)))
+    raise SystemExit(1 if report.failures else 0)
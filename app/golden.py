@@ -0,0 +1,198 @@
+import argparse
+import hashlib
+import json
+import os
+from typing import NamedTuple, Optional, Sequence
+from app.constants import DEFAULT_PALETTE, SCREEN_SIZE
+from app.cpu import CPU
+from app.engine.headless_engine_handler import HeadlessEngineHandler
+from app.frame_codec import FrameRows, copy_frame
+from app.key import Key
+from app.keyboard import Keyboard
+from app.recorder import encode_png, frame_indices
+from app.renderer import Renderer
+from app.speaker import Speaker
+
+GOLDEN_FILE_NAME: str = 'golden.json'
+# Input scripts are looked up next to the golden file, named after the ROM
+INPUT_SCRIPT_EXTENSION: str = '.keys'
+
+DEFAULT_CYCLES_PER_FRAME: int = 10
+DEFAULT_SEED: int = 0xC8
+DEFAULT_CHECKPOINTS: list[int] = [60, 300, 600]
+
+
+class InputEvent(NamedTuple):
+    frame: int
+    key: Key
+    down: bool
+
+
+class InputScriptError(ValueError):
+    pass
+
+
+def parse_input_script(text: str) -> list[InputEvent]:
+    """
+        Parses an input script. Each line holds a frame number and a key event applied before that frame runs:
+        `+5` presses key 5 and `-5` releases it. Everything after a `#` is a comment.
+
+            60 +5   # start the game
+            64 -5
+    """
+    events = []
+    for line_number, line in enumerate(text.splitlines(), 1):
+        fields = line.split('#', 1)[0].split()
+        if not fields:
+            continue
+        try:
+            frame, event = fields
+            if event[0] not in '+-':
+                raise ValueError()
+            events.append(InputEvent(int(frame), Key(int(event[1:], 16)), event[0] == '+'))
+        except ValueError:
+            raise InputScriptError("Invalid input event on line %d: %r" % (line_number, line))
+    return sorted(events, key=lambda event: event.frame)
+
+
+def frame_hash(planes: FrameRows) -> str:
+    rows = b''.join(row.to_bytes(SCREEN_SIZE.x // 8, 'big') for rows in planes for row in rows)
+    return hashlib.sha1(rows).hexdigest()
+
+
+def dump_frame(planes: FrameRows) -> str:
+    """ Text rendering of a frame, one character per pixel showing its palette index """
+    return '\n'.join(row.decode('latin-1') for row in frame_indices(planes, 1)) \
+        .translate(str.maketrans('\x00\x01\x02\x03', '.#o@'))
+
+
+class GoldenRun:
+    """ Runs a ROM headlessly with scripted input and captures the framebuffer at checkpoints """
+
+    def __init__(self, rom: bytes, cycles_per_frame: int = DEFAULT_CYCLES_PER_FRAME, seed: int = DEFAULT_SEED) -> None:
+        self.engine = HeadlessEngineHandler(size=SCREEN_SIZE)
+        renderer = Renderer(self.engine, 1, (255, 255, 255))
+        self.cpu = CPU(cycles_per_frame, renderer, Keyboard(self.engine), Speaker(self.engine, 440), seed=seed)
+        self.cpu.load_rom_bytes(rom)
+
+    def run(self, checkpoints: list[int], events: Sequence[InputEvent] = ()) -> dict[int, list[list[int]]]:
+        """ Returns the planes after each checkpoint frame, frames being numbered from 1 """
+        frames = {}
+        pending = list(events)
+        for frame in range(1, max(checkpoints, default=0) + 1):
+            while pending and pending[0].frame <= frame:
+                event = pending.pop(0)
+                if event.down:
+                    self.engine.press(event.key)
+                else:
+                    self.engine.release(event.key)
+            self.cpu.update()
+            if frame in checkpoints:
+                frames[frame] = copy_frame(self.cpu.renderer.planes)
+        return frames
+
+
+class GoldenMismatch(NamedTuple):
+    rom: str
+    frame: int
+    expected: str
+    actual: str
+    planes: list[list[int]]
+
+    def report(self) -> str:
+        return "%s: frame %d hashes to %s instead of %s\n%s" % (
+            self.rom, self.frame, self.actual, self.expected, dump_frame(self.planes))
+
+
+class GoldenSuite:
+    """
+        Golden hashes of a ROM corpus, stored as JSON in a directory along with the input scripts:
+
+            {"cycles_per_frame": 10, "seed": 200, "roms": {"PONG": {"30": "<sha1>", ...}, ...}}
+    """
+
+    def __init__(self, golden_directory: str, rom_directory: str) -> None:
+        self.directory = golden_directory
+        self.rom_directory = rom_directory
+        self.path = os.path.join(golden_directory, GOLDEN_FILE_NAME)
+        self.cycles_per_frame = DEFAULT_CYCLES_PER_FRAME
+        self.seed = DEFAULT_SEED
+        self.hashes: dict[str, dict[int, str]] = {}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                data = json.load(f)
+            self.cycles_per_frame = data['cycles_per_frame']
+            self.seed = data['seed']
+            self.hashes = {rom: {int(frame): h for frame, h in frames.items()} for rom, frames in data['roms'].items()}
+
+    def rom_names(self) -> list[str]:
+        return sorted(name for name in os.listdir(self.rom_directory) if os.path.isfile(os.path.join(self.rom_directory, name)))
+
+    def input_events(self, rom_name: str) -> list[InputEvent]:
+        path = os.path.join(self.directory, rom_name + INPUT_SCRIPT_EXTENSION)
+        if not os.path.exists(path):
+            return []
+        with open(path) as f:
+            return parse_input_script(f.read())
+
+    def run(self, rom_name: str, checkpoints: list[int]) -> dict[int, list[list[int]]]:
+        with open(os.path.join(self.rom_directory, rom_name), 'rb') as f:
+            rom = f.read()
+        return GoldenRun(rom, self.cycles_per_frame, self.seed).run(checkpoints, self.input_events(rom_name))
+
+    def check(self, rom_name: str) -> Optional[GoldenMismatch]:
+        """ Returns the first checkpoint whose frame differs from the golden hash """
+        expected = self.hashes[rom_name]
+        frames = self.run(rom_name, sorted(expected))
+        for frame, planes in sorted(frames.items()):
+            actual = frame_hash(planes)
+            if actual != expected[frame]:
+                return GoldenMismatch(rom_name, frame, expected[frame], actual, planes)
+        return None
+
+    def update(self, rom_names: Optional[list[str]] = None, checkpoints: list[int] = DEFAULT_CHECKPOINTS) -> None:
+        """ Records new golden hashes, by default for every ROM of the corpus """
+        for rom_name in rom_names or self.rom_names():
+            frames = self.run(rom_name, sorted(self.hashes.get(rom_name, checkpoints)))
+            self.hashes[rom_name] = {frame: frame_hash(planes) for frame, planes in frames.items()}
+
+    def save(self) -> None:
+        data = {
+            'cycles_per_frame': self.cycles_per_frame,
+            'seed': self.seed,
+            'roms': {rom: {str(frame): h for frame, h in sorted(frames.items())} for rom, frames in sorted(self.hashes.items())},
+        }
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.path, 'w') as f:
+            json.dump(data, f, indent=2)
+            f.write('\n')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Check or update the golden framebuffer hashes of a ROM corpus")
+    parser.add_argument('command', choices=['check', 'update'])
+    parser.add_argument('roms', nargs='*', help="ROM names, every ROM of the corpus by default")
+    parser.add_argument('--rom-directory', default='roms')
+    parser.add_argument('--golden-directory', default=os.path.join('tests', 'golden'))
+    parser.add_argument('--dump', metavar='DIRECTORY', help="Write the mismatching frames as PNG files")
+    args = parser.parse_args()
+
+    suite = GoldenSuite(args.golden_directory, args.rom_directory)
+    if args.command == 'update':
+        suite.update(args.roms)
+        suite.save()
+        print("Updated %d roms in %s" % (len(args.roms or suite.hashes), suite.path))
+    else:
+        failures = 0
+        for rom_name in args.roms or sorted(suite.hashes):
+            mismatch = suite.check(rom_name)
+            if mismatch is None:
+                continue
+            failures += 1
+            print(mismatch.report())
+            if args.dump:
+                os.makedirs(args.dump, exist_ok=True)
+                with open(os.path.join(args.dump, '%s_%d.png' % (rom_name, mismatch.frame)), 'wb') as f:
+                    f.write(encode_png(frame_indices(mismatch.planes, 8), DEFAULT_PALETTE))
+        print("%d roms checked, %d mismatches" % (len(args.roms or suite.hashes), failures))
+        raise SystemExit(1 if failures else 0)
@@ -0,0 +1,291 @@
+import argparse
+import hashlib
+import os
+import struct
+import zlib
+from typing import BinaryIO, Iterator, NamedTuple, Optional, Tuple
+from app.constants import DEFAULT_PALETTE, SCREEN_SIZE
+from app.cpu import CPU, CPUState
+from app.engine.headless_engine_handler import HeadlessEngineHandler
+from app.golden import dump_frame
+from app.key import Key
+from app.keyboard import Keyboard
+from app.packed_state import PACKED_STATE_SIZE, PackedState
+from app.quirks import Quirks
+from app.recorder import DEFAULT_BUFFER_SIZE, RecordingError, encode_png, frame_indices
+from app.renderer import Renderer
+from app.speaker import Speaker
+
+INPUT_RECORDING_MAGIC: bytes = b'CH8INP01'
+INDEX_MAGIC: bytes = b'CH8INDEX'
+# Magic, fps, cycles per frame, keyframe interval, ROM SHA-1 and quirks key
+INPUT_HEADER = struct.Struct('>8sHHI20s8s')
+RECORD_TAG = struct.Struct('>c')
+KEY_RECORD = struct.Struct('>QBB') # Frame, key, pressed
+KEYFRAME_RECORD = struct.Struct('>QI') # Frame, length of the compressed state
+END_RECORD = struct.Struct('>Q') # Frame count
+INDEX_ENTRY = struct.Struct('>QQ') # Frame, offset of the keyframe record
+# Offset of the index and number of entries, the last bytes of a finished recording
+INDEX_TRAILER = struct.Struct('>QI8s')
+
+KEY_TAG: bytes = b'K'
+KEYFRAME_TAG: bytes = b'S'
+END_TAG: bytes = b'E'
+
+DEFAULT_KEYFRAME_INTERVAL: int = 600 # Frames, 10 seconds at 60 fps
+
+PressedKeys = list[Tuple[Key, bool]]
+
+
+def encode_keyframe(state: CPUState, pressed_keys: PressedKeys) -> bytes:
+    """ Compressed packed state and keyboard. Pressed keys keep their order, the key FX0A reads depends on it """
+    keys = bytes(value for key, down in pressed_keys for value in (key.value, down))
+    return zlib.compress(bytes(PackedState.from_state(state).buffer) + keys)
+
+
+def decode_keyframe(data: bytes) -> Tuple[CPUState, PressedKeys]:
+    try:
+        data = zlib.decompress(data)
+        if len(data) < PACKED_STATE_SIZE:
+            raise ValueError("%d bytes long" % len(data))
+        keys = data[PACKED_STATE_SIZE:]
+        pressed_keys = [(Key(keys[n]), bool(keys[n + 1])) for n in range(0, len(keys) - 1, 2)]
+    except (zlib.error, ValueError) as e:
+        raise RecordingError("Invalid keyframe: %s" % e)
+    return PackedState(bytearray(data[:PACKED_STATE_SIZE])).to_state(), pressed_keys
+
+
+class InputRecorder:
+    """
+        Records the key events of each frame, and the whole machine state every keyframe_interval frames,
+        so a recording can be replayed from any frame without running the frames before the previous
+        keyframe. The first keyframe holds the random generator state, replays don't depend on the seed.
+        Frames are numbered from 0, the keyframe of a frame is the state right before it runs,
+        with its key events applied. An index of the keyframes ends the file.
+    """
+
+    def __init__(self, path: str, keyframe_interval: int = DEFAULT_KEYFRAME_INTERVAL, fps: int = 60, buffer_size: int = DEFAULT_BUFFER_SIZE) -> None:
+        if keyframe_interval < 1:
+            raise ValueError("The keyframe interval must be at least 1 frame")
+        self.path = path
+        self.keyframe_interval = keyframe_interval
+        self.fps = fps
+        self.buffer_size = buffer_size
+        self.file: Optional[BinaryIO] = None
+        self.cpu: Optional[CPU] = None
+        self.frame_number = 0
+        self.keyframes: list[Tuple[int, int]] = []
+        self._events: list[Tuple[Key, bool]] = []
+
+    def start(self, cpu: CPU, rom: bytes) -> None:
+        """ Starts recording a CPU that just loaded rom, listening to the key events of its engine """
+        self.cpu = cpu
+        self.file = open(self.path, 'wb', buffering=self.buffer_size)
+        self.file.write(INPUT_HEADER.pack(INPUT_RECORDING_MAGIC, self.fps, cpu.cycles_per_frame, self.keyframe_interval,
+            hashlib.sha1(rom).digest(), cpu.quirks.key().encode()))
+        engine = cpu.keyboard.engine
+        engine.keydown(lambda key: self._events.append((key, True)))
+        engine.keyup(lambda key: self._events.append((key, False)))
+
+    def capture(self) -> None:
+        """ Called before each frame runs, once the engine received its key events """
+        if self.file is None:
+            return
+        for key, down in self._events:
+            self.file.write(KEY_TAG + KEY_RECORD.pack(self.frame_number, key.value, down))
+        self._events.clear()
+        if self.frame_number % self.keyframe_interval == 0:
+            state = encode_keyframe(self.cpu.snapshot(), list(self.cpu.keyboard.pressed_keys.items()))
+            self.keyframes.append((self.frame_number, self.file.tell()))
+            self.file.write(KEYFRAME_TAG + KEYFRAME_RECORD.pack(self.frame_number, len(state)))
+            self.file.write(state)
+        self.frame_number += 1
+
+    def close(self) -> None:
+        if self.file is None or self.file.closed:
+            return
+        self.file.write(END_TAG + END_RECORD.pack(self.frame_number))
+        index_offset = self.file.tell()
+        for frame, offset in self.keyframes:
+            self.file.write(INDEX_ENTRY.pack(frame, offset))
+        self.file.write(INDEX_TRAILER.pack(index_offset, len(self.keyframes), INDEX_MAGIC))
+        self.file.close()
+
+    def __enter__(self) -> 'InputRecorder':
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+
+class KeyEvent(NamedTuple):
+    frame: int
+    key: Key
+    down: bool
+
+
+class InputRecordingReader:
+    """
+        Reads the header and the keyframe index of an input recording. A recording that wasn't closed,
+        after a crash, has no index: it is rebuilt by scanning the records, up to the last complete one.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(path, 'rb') as f:
+            header = f.read(INPUT_HEADER.size)
+            if len(header) < INPUT_HEADER.size or not header.startswith(INPUT_RECORDING_MAGIC):
+                raise RecordingError("%s is not an input recording" % path)
+            _, self.fps, self.cycles_per_frame, self.keyframe_interval, self.rom_sha1, quirks_key = INPUT_HEADER.unpack(header)
+            self.quirks = Quirks(*(digit == ord('1') for digit in quirks_key.rstrip(b'\0')))
+
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            trailer = b''
+            if size >= INPUT_HEADER.size + INDEX_TRAILER.size:
+                f.seek(size - INDEX_TRAILER.size)
+                trailer = f.read(INDEX_TRAILER.size)
+            if trailer.endswith(INDEX_MAGIC):
+                index_offset, count, _ = INDEX_TRAILER.unpack(trailer)
+                f.seek(index_offset)
+                entries = f.read(count * INDEX_ENTRY.size)
+                self.keyframes: list[Tuple[int, int]] = [INDEX_ENTRY.unpack_from(entries, n * INDEX_ENTRY.size) for n in range(count)]
+                f.seek(index_offset - END_RECORD.size)
+                self.frame_count: int = END_RECORD.unpack(f.read(END_RECORD.size))[0]
+                self.finished = True
+            else:
+                self.keyframes, self.frame_count = self._scan(f)
+                self.finished = False
+        if not self.keyframes:
+            raise RecordingError("%s holds no keyframe" % path)
+
+    def _scan(self, f: BinaryIO) -> Tuple[list[Tuple[int, int]], int]:
+        keyframes = []
+        frame_count = 0
+        for tag, frame, offset, _ in self._records(f, INPUT_HEADER.size):
+            if tag == KEYFRAME_TAG:
+                keyframes.append((frame, offset))
+            # Without the end record, the events of the frame after the last record may be lost
+            frame_count = frame
+        return keyframes, frame_count
+
+    def _records(self, f: BinaryIO, offset: int) -> Iterator[Tuple[bytes, int, int, bytes]]:
+        """ Yields (tag, frame, offset, payload) from offset, stopping at the end record or a truncated one """
+        f.seek(offset)
+        while True:
+            tag = f.read(RECORD_TAG.size)
+            if tag == KEY_TAG:
+                data = f.read(KEY_RECORD.size)
+                if len(data) < KEY_RECORD.size:
+                    return
+                frame = KEY_RECORD.unpack(data)[0]
+            elif tag == KEYFRAME_TAG:
+                data = f.read(KEYFRAME_RECORD.size)
+                if len(data) < KEYFRAME_RECORD.size:
+                    return
+                frame, length = KEYFRAME_RECORD.unpack(data)
+                data = f.read(length)
+                if len(data) < length:
+                    return
+            elif tag == END_TAG:
+                data = f.read(END_RECORD.size)
+                if len(data) == END_RECORD.size:
+                    yield tag, END_RECORD.unpack(data)[0], offset, data
+                return
+            elif not tag:
+                return
+            else:
+                raise RecordingError("Invalid record %r at offset %d of %s" % (tag, offset, self.path))
+            yield tag, frame, offset, data
+            offset = f.tell()
+
+    def keyframe_before(self, frame: int) -> Tuple[int, int]:
+        """ (frame, offset) of the last keyframe at or before frame """
+        entry = self.keyframes[0]
+        for keyframe in self.keyframes:
+            if keyframe[0] > frame:
+                break
+            entry = keyframe
+        return entry
+
+    def read_keyframe(self, offset: int) -> Tuple[CPUState, PressedKeys]:
+        with open(self.path, 'rb') as f:
+            for tag, _, _, data in self._records(f, offset):
+                if tag != KEYFRAME_TAG:
+                    break
+                return decode_keyframe(data)
+        raise RecordingError("No keyframe at offset %d of %s" % (offset, self.path))
+
+    def events(self, offset: int) -> Iterator[KeyEvent]:
+        """ Key events of the records from offset """
+        with open(self.path, 'rb') as f:
+            for tag, frame, _, data in self._records(f, offset):
+                if tag == KEY_TAG:
+                    _, key, down = KEY_RECORD.unpack(data)
+                    yield KeyEvent(frame, Key(key), bool(down))
+
+
+class InputReplay:
+    """ Replays an input recording headlessly, from the keyframe before each frame asked for """
+
+    def __init__(self, path: str, rom: bytes) -> None:
+        self.reader = InputRecordingReader(path)
+        if hashlib.sha1(rom).digest() != self.reader.rom_sha1:
+            raise RecordingError("%s was recorded with another ROM" % path)
+        self.engine = HeadlessEngineHandler(size=SCREEN_SIZE)
+        renderer = Renderer(self.engine, 1, (255, 255, 255))
+        self.cpu = CPU(self.reader.cycles_per_frame, renderer, Keyboard(self.engine), Speaker(self.engine, 440),
+            decode_cache=None, quirks=self.reader.quirks)
+        self.cpu.load_rom_bytes(rom)
+        # Frames run since the last keyframe restored, for statistics and tests
+        self.frames_replayed = 0
+
+    def seek(self, frame: int) -> CPU:
+        """ Puts the CPU in its state right before frame runs, replaying at most keyframe_interval frames """
+        if not 0 <= frame <= self.reader.frame_count:
+            raise RecordingError("Frame %d is out of the recording, which has %d frames" % (frame, self.reader.frame_count))
+        keyframe, offset = self.reader.keyframe_before(frame)
+        cpu = self.cpu
+        state, pressed_keys = self.reader.read_keyframe(offset)
+        cpu.restore(state)
+        cpu.keyboard.pressed_keys = dict(pressed_keys)
+
+        self.frames_replayed = 0
+        current = keyframe
+        for event in self.reader.events(offset):
+            if event.frame > frame:
+                break
+            while current < event.frame:
+                cpu.update()
+                current += 1
+                self.frames_replayed += 1
+            cpu.keyboard._on_key_pressed(event.key, event.down)
+        while current < frame:
+            cpu.update()
+            current += 1
+            self.frames_replayed += 1
+        return cpu
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Show a frame of an input recording")
+    parser.add_argument('recording')
+    parser.add_argument('rom')
+    parser.add_argument('--frame', type=int, help="Replay up to this frame and print the screen")
+    parser.add_argument('--png', metavar='PATH', help="Write the screen of the frame to a PNG file instead")
+    parser.add_argument('--scale', type=int, default=8)
+    args = parser.parse_args()
+    with open(args.rom, 'rb') as f:
+        replay = InputReplay(args.recording, f.read())
+    reader = replay.reader
+    print("%d frames at %d fps, %d keyframes every %d frames%s" % (reader.frame_count, reader.fps, len(reader.keyframes),
+        reader.keyframe_interval, '' if reader.finished else ', unfinished recording'))
+    if args.frame is not None:
+        # The screen once the frame ran
+        cpu = replay.seek(args.frame)
+        cpu.update()
+        if args.png:
+            with open(args.png, 'wb') as f:
+                f.write(encode_png(frame_indices(cpu.renderer.planes, args.scale), DEFAULT_PALETTE))
+        else:
+            print(dump_frame(cpu.renderer.planes))
@@ -0,0 +1,451 @@
+import argparse
+import asyncio
+import base64
+import json
+import logging
+import os
+import socket
+import struct
+import subprocess
+import sys
+import traceback
+from collections import deque
+from time import monotonic, perf_counter, sleep
+from typing import Callable, NamedTuple, Optional
+from app.cpu import CPUError
+from app.decode_cache import DecodedRom
+from app.golden import DEFAULT_CYCLES_PER_FRAME, DEFAULT_SEED, GoldenRun, GoldenSuite, InputEvent, frame_hash, parse_input_script
+from app.key import Key
+from app.quirks import get_quirks
+
+MESSAGE_LENGTH = struct.Struct('>I')
+DEFAULT_PORT: int = 8965
+DEFAULT_JOB_TIMEOUT: float = 600.0
+DEFAULT_MAX_ATTEMPTS: int = 3
+# Time given to a worker past the job timeout before the coordinator gives up on it
+DEFAULT_TIMEOUT_GRACE: float = 5.0
+
+# Job statuses. Timed out or lost jobs are retried, a ROM error is final
+JOB_DONE = 'done'
+JOB_ERROR = 'error'
+JOB_TIMEOUT = 'timeout'
+JOB_LOST = 'lost'
+
+
+class JobQueueError(Exception):
+    pass
+
+
+class Job(NamedTuple):
+    """ Headless run of a ROM with scripted input, hashing the framebuffer at the checkpoint frames (numbered from 1) """
+    job_id: str
+    rom: bytes
+    checkpoints: list[int]
+    events: list[InputEvent] = []
+    cycles_per_frame: int = DEFAULT_CYCLES_PER_FRAME
+    seed: int = DEFAULT_SEED
+    quirks: Optional[str] = None # Quirks profile, the CPU defaults when None
+    timeout: float = DEFAULT_JOB_TIMEOUT
+
+    @property
+    def frames(self) -> int:
+        return max(self.checkpoints, default=0)
+
+    def to_message(self) -> dict:
+        message = self._asdict()
+        message['rom'] = base64.b64encode(self.rom).decode('ascii')
+        message['events'] = [[event.frame, event.key.value, event.down] for event in self.events]
+        return message
+
+    @classmethod
+    def from_message(cls, message: dict) -> 'Job':
+        fields = {name: message[name] for name in cls._fields if name in message}
+        fields['rom'] = base64.b64decode(message['rom'])
+        fields['events'] = [InputEvent(frame, Key(key), down) for frame, key, down in message.get('events', [])]
+        return cls(**fields)
+
+
+class JobResult(NamedTuple):
+    job_id: str
+    status: str
+    hashes: dict[int, str] # Framebuffer SHA-1 of each checkpoint reached
+    attempts: int
+    worker: Optional[str] = None
+    error: Optional[str] = None
+    seconds: float = 0.0
+
+    def to_json(self) -> str:
+        return json.dumps(dict(self._asdict(), hashes={str(frame): h for frame, h in sorted(self.hashes.items())}))
+
+    @classmethod
+    def from_json(cls, line: str) -> 'JobResult':
+        data = json.loads(line)
+        data['hashes'] = {int(frame): h for frame, h in data['hashes'].items()}
+        return cls(**data)
+
+
+class ResultStore:
+    """ Final results by job id, appended to a JSON lines file when given a path and read back from it on creation """
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        self.path = path
+        self.results: dict[str, JobResult] = {}
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    if line.strip():
+                        result = JobResult.from_json(line)
+                        self.results[result.job_id] = result
+
+    def add(self, result: JobResult) -> None:
+        self.results[result.job_id] = result
+        if self.path is not None:
+            with open(self.path, 'a') as f:
+                f.write(result.to_json() + '\n')
+
+    def get(self, job_id: str) -> Optional[JobResult]:
+        return self.results.get(job_id)
+
+    def __len__(self) -> int:
+        return len(self.results)
+
+
+def encode_message(message: dict) -> bytes:
+    data = json.dumps(message).encode()
+    return MESSAGE_LENGTH.pack(len(data)) + data
+
+
+async def read_message(reader: asyncio.StreamReader) -> dict:
+    length, = MESSAGE_LENGTH.unpack(await reader.readexactly(MESSAGE_LENGTH.size))
+    return json.loads(await reader.readexactly(length))
+
+
+class RunningJob:
+    def __init__(self, job: Job, worker: str) -> None:
+        self.job = job
+        self.worker = worker
+        self.hashes: dict[int, str] = {}
+        self.start = monotonic()
+
+
+class JobCoordinator:
+    """
+        Hands jobs to the workers connected over TCP, one job at a time per worker, and collects their results.
+        Every message is a JSON object prefixed by its length. A worker sends {"type": "hello", "worker": name}
+        and gets {"type": "job", ...} messages; it streams back a "checkpoint" message with the frame hash of each
+        checkpoint, then one of "done", "error" or "timeout".
+
+        A job that times out, or whose worker disconnects or stops answering, goes back to the queue until it
+        was attempted max_attempts times.
+    """
+
+    def __init__(self,
+        store: Optional[ResultStore] = None,
+        host: str = '127.0.0.1',
+        port: int = DEFAULT_PORT,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+        timeout_grace: float = DEFAULT_TIMEOUT_GRACE) -> None:
+        self.store = store if store is not None else ResultStore()
+        self.host = host
+        self.port = port
+        self.max_attempts = max_attempts
+        self.timeout_grace = timeout_grace
+        self.pending: deque[Job] = deque()
+        self.running: dict[str, RunningJob] = {}
+        self.attempts: dict[str, int] = {}
+        self.futures: dict[str, asyncio.Future] = {}
+        self.workers: set[str] = set()
+        self.server: Optional[asyncio.AbstractServer] = None
+        self._job_available: Optional[asyncio.Condition] = None
+        self._stopping = False
+        self._writers: set[asyncio.StreamWriter] = set()
+
+    def submit(self, job: Job) -> asyncio.Future:
+        """ Queues job, the future resolves to its final JobResult """
+        if job.job_id in self.futures and not self.futures[job.job_id].done():
+            raise JobQueueError("Job %r is already queued" % job.job_id)
+        future = asyncio.get_running_loop().create_future()
+        self.futures[job.job_id] = future
+        self.attempts[job.job_id] = 0
+        self._queue(job)
+        return future
+
+    def _queue(self, job: Job, first: bool = False) -> None:
+        if first:
+            self.pending.appendleft(job)
+        else:
+            self.pending.append(job)
+        asyncio.get_running_loop().create_task(self._notify())
+
+    async def _notify(self) -> None:
+        async with self._condition():
+            self._condition().notify()
+
+    def _condition(self) -> asyncio.Condition:
+        if self._job_available is None:
+            self._job_available = asyncio.Condition()
+        return self._job_available
+
+    async def join(self) -> list[JobResult]:
+        """ Waits for every submitted job """
+        return list(await asyncio.gather(*self.futures.values()))
+
+    async def start(self) -> None:
+        self.server = await asyncio.start_server(self._handle_worker, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        logging.info("Job coordinator listening on %s:%d" % (self.host, self.port))
+
+    async def stop(self) -> None:
+        """ Disconnects the workers, which exit """
+        self._stopping = True
+        async with self._condition():
+            self._condition().notify_all()
+        writers = list(self._writers)
+        for writer in writers:
+            writer.close()
+        await asyncio.gather(*[writer.wait_closed() for writer in writers], return_exceptions=True)
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    def _finish(self, job: Job, result: JobResult) -> None:
+        self.store.add(result)
+        future = self.futures[job.job_id]
+        if not future.done():
+            future.set_result(result)
+
+    def _failed(self, running: RunningJob, status: str, error: Optional[str] = None) -> None:
+        """ Retries a timed out or lost job, unless it used all its attempts """
+        job = running.job
+        attempts = self.attempts[job.job_id]
+        if attempts < self.max_attempts:
+            logging.warning("Job %s attempt %d on %s: %s, retrying" % (job.job_id, attempts, running.worker, status))
+            self._queue(job, first=True)
+        else:
+            self._finish(job, JobResult(job.job_id, status, running.hashes, attempts, running.worker, error, monotonic() - running.start))
+
+    async def _next_job(self) -> Optional[Job]:
+        """ The next pending job, None once the coordinator stops """
+        condition = self._condition()
+        async with condition:
+            await condition.wait_for(lambda: bool(self.pending) or self._stopping)
+            return None if self._stopping else self.pending.popleft()
+
+    async def _handle_worker(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self._writers.add(writer)
+        running: Optional[RunningJob] = None
+        try:
+            hello = await read_message(reader)
+            worker = hello.get('worker') or '%s:%d' % writer.get_extra_info('peername')[:2]
+            self.workers.add(worker)
+            logging.info("Worker %s connected" % worker)
+            while True:
+                job = await self._next_job()
+                if job is None:
+                    break
+                self.attempts[job.job_id] += 1
+                running = RunningJob(job, worker)
+                self.running[job.job_id] = running
+                writer.write(encode_message(dict(job.to_message(), type='job')))
+                await writer.drain()
+                try:
+                    status, error = await asyncio.wait_for(self._receive_results(reader, running), job.timeout + self.timeout_grace)
+                except asyncio.TimeoutError:
+                    # The worker stopped answering: its connection is dropped along with whatever it still sends
+                    del self.running[job.job_id]
+                    self._failed(running, JOB_TIMEOUT, "No answer from %s" % worker)
+                    running = None
+                    break
+                del self.running[job.job_id]
+                if status == JOB_TIMEOUT:
+                    self._failed(running, status, error)
+                else:
+                    self._finish(job, JobResult(job.job_id, status, running.hashes, self.attempts[job.job_id], worker, error,
+                        monotonic() - running.start))
+                running = None
+        except (asyncio.IncompleteReadError, ConnectionError, json.JSONDecodeError) as e:
+            if running is not None:
+                self._failed(running, JOB_LOST, repr(e))
+        finally:
+            if running is not None:
+                self.running.pop(running.job.job_id, None)
+            self._writers.discard(writer)
+            writer.close()
+
+    async def _receive_results(self, reader: asyncio.StreamReader, running: RunningJob) -> tuple[str, Optional[str]]:
+        while True:
+            message = await read_message(reader)
+            if message['type'] == 'checkpoint':
+                running.hashes[message['frame']] = message['hash']
+            else:
+                return message['type'], message.get('error')
+
+
+def run_job(job: Job, on_checkpoint: Callable[[int, str], None], decoded_rom: Optional[DecodedRom] = None) -> tuple[str, Optional[str]]:
+    """
+        Runs job headlessly, calling on_checkpoint with the frame hash of each checkpoint. Returns the status and error.
+        decoded_rom warm starts the CPU, it is only read.
+        Any error raised by the job is its JOB_ERROR status: a bad ROM must not stop the worker running it.
+    """
+    checkpoints = set(job.checkpoints)
+    pending = sorted(job.events, key=lambda event: event.frame)
+    deadline = perf_counter() + job.timeout
+    try:
+        run = GoldenRun(job.rom, job.cycles_per_frame, job.seed)
+        cpu = run.cpu
+        if job.quirks is not None:
+            cpu.set_quirks(get_quirks(job.quirks))
+        if decoded_rom is not None:
+            cpu.warm_start(decoded_rom)
+        for frame in range(1, job.frames + 1):
+            while pending and pending[0].frame <= frame:
+                event = pending.pop(0)
+                if event.down:
+                    run.engine.press(event.key)
+                else:
+                    run.engine.release(event.key)
+            cpu.update()
+            if frame in checkpoints:
+                on_checkpoint(frame, frame_hash(cpu.renderer.planes))
+            if perf_counter() > deadline:
+                return JOB_TIMEOUT, "Stopped at frame %d after %gs" % (frame, job.timeout)
+    except CPUError as e:
+        return JOB_ERROR, repr(e)
+    except Exception:
+        # Errors of the emulator itself, e.g. an instruction reading a key that doesn't exist
+        return JOB_ERROR, traceback.format_exc()
+    return JOB_DONE, None
+
+
+def _receive_exactly(connection: socket.socket, size: int) -> Optional[bytes]:
+    data = b''
+    while len(data) < size:
+        chunk = connection.recv(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+
+def run_worker(host: str = '127.0.0.1', port: int = DEFAULT_PORT, name: Optional[str] = None, connect_timeout: float = 30.0) -> int:
+    """ Runs the jobs of a coordinator until it closes the connection, returns the number of jobs run """
+    name = name or '%s-%d' % (socket.gethostname(), os.getpid())
+    deadline = monotonic() + connect_timeout
+    while True:
+        try:
+            connection = socket.create_connection((host, port))
+            break
+        except ConnectionRefusedError:
+            # The coordinator may not be listening yet
+            if monotonic() > deadline:
+                raise
+            sleep(0.1)
+    jobs = 0
+    with connection:
+        connection.sendall(encode_message({'type': 'hello', 'worker': name}))
+        while True:
+            header = _receive_exactly(connection, MESSAGE_LENGTH.size)
+            if header is None:
+                return jobs
+            data = _receive_exactly(connection, MESSAGE_LENGTH.unpack(header)[0])
+            if data is None:
+                return jobs
+            try:
+                job = Job.from_message(json.loads(data))
+                status, error = run_job(job, lambda frame, h: connection.sendall(encode_message({'type': 'checkpoint', 'frame': frame, 'hash': h})))
+            except Exception:
+                # An invalid job message: the job fails, the worker keeps running the next ones
+                logging.exception("Can't run job")
+                status, error = JOB_ERROR, traceback.format_exc()
+            connection.sendall(encode_message({'type': status, 'error': error}))
+            jobs += 1
+
+
+def start_local_workers(count: int, port: int, host: str = '127.0.0.1') -> list[subprocess.Popen]:
+    """ Worker processes on this machine, each running `python -m app.job_queue worker` """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return [subprocess.Popen([sys.executable, '-m', 'app.job_queue', 'worker', '--host', host, '--port', str(port), '--name', 'local-%d' % n],
+        cwd=root) for n in range(count)]
+
+
+def golden_jobs(suite: GoldenSuite) -> list[Job]:
+    """ One job per ROM of a golden suite, checking its golden checkpoints """
+    jobs = []
+    for rom_name, hashes in sorted(suite.hashes.items()):
+        with open(os.path.join(suite.rom_directory, rom_name), 'rb') as f:
+            rom = f.read()
+        jobs.append(Job(rom_name, rom, sorted(hashes), suite.input_events(rom_name), suite.cycles_per_frame, suite.seed))
+    return jobs
+
+
+def load_jobs(path: str) -> list[Job]:
+    """
+        Jobs listed in a JSON file, with ROM and input script paths relative to the file:
+
+            [{"id": "pong-long", "rom": "roms/PONG", "script": "pong.keys", "checkpoints": [600, 36000], "timeout": 120}, ...]
+    """
+    directory = os.path.dirname(path)
+    with open(path) as f:
+        entries = json.load(f)
+    jobs = []
+    for entry in entries:
+        with open(os.path.join(directory, entry['rom']), 'rb') as f:
+            rom = f.read()
+        events = []
+        if 'script' in entry:
+            with open(os.path.join(directory, entry['script'])) as f:
+                events = parse_input_script(f.read())
+        jobs.append(Job(entry.get('id', entry['rom']), rom, entry['checkpoints'], events,
+            entry.get('cycles_per_frame', DEFAULT_CYCLES_PER_FRAME), entry.get('seed', DEFAULT_SEED), entry.get('quirks'),
+            entry.get('timeout', DEFAULT_JOB_TIMEOUT)))
+    return jobs
+
+
+async def coordinate(jobs: list[Job], coordinator: JobCoordinator, local_workers: int = 0) -> list[JobResult]:
+    await coordinator.start()
+    workers = start_local_workers(local_workers, coordinator.port) if local_workers else []
+    try:
+        futures = [coordinator.submit(job) for job in jobs]
+        return list(await asyncio.gather(*futures))
+    finally:
+        await coordinator.stop()
+        for worker in workers:
+            worker.wait()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Distributed headless ROM runs: a coordinator queues the jobs, workers connect over TCP")
+    commands = parser.add_subparsers(dest='command', required=True)
+    coordinator_parser = commands.add_parser('coordinator', help="Queue jobs and wait for their results")
+    jobs_source = coordinator_parser.add_mutually_exclusive_group(required=True)
+    jobs_source.add_argument('--jobs', metavar='PATH', help="JSON file listing the jobs, see load_jobs")
+    jobs_source.add_argument('--golden', metavar='DIRECTORY', help="Check the golden hashes of a golden suite")
+    coordinator_parser.add_argument('--rom-directory', default='roms', help="ROMs of the golden suite")
+    coordinator_parser.add_argument('--results', metavar='PATH', help="JSON lines file the results are appended to")
+    coordinator_parser.add_argument('--host', default='127.0.0.1', help="Address to listen on, 0.0.0.0 for workers on other machines")
+    coordinator_parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    coordinator_parser.add_argument('--local-workers', type=int, default=0, help="Worker processes to start on this machine")
+    coordinator_parser.add_argument('--max-attempts', type=int, default=DEFAULT_MAX_ATTEMPTS)
+    worker_parser = commands.add_parser('worker', help="Run the jobs of a coordinator")
+    worker_parser.add_argument('--host', default='127.0.0.1', help="Address of the coordinator")
+    worker_parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    worker_parser.add_argument('--name', help="Worker name in the results, the host name and process id by default")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO if args.command == 'coordinator' else logging.WARNING)
+
+    if args.command == 'worker':
+        run_worker(args.host, args.port, args.name)
+    else:
+        suite = GoldenSuite(args.golden, args.rom_directory) if args.golden else None
+        jobs = golden_jobs(suite) if suite is not None else load_jobs(args.jobs)
+        coordinator = JobCoordinator(ResultStore(args.results), args.host, args.port, args.max_attempts)
+        results = asyncio.run(coordinate(jobs, coordinator, args.local_workers))
+        failures = 0
+        for result in results:
+            expected = suite.hashes[result.job_id] if suite is not None else None
+            if result.status != JOB_DONE or (expected is not None and result.hashes != expected):
+                failures += 1
+                print("%s: %s after %d attempts on %s %s" % (result.job_id, result.status, result.attempts, result.worker, result.error or 'hash mismatch'))
+        print("%d jobs, %d failures" % (len(results), failures))
+        raise SystemExit(1 if failures else 0)
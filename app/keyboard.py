@@ -1,3 +1,4 @@
+import copy
 from typing import Mapping, Optional
 from app.engine.engine_handler import EngineHandler
 from app.key import Key
@@ -17,6 +18,13 @@ class Keyboard:
             self._on_key_pressed(key, False)
         
         
+    def detached_copy(self, engine: EngineHandler) -> 'Keyboard':
+        """ Copy of the pressed keys that doesn't listen to any engine, keys are then set with _on_key_pressed """
+        keyboard = copy.copy(self)
+        keyboard.engine = engine
+        keyboard.pressed_keys = dict(self.pressed_keys)
+        return keyboard
+
     def _on_key_pressed(self, key: Key, down: bool = True) -> None:
         logging.info("%s %s" % (key, "pressed" if down else "release"))
         self.pressed_keys[key] = down
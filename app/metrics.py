@@ -0,0 +1,184 @@
+import json
+import logging
+import threading
+from collections import deque
+from time import monotonic, time
+from typing import Optional
+
+DEFAULT_METRICS_PORT: int = 9464
+# Frames over which rates and percentiles are computed
+DEFAULT_WINDOW: int = 600
+DEFAULT_LOG_INTERVAL: float = 10.0 # Seconds
+PHASES: tuple[str, ...] = ('engine', 'cpu', 'render')
+QUANTILES: tuple[float, ...] = (0.5, 0.99)
+
+
+def percentile(sorted_values: list[float], quantile: float) -> float:
+    """ Nearest rank percentile of sorted values """
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(quantile * len(sorted_values) + 0.5) - 1))
+    return sorted_values[rank]
+
+
+class EmulatorMetrics:
+    """
+        Runtime metrics of an emulator loop: totals since the start, and rates and frame time percentiles
+        over the last frames. Frames are recorded by the emulation thread while the HTTP server reads
+        the metrics from its own thread, both under a lock.
+    """
+
+    def __init__(self, fps: int = 60, window: int = DEFAULT_WINDOW,
+        log_path: Optional[str] = None, log_interval: float = DEFAULT_LOG_INTERVAL) -> None:
+        self.budget = 1.0 / fps
+        self.frames = 0
+        self.instructions = 0
+        self.overruns = 0
+        self.sound_time = 0.0
+        self.input_events = 0
+        self.phase_time = {phase: 0.0 for phase in PHASES}
+        self.frame_time = 0.0
+        # (time, instructions, input events) of the last frames, and their durations
+        self._window: deque[tuple[float, int, int]] = deque(maxlen=window)
+        self._durations: deque[float] = deque(maxlen=window)
+        self._lock = threading.Lock()
+        # Instructions run by each kind of superinstruction, CPU.fusion_stats of the emulated CPU
+        self.fusion_stats: Optional[dict[str, int]] = None
+
+        self.log_path = log_path
+        self.log_interval = log_interval
+        self._last_log = monotonic()
+
+    def record_input(self, *_) -> None:
+        """ Engine key callback """
+        with self._lock:
+            self.input_events += 1
+
+    def record_frame(self, instructions: int, engine_time: float, cpu_time: float, render_time: float, sound: bool) -> None:
+        now = monotonic()
+        duration = engine_time + cpu_time + render_time
+        with self._lock:
+            self.frames += 1
+            self.instructions += instructions
+            self.phase_time['engine'] += engine_time
+            self.phase_time['cpu'] += cpu_time
+            self.phase_time['render'] += render_time
+            self.frame_time += duration
+            if duration > self.budget:
+                self.overruns += 1
+            if sound:
+                self.sound_time += self.budget
+            self._window.append((now, self.instructions, self.input_events))
+            self._durations.append(duration)
+        if self.log_path is not None and now - self._last_log >= self.log_interval:
+            self._last_log = now
+            self.write_log()
+
+    def _rates(self) -> tuple[float, float, float]:
+        """ Frames, instructions and input events per second over the window """
+        if len(self._window) < 2:
+            return 0.0, 0.0, 0.0
+        (start, start_instructions, start_inputs), (end, end_instructions, end_inputs) = self._window[0], self._window[-1]
+        elapsed = end - start
+        if elapsed <= 0:
+            return 0.0, 0.0, 0.0
+        return (len(self._window) - 1) / elapsed, (end_instructions - start_instructions) / elapsed, (end_inputs - start_inputs) / elapsed
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            fps, ips, inputs = self._rates()
+            durations = sorted(self._durations)
+            return {
+                'fps': fps,
+                'instructions_per_second': ips,
+                'input_events_per_second': inputs,
+                'frame_time': {'p%d' % (q * 100): percentile(durations, q) for q in QUANTILES},
+                'phase_seconds': dict(self.phase_time),
+                'frames': self.frames,
+                'instructions': self.instructions,
+                'overruns': self.overruns,
+                'sound_seconds': self.sound_time,
+                'input_events': self.input_events,
+            }
+
+    def prometheus_text(self) -> str:
+        """ Metrics in the Prometheus text exposition format """
+        snapshot = self.snapshot()
+        with self._lock:
+            durations = sorted(self._durations)
+            frame_time_sum, frame_count = self.frame_time, self.frames
+        lines = []
+
+        def metric(name: str, kind: str, description: str, samples: list[tuple[str, float]]) -> None:
+            lines.append('# HELP chip8_%s %s' % (name, description))
+            lines.append('# TYPE chip8_%s %s' % (name, kind))
+            lines.extend('chip8_%s%s %s' % (name, labels, repr(float(value))) for labels, value in samples)
+
+        metric('fps', 'gauge', "Emulated frames per second", [('', snapshot['fps'])])
+        metric('instructions_per_second', 'gauge', "Executed instructions per second", [('', snapshot['instructions_per_second'])])
+        metric('frames_total', 'counter', "Emulated frames", [('', snapshot['frames'])])
+        metric('instructions_total', 'counter', "Executed instructions", [('', snapshot['instructions'])])
+        metric('frame_phase_seconds_total', 'counter', "Time spent in each phase of the frames",
+            [('{phase="%s"}' % phase, seconds) for phase, seconds in snapshot['phase_seconds'].items()])
+        metric('frame_seconds', 'summary', "Frame time, without the wait for the next frame",
+            [('{quantile="%s"}' % q, percentile(durations, q)) for q in QUANTILES])
+        lines.append('chip8_frame_seconds_sum %r' % float(frame_time_sum))
+        lines.append('chip8_frame_seconds_count %r' % float(frame_count))
+        metric('frame_overruns_total', 'counter', "Frames that took longer than the frame budget", [('', snapshot['overruns'])])
+        metric('sound_seconds_total', 'counter', "Time the sound was on", [('', snapshot['sound_seconds'])])
+        metric('input_events_total', 'counter', "Key presses and releases", [('', snapshot['input_events'])])
+        metric('input_events_per_second', 'gauge', "Key presses and releases per second", [('', snapshot['input_events_per_second'])])
+        if self.fusion_stats is not None:
+            metric('fused_instructions_total', 'counter', "Instructions run as part of a superinstruction",
+                [('{sequence="%s"}' % name, count) for name, count in list(self.fusion_stats.items())])
+        return '\n'.join(lines) + '\n'
+
+    def write_log(self) -> None:
+        """ Appends the metrics as a JSON line to log_path """
+        entry = dict(self.snapshot(), time=time())
+        try:
+            with open(self.log_path, 'a') as f:
+                f.write(json.dumps(entry) + '\n')
+        except OSError as e:
+            logging.warning("Can't write metrics to %s: %s" % (self.log_path, e))
+
+
+class MetricsServer:
+    """ Serves the metrics at /metrics over HTTP, from a background thread """
+
+    def __init__(self, metrics: EmulatorMetrics, host: str = '127.0.0.1', port: int = DEFAULT_METRICS_PORT) -> None:
+        # Imported here, the emulator imports this module and only needs the server with --metrics-port
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        self.metrics = metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(handler) -> None:
+                if handler.path.split('?')[0] != '/metrics':
+                    handler.send_error(404)
+                    return
+                body = metrics.prometheus_text().encode()
+                handler.send_response(200)
+                handler.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                handler.send_header('Content-Length', str(len(body)))
+                handler.end_headers()
+                handler.wfile.write(body)
+
+            def log_message(handler, format: str, *arguments) -> None:
+                logging.debug("Metrics request: " + format % arguments)
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.host, self.port = self.server.server_address[:2]
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self.server.serve_forever, name='chip8-metrics', daemon=True)
+        self._thread.start()
+        logging.info("Serving metrics on http://%s:%d/metrics" % (self.host, self.port))
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
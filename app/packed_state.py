@@ -0,0 +1,196 @@
+import hashlib
+import struct
+from itertools import chain
+from typing import Optional, Union
+from app.constants import AUDIO_PATTERN_SIZE, MEMORY_SIZE, PLANE_COUNT, REGISTER_COUNT, SCREEN_SIZE, STACK_SIZE
+from app.cpu import CPU, CPUState
+
+Buffer = Union[bytearray, memoryview]
+
+# Fields of the packed state in layout order, little endian without padding, so packed states can be stored
+# in files. The 64-bit planes come first to be aligned for memoryview.cast, and memory last
+PACKED_FIELDS: list[tuple[str, str]] = [
+    ('planes', '%dQ' % (PLANE_COUNT * SCREEN_SIZE.y)),
+    ('rng_words', '625I'), # Mersenne Twister state of random.Random
+    ('stack', '%dI' % STACK_SIZE),
+    ('i', 'Q'),
+    ('pc', 'I'),
+    ('rng_gauss', 'd'),
+    ('sp', 'B'),
+    ('delay_timer', 'B'),
+    ('sound_timer', 'B'),
+    ('wait_for_key_reg', 'b'), # -1 when no instruction waits for a key
+    ('plane_mask', 'B'),
+    ('pattern_pitch', 'B'),
+    ('has_audio_pattern', '?'),
+    ('rng_version', 'B'),
+    ('has_rng_gauss', '?'),
+    ('registers', '%dB' % REGISTER_COUNT),
+    ('audio_pattern', '%ds' % AUDIO_PATTERN_SIZE),
+]
+FIXED_FIELDS = struct.Struct('<' + ''.join(field_format for _, field_format in PACKED_FIELDS))
+MEMORY_OFFSET: int = FIXED_FIELDS.size
+PACKED_STATE_SIZE: int = FIXED_FIELDS.size + MEMORY_SIZE
+
+
+def _field_offsets() -> dict[str, tuple[int, int]]:
+    """ (offset, size) of each field in the buffer """
+    offsets = {}
+    offset = 0
+    for name, field_format in PACKED_FIELDS:
+        size = struct.calcsize('<' + field_format)
+        offsets[name] = (offset, size)
+        offset += size
+    offsets['memory'] = (MEMORY_OFFSET, MEMORY_SIZE)
+    return offsets
+
+
+FIELD_OFFSETS: dict[str, tuple[int, int]] = _field_offsets()
+
+
+class PackedState:
+    """
+        Whole machine state in one contiguous buffer with a fixed layout, see PACKED_FIELDS.
+        Copying, hashing, comparing or sending a state to another process is a single operation on the buffer,
+        which can also live in shared memory. planes, registers and memory are memoryviews into the buffer,
+        planes in the host byte order (little endian on the supported platforms).
+    """
+
+    def __init__(self, buffer: Optional[Buffer] = None) -> None:
+        if buffer is None:
+            buffer = bytearray(PACKED_STATE_SIZE)
+        if len(buffer) != PACKED_STATE_SIZE:
+            raise ValueError("A packed state is %d bytes long, not %d" % (PACKED_STATE_SIZE, len(buffer)))
+        self.buffer = buffer
+        view = memoryview(buffer)
+        self.planes = self._view(view, 'planes').cast('Q')
+        self.registers = self._view(view, 'registers')
+        self.memory = self._view(view, 'memory')
+
+    @staticmethod
+    def _view(view: memoryview, name: str) -> memoryview:
+        offset, size = FIELD_OFFSETS[name]
+        return view[offset:offset + size]
+
+    def __getitem__(self, name: str) -> Union[int, float, bytes, tuple]:
+        """ Value of a field, a tuple for the array fields """
+        offset, _ = FIELD_OFFSETS[name]
+        if name == 'memory':
+            return bytes(self.memory)
+        field_format = dict(PACKED_FIELDS)[name]
+        values = struct.unpack_from('<' + field_format, self.buffer, offset)
+        return values[0] if len(values) == 1 else values
+
+    def capture(self, cpu: CPU) -> 'PackedState':
+        """ Packs the state of cpu into the buffer: one struct pack and one memory copy """
+        renderer = cpu.renderer
+        speaker = cpu.speaker
+        version, words, gauss = cpu.rng.getstate()
+        FIXED_FIELDS.pack_into(self.buffer, 0,
+            *chain.from_iterable(renderer.planes),
+            *words,
+            *cpu.stack,
+            cpu.i,
+            cpu.pc,
+            gauss or 0.0,
+            cpu.sp,
+            cpu.delay_timer,
+            cpu.sound_timer,
+            -1 if cpu.wait_for_key_reg is None else cpu.wait_for_key_reg,
+            renderer.plane_mask,
+            speaker.pattern_pitch,
+            speaker.pattern is not None,
+            version,
+            gauss is not None,
+            *cpu.registers,
+            speaker.pattern or b'')
+        memory = cpu.memory
+        self.memory[:] = memory if len(memory) == MEMORY_SIZE else memory[:MEMORY_SIZE]
+        return self
+
+    @classmethod
+    def from_cpu(cls, cpu: CPU) -> 'PackedState':
+        return cls().capture(cpu)
+
+    def restore(self, cpu: CPU) -> None:
+        """ Puts cpu in the packed state, like CPU.restore """
+        fields = FIXED_FIELDS.unpack_from(self.buffer)
+        rows = PLANE_COUNT * SCREEN_SIZE.y
+        stack_end = rows + 625 + STACK_SIZE
+        (i, pc, gauss, sp, delay_timer, sound_timer, wait_for_key_reg, plane_mask, pattern_pitch,
+            has_audio_pattern, version, has_gauss) = fields[stack_end:stack_end + 12]
+        cpu.memory = bytearray(self.memory)
+        cpu.memory_shared = False
+        cpu.registers = list(fields[stack_end + 12:stack_end + 12 + REGISTER_COUNT])
+        cpu.i = i
+        cpu.pc = pc
+        cpu.sp = sp
+        cpu.stack = list(fields[rows + 625:stack_end])
+        cpu.delay_timer = delay_timer
+        cpu.sound_timer = sound_timer
+        cpu.wait_for_key_reg = None if wait_for_key_reg < 0 else wait_for_key_reg
+        renderer = cpu.renderer
+        for plane, plane_rows in enumerate(renderer.planes):
+            plane_rows[:] = fields[plane * SCREEN_SIZE.y:(plane + 1) * SCREEN_SIZE.y]
+        renderer.plane_mask = plane_mask
+        renderer.dirty = True
+        cpu.speaker.pattern = fields[-1] if has_audio_pattern else None
+        cpu.speaker.pattern_pitch = pattern_pitch
+        cpu.rng.setstate((version, fields[rows:rows + 625], gauss if has_gauss else None))
+
+    def to_state(self) -> CPUState:
+        fields = {name: self[name] for name, _ in PACKED_FIELDS}
+        planes = fields['planes']
+        return CPUState(
+            bytes(self.memory),
+            fields['registers'],
+            fields['i'],
+            fields['pc'],
+            fields['sp'],
+            fields['stack'],
+            fields['delay_timer'],
+            fields['sound_timer'],
+            None if fields['wait_for_key_reg'] < 0 else fields['wait_for_key_reg'],
+            tuple(planes[plane * SCREEN_SIZE.y:(plane + 1) * SCREEN_SIZE.y] for plane in range(PLANE_COUNT)),
+            fields['plane_mask'],
+            fields['audio_pattern'] if fields['has_audio_pattern'] else None,
+            fields['pattern_pitch'],
+            (fields['rng_version'], fields['rng_words'], fields['rng_gauss'] if fields['has_rng_gauss'] else None))
+
+    @classmethod
+    def from_state(cls, state: CPUState) -> 'PackedState':
+        packed = cls()
+        version, words, gauss = state.rng_state
+        FIXED_FIELDS.pack_into(packed.buffer, 0,
+            *chain.from_iterable(state.planes),
+            *words,
+            *state.stack,
+            state.i,
+            state.pc,
+            gauss or 0.0,
+            state.sp,
+            state.delay_timer,
+            state.sound_timer,
+            -1 if state.wait_for_key_reg is None else state.wait_for_key_reg,
+            state.plane_mask,
+            state.pattern_pitch,
+            state.audio_pattern is not None,
+            version,
+            gauss is not None,
+            *state.registers,
+            state.audio_pattern or b'')
+        packed.memory[:] = state.memory
+        return packed
+
+    def copy(self) -> 'PackedState':
+        return PackedState(bytearray(self.buffer))
+
+    def digest(self) -> str:
+        return hashlib.sha1(self.buffer).hexdigest()
+
+    def diff(self, other: 'PackedState') -> list[str]:
+        """ Names of the fields that differ between two states """
+        if self.buffer == other.buffer:
+            return []
+        return [name for name, (offset, size) in FIELD_OFFSETS.items()
+            if self.buffer[offset:offset + size] != other.buffer[offset:offset + size]]
@@ -0,0 +1,401 @@
+import logging
+import multiprocessing
+import struct
+from enum import IntEnum
+from multiprocessing.connection import Connection
+from multiprocessing.shared_memory import SharedMemory
+from time import perf_counter, sleep
+from typing import Any, Callable, Optional
+from app.constants import PLANE_COUNT, REGISTER_COUNT, SCREEN_SIZE
+from app.cpu import CPU, CPUState
+from app.emulator import Emulator
+from app.engine.headless_engine_handler import HeadlessEngineHandler
+from app.frame_codec import FrameRows, copy_frame
+from app.key import Key
+from app.keyboard import Keyboard
+from app.quirks import DEFAULT_PROFILE, get_quirks
+from app.renderer import Renderer
+from app.speaker import Speaker
+
+# Layout of the shared block: frame sequence number, emulated frame count, status, sound,
+# the rows of every plane as 64-bit ints, then one byte per keypad key
+SEQUENCE = struct.Struct('<Q')
+FRAME_COUNT = struct.Struct('<Q')
+PLANES = struct.Struct('>%dQ' % (PLANE_COUNT * SCREEN_SIZE.y))
+FRAME_COUNT_OFFSET = 8
+STATUS_OFFSET = 16
+SOUND_OFFSET = 17
+PLANES_OFFSET = 24
+KEYPAD_OFFSET = PLANES_OFFSET + PLANES.size
+SHARED_SIZE = KEYPAD_OFFSET + REGISTER_COUNT
+
+KEYPAD: list[Key] = [Key(value) for value in range(REGISTER_COUNT)]
+# Attempts at reading a frame while the core keeps writing new ones
+READ_ATTEMPTS: int = 4
+
+
+class CoreStatus(IntEnum):
+    STARTING = 0
+    RUNNING = 1
+    PAUSED = 2
+    STOPPED = 3
+    CRASHED = 4
+
+
+class CoreCrashedError(RuntimeError):
+    pass
+
+
+class SharedFrame:
+    """
+        View over the block shared by the UI and the core process. The core is the only writer of the frame,
+        the UI the only writer of the keypad. The sequence number is odd while a frame is being written:
+        a reader that sees it odd or changed retries instead of taking a torn frame.
+    """
+
+    def __init__(self, memory: SharedMemory) -> None:
+        self.memory = memory
+        self.buffer = memory.buf
+
+    @property
+    def sequence(self) -> int:
+        return SEQUENCE.unpack_from(self.buffer)[0]
+
+    @property
+    def frame_number(self) -> int:
+        """ Number of different frames written so far """
+        return self.sequence // 2
+
+    @property
+    def frame_count(self) -> int:
+        """ Number of frames emulated so far """
+        return FRAME_COUNT.unpack_from(self.buffer, FRAME_COUNT_OFFSET)[0]
+
+    @frame_count.setter
+    def frame_count(self, count: int) -> None:
+        FRAME_COUNT.pack_into(self.buffer, FRAME_COUNT_OFFSET, count)
+
+    @property
+    def status(self) -> CoreStatus:
+        return CoreStatus(self.buffer[STATUS_OFFSET])
+
+    @status.setter
+    def status(self, status: CoreStatus) -> None:
+        self.buffer[STATUS_OFFSET] = status
+
+    @property
+    def sound(self) -> bool:
+        return bool(self.buffer[SOUND_OFFSET])
+
+    @sound.setter
+    def sound(self, playing: bool) -> None:
+        self.buffer[SOUND_OFFSET] = playing
+
+    def write_frame(self, planes: FrameRows) -> None:
+        buffer = self.buffer
+        sequence = SEQUENCE.unpack_from(buffer)[0] + 1
+        SEQUENCE.pack_into(buffer, 0, sequence)
+        PLANES.pack_into(buffer, PLANES_OFFSET, *[row for rows in planes for row in rows])
+        SEQUENCE.pack_into(buffer, 0, sequence + 1)
+
+    def read_frame(self, planes: list[list[int]], last_frame: int) -> Optional[int]:
+        """ Reads the rows into planes if a frame newer than last_frame is there, and returns its number """
+        buffer = self.buffer
+        for _ in range(READ_ATTEMPTS):
+            sequence = SEQUENCE.unpack_from(buffer)[0]
+            if sequence & 1:
+                continue
+            if sequence // 2 == last_frame:
+                return None
+            rows = PLANES.unpack_from(buffer, PLANES_OFFSET)
+            if SEQUENCE.unpack_from(buffer)[0] != sequence:
+                continue
+            height = SCREEN_SIZE.y
+            for plane, target in enumerate(planes):
+                target[:] = rows[plane * height:(plane + 1) * height]
+            return sequence // 2
+        return None
+
+    def set_key(self, key: Key, down: bool) -> None:
+        if key in KEYPAD:
+            self.buffer[KEYPAD_OFFSET + key.value] = down
+
+    def is_key_pressed(self, key: Key) -> bool:
+        return bool(self.buffer[KEYPAD_OFFSET + key.value])
+
+
+class CoreLoop:
+    """ Runs in the core process: emulates frames at fps and answers the commands received on the pipe """
+
+    def __init__(self,
+        shared: SharedFrame,
+        connection: Connection,
+        rom: bytes,
+        cycles_per_frame: int,
+        quirks: str = DEFAULT_PROFILE,
+        fps: int = 60,
+        seed: Optional[int] = None) -> None:
+        self.shared = shared
+        self.connection = connection
+        self.fps = fps
+        self.engine = HeadlessEngineHandler(size=SCREEN_SIZE)
+        renderer = Renderer(self.engine, 1, (255, 255, 255))
+        self.cpu = CPU(cycles_per_frame, renderer, Keyboard(self.engine), Speaker(self.engine, 440), seed=seed, quirks=get_quirks(quirks))
+        self.cpu.load_rom_bytes(rom)
+        self.initial_state = self.cpu.snapshot()
+        self.paused = False
+        self.running = True
+        self._written: Optional[list[list[int]]] = None
+
+        self.commands: dict[str, Callable[..., Any]] = {
+            'pause': self.pause,
+            'resume': self.resume,
+            'reset': self.reset,
+            'snapshot': self.cpu.snapshot,
+            'restore': self.restore,
+            'stop': self.stop,
+        }
+
+    def pause(self) -> None:
+        self.paused = True
+        self.shared.status = CoreStatus.PAUSED
+
+    def resume(self) -> None:
+        self.paused = False
+        self.shared.status = CoreStatus.RUNNING
+
+    def reset(self) -> None:
+        self.restore(self.initial_state)
+
+    def restore(self, state: CPUState) -> None:
+        self.cpu.restore(state)
+        self.publish_frame()
+
+    def stop(self) -> None:
+        self.running = False
+
+    def publish_frame(self) -> None:
+        planes = self.cpu.renderer.planes
+        if planes != self._written:
+            self.shared.write_frame(planes)
+            self._written = copy_frame(planes)
+
+    def step_frame(self) -> None:
+        shared = self.shared
+        keyboard = self.cpu.keyboard
+        for key in KEYPAD:
+            down = shared.is_key_pressed(key)
+            if keyboard.is_key_pressed(key) != down:
+                if down:
+                    self.engine.press(key)
+                else:
+                    self.engine.release(key)
+
+        self.cpu.update()
+        self.publish_frame()
+        shared.sound = self.engine.sound_playing
+        shared.frame_count += 1
+
+    def _handle_command(self) -> None:
+        command, arguments = self.connection.recv()
+        self.connection.send(('ok', self.commands[command](*arguments)))
+
+    def _wait_until(self, deadline: float) -> None:
+        """ Sleeps until deadline, answering commands as they arrive """
+        while self.running:
+            delay = deadline - perf_counter()
+            if not self.connection.poll(max(0.0, delay)):
+                return
+            self._handle_command()
+            if delay <= 0:
+                return
+
+    def run(self) -> None:
+        step = 1.0 / self.fps
+        self.publish_frame()
+        self.shared.status = CoreStatus.RUNNING
+        deadline = perf_counter()
+        try:
+            while self.running:
+                if not self.paused:
+                    self.step_frame()
+                deadline += step
+                if perf_counter() - deadline > step:
+                    # More than a frame late: drop the backlog instead of running a burst of frames
+                    deadline = perf_counter()
+                self._wait_until(deadline)
+        except (EOFError, OSError):
+            logging.warning("UI process went away, stopping the core")
+        except Exception as e:
+            logging.error("Core stopped: %r" % e)
+            self.shared.status = CoreStatus.CRASHED
+            self.connection.send(('error', repr(e)))
+            return
+        self.shared.status = CoreStatus.STOPPED
+
+
+def run_core(memory_name: str, connection: Connection, rom: bytes, cycles_per_frame: int,
+    quirks: str, fps: int, seed: Optional[int]) -> None:
+    """ Entry point of the core process """
+    memory = SharedMemory(memory_name)
+    try:
+        CoreLoop(SharedFrame(memory), connection, rom, cycles_per_frame, quirks, fps, seed).run()
+    finally:
+        connection.close()
+        memory.close()
+
+
+class CoreProcess:
+    """
+        UI side of an emulator core running in a child process. The frame, sound and keypad are exchanged
+        through shared memory, read and written in place. Commands go through a pipe, each one answered
+        by the core. The child is spawned rather than forked so it starts without the UI libraries.
+    """
+
+    def __init__(self,
+        rom: bytes,
+        cycles_per_frame: int,
+        quirks: str = DEFAULT_PROFILE,
+        fps: int = 60,
+        seed: Optional[int] = None) -> None:
+        self.memory = SharedMemory(create=True, size=SHARED_SIZE)
+        self.shared = SharedFrame(self.memory)
+        self.error: Optional[str] = None
+        context = multiprocessing.get_context('spawn')
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(target=run_core, name='chip8-core', daemon=True,
+            args=(self.memory.name, child_connection, rom, cycles_per_frame, quirks, fps, seed))
+        self.process.start()
+        child_connection.close()
+
+    @property
+    def alive(self) -> bool:
+        return self.error is None and self.process.is_alive()
+
+    def check(self) -> Optional[str]:
+        """ Error the core crashed with, if any """
+        if self.error is None and self.shared.status == CoreStatus.CRASHED and self.connection.poll():
+            reply, value = self.connection.recv()
+            if reply == 'error':
+                self.error = value
+        elif self.error is None and not self.process.is_alive() and self.shared.status != CoreStatus.STOPPED:
+            self.error = "Core process exited with code %s" % self.process.exitcode
+        return self.error
+
+    def request(self, command: str, *arguments: Any) -> Any:
+        if self.error is not None:
+            raise CoreCrashedError(self.error)
+        try:
+            self.connection.send((command, arguments))
+            reply, value = self.connection.recv()
+        except (EOFError, OSError) as e:
+            self.error = "Core process exited"
+            raise CoreCrashedError(self.error) from e
+        if reply == 'error':
+            self.error = value
+            raise CoreCrashedError(value)
+        return value
+
+    def pause(self) -> None:
+        self.request('pause')
+
+    def resume(self) -> None:
+        self.request('resume')
+
+    def reset(self) -> None:
+        self.request('reset')
+
+    def snapshot(self) -> CPUState:
+        return self.request('snapshot')
+
+    def restore(self, state: CPUState) -> None:
+        self.request('restore', state)
+
+    def close(self, timeout: float = 5.0) -> None:
+        if self.process.is_alive():
+            try:
+                self.request('stop')
+            except CoreCrashedError:
+                pass
+            self.process.join(timeout)
+            if self.process.is_alive():
+                self.process.terminate()
+                self.process.join()
+        self.connection.close()
+        self.memory.close()
+        self.memory.unlink()
+
+
+class ProcessEmulator:
+    """
+        Runs the CPU of an emulator in a CoreProcess while this process handles the window: input,
+        rendering and sound. A ROM crashing the core leaves the window open on the last frame.
+        Only the square wave sound is played, XO-CHIP audio patterns stay in the core.
+    """
+
+    def __init__(self, emulator: Emulator, seed: Optional[int] = None) -> None:
+        if emulator.tuner is not None:
+            raise ValueError("Auto-tuning measures renders on the emulation thread and can't run out of process")
+        self.emulator = emulator
+        self.engine = emulator.engine
+        self.renderer = emulator.cpu.renderer
+        self.seed = seed
+        self.core: Optional[CoreProcess] = None
+        self.frame_number = -1
+        self._sound = False
+        self._crash_reported = False
+
+        self.engine.keydown_callbacks[:] = [lambda key: self._set_key(key, True)]
+        self.engine.keyup_callbacks[:] = [lambda key: self._set_key(key, False)]
+
+    def _set_key(self, key: Key, down: bool) -> None:
+        if self.core is not None:
+            self.core.shared.set_key(key, down)
+
+    def start(self, rom: bytes) -> CoreProcess:
+        profile = self.emulator.quirks_profile(rom)
+        logging.info("Using %s quirks" % profile)
+        self.core = CoreProcess(rom, self.emulator.cpu.cycles_per_frame, profile, self.emulator.fps, self.seed)
+        return self.core
+
+    def render_frame(self, core: CoreProcess) -> bool:
+        """ One frame of the UI process, returns False once the window is closed """
+        running = self.engine.update()
+        frame_number = core.shared.read_frame(self.renderer.planes, self.frame_number)
+        if frame_number is not None:
+            self.frame_number = frame_number
+            self.renderer.dirty = True
+        if self.emulator.recorder is not None:
+            self.emulator.recorder.capture(self.renderer.planes)
+        self.renderer.render()
+
+        sound = core.shared.sound
+        if sound != self._sound:
+            if sound:
+                self.engine.play_sound(self.emulator.cpu.speaker.pitch)
+            else:
+                self.engine.stop_sound()
+            self._sound = sound
+
+        if not self._crash_reported and core.check() is not None:
+            logging.error("Emulator core crashed: %s" % core.error)
+            self.engine.stop_sound()
+            self._crash_reported = True
+        return running
+
+    def run_rom(self, rom_path: str) -> None:
+        with open(rom_path, 'rb') as f:
+            rom = f.read()
+        core = self.start(rom)
+        self.engine.start()
+        step = 1.0 / self.emulator.fps
+        try:
+            while True:
+                start = perf_counter()
+                if not self.render_frame(core):
+                    break
+                sleep(max(0, step - (perf_counter() - start)))
+        finally:
+            core.close()
+            if self.emulator.recorder is not None:
+                self.emulator.recorder.close()
@@ -0,0 +1,77 @@
+import json
+import logging
+import os
+from typing import NamedTuple, Optional
+from app.rom_library import Platform, detect_platform, rom_hash
+
+DEFAULT_QUIRKS_DATABASE: str = os.path.join(os.path.expanduser('~'), '.config', 'pychip8', 'quirks.json')
+
+
+class Quirks(NamedTuple):
+    """ Behaviours that differ between CHIP-8 variants. The defaults are the historical behaviour of this emulator """
+    shift_uses_vy: bool = False           # 8XY6/8XYE shift VY into VX instead of shifting VX
+    load_store_increments_i: bool = False # FX55/FX65 leave I after the last register
+    jump_uses_vx: bool = False            # BNNN jumps to NNN plus VX, X being the highest digit of NNN
+    clip_sprites: bool = False            # Sprites are clipped at the screen edges instead of wrapping
+    logic_resets_vf: bool = False         # 8XY1/8XY2/8XY3 set VF to 0
+
+    def key(self) -> str:
+        """ Short identifier, one digit per quirk """
+        return ''.join('1' if enabled else '0' for enabled in self)
+
+
+QUIRK_PROFILES: dict[str, Quirks] = {
+    'modern': Quirks(),
+    'cosmac': Quirks(shift_uses_vy=True, load_store_increments_i=True, clip_sprites=True, logic_resets_vf=True),
+    'schip': Quirks(jump_uses_vx=True, clip_sprites=True),
+    'xo-chip': Quirks(shift_uses_vy=True, load_store_increments_i=True),
+}
+DEFAULT_PROFILE: str = 'modern'
+
+PLATFORM_PROFILES: dict[Platform, str] = {
+    Platform.CHIP8: DEFAULT_PROFILE,
+    Platform.SCHIP: 'schip',
+    Platform.XOCHIP: 'xo-chip',
+}
+
+
+class UnknownQuirksProfileError(ValueError):
+    pass
+
+
+def get_quirks(profile: str) -> Quirks:
+    if profile not in QUIRK_PROFILES:
+        raise UnknownQuirksProfileError("Unknown quirks profile %r, expected one of %s" % (profile, ', '.join(sorted(QUIRK_PROFILES))))
+    return QUIRK_PROFILES[profile]
+
+
+def load_quirks_database(path: str = DEFAULT_QUIRKS_DATABASE) -> dict[str, str]:
+    """
+        Profile names by ROM SHA-1, from a JSON object. A missing or invalid file is an empty database.
+        Entries naming an unknown profile are left out: these ROMs get the profile of their platform
+    """
+    try:
+        with open(path, 'r') as f:
+            database = json.load(f)
+        if not isinstance(database, dict):
+            raise ValueError("expected a JSON object")
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logging.warning("Ignoring invalid quirks database %s: %s" % (path, e))
+        return {}
+    profiles = {}
+    for sha1, profile in database.items():
+        if profile in QUIRK_PROFILES:
+            profiles[str(sha1)] = profile
+        else:
+            logging.warning("Ignoring unknown quirks profile %r for ROM %s in %s" % (profile, sha1, path))
+    return profiles
+
+
+def profile_for_rom(rom: bytes, database: Optional[dict[str, str]] = None) -> str:
+    """ Profile listed for the ROM hash in the database, else the one of the platform the ROM was written for """
+    profile = (database or {}).get(rom_hash(rom))
+    if profile is not None:
+        return profile
+    return PLATFORM_PROFILES[detect_platform(rom)]
@@ -0,0 +1,247 @@
+import argparse
+import os
+import struct
+import zlib
+from typing import BinaryIO, Iterator, Optional, Sequence, Tuple
+from app.constants import DEFAULT_PALETTE, PLANE_COUNT, SCREEN_SIZE
+from app.frame_codec import FrameDecoder, FrameRows, copy_frame, encode_frame
+
+RECORDING_MAGIC: bytes = b'CH8REC01'
+# Magic, fps, then the palette as 4 RGB triplets
+RECORDING_HEADER = struct.Struct('>8sH12B')
+FRAME_LENGTH = struct.Struct('>H')
+
+DEFAULT_BUFFER_SIZE: int = 1024 * 1024
+
+Palette = Sequence[Tuple[int, int, int]]
+
+
+class RecordingError(ValueError):
+    pass
+
+
+class FrameRecorder:
+    """
+        Writes presented frames to disk. Frames are encoded with app.frame_codec, only storing the rows
+        that changed, and unchanged frames are not written at all: their frame number is implied by the
+        next recorded frame. A final empty delta marks the last frame of the recording.
+    """
+
+    def __init__(self, path: str, fps: int = 60, palette: Palette = DEFAULT_PALETTE, buffer_size: int = DEFAULT_BUFFER_SIZE) -> None:
+        self.path = path
+        self.file: BinaryIO = open(path, 'wb', buffering=buffer_size)
+        self.file.write(RECORDING_HEADER.pack(RECORDING_MAGIC, fps, *[c for color in palette[:4] for c in color]))
+        self.frame_number = 0
+        self._previous_frame: Optional[list[list[int]]] = None
+
+    def capture(self, planes: FrameRows) -> None:
+        if self._previous_frame is None or planes != self._previous_frame:
+            self._write(encode_frame(self.frame_number, planes, self._previous_frame))
+            self._previous_frame = copy_frame(planes)
+        self.frame_number += 1
+
+    def _write(self, message: bytes) -> None:
+        self.file.write(FRAME_LENGTH.pack(len(message)))
+        self.file.write(message)
+
+    def close(self) -> None:
+        if self.file.closed:
+            return
+        if self._previous_frame is not None:
+            self._write(encode_frame(self.frame_number, self._previous_frame, self._previous_frame))
+        self.file.close()
+
+    def __enter__(self) -> 'FrameRecorder':
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+
+class RecordingReader:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(path, 'rb') as f:
+            header = f.read(RECORDING_HEADER.size)
+        if len(header) < RECORDING_HEADER.size or not header.startswith(RECORDING_MAGIC):
+            raise RecordingError("%s is not a frame recording" % path)
+        fields = RECORDING_HEADER.unpack(header)
+        self.fps: int = fields[1]
+        self.palette: list[Tuple[int, int, int]] = [tuple(fields[2 + i * 3:5 + i * 3]) for i in range(4)]
+
+    def frames(self) -> Iterator[Tuple[int, list[list[int]]]]:
+        """
+            Yields (frame number, planes) for each recorded frame. The planes stay on screen until the next
+            frame number; the last item is the end marker and repeats the previous planes.
+        """
+        decoder = FrameDecoder()
+        with open(self.path, 'rb') as f:
+            f.seek(RECORDING_HEADER.size)
+            while True:
+                length_bytes = f.read(FRAME_LENGTH.size)
+                if not length_bytes:
+                    return
+                length, = FRAME_LENGTH.unpack(length_bytes)
+                message = f.read(length)
+                if len(message) < length:
+                    raise RecordingError("Truncated recording %s" % self.path)
+                frame_number = decoder.apply(message)
+                yield frame_number, decoder.planes
+
+    def durations(self) -> Iterator[Tuple[list[list[int]], int]]:
+        """ Yields (planes, number of frames shown) pairs """
+        previous: Optional[Tuple[int, list[list[int]]]] = None
+        for frame_number, planes in self.frames():
+            if previous is not None:
+                yield previous[1], frame_number - previous[0]
+            previous = (frame_number, copy_frame(planes))
+
+
+def frame_indices(planes: FrameRows, scale: int) -> list[bytes]:
+    """ Converts planes to scaled rows of palette indices """
+    width = SCREEN_SIZE.x
+    rows = []
+    for y in range(SCREEN_SIZE.y):
+        indices = bytearray(width)
+        for plane in range(PLANE_COUNT):
+            row = planes[plane][y]
+            if not row:
+                continue
+            for x, bit in enumerate(format(row, '0%db' % width)):
+                if bit == '1':
+                    indices[x] |= 1 << plane
+        scaled = bytes(index for index in indices for _ in range(scale))
+        rows.extend([scaled] * scale)
+    return rows
+
+
+##############
+# PNG export #
+##############
+
+def _png_chunk(kind: bytes, data: bytes) -> bytes:
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xFFFFFFFF)
+
+
+def encode_png(rows: list[bytes], palette: Palette) -> bytes:
+    """ Encodes rows of palette indices as an 8 bits paletted PNG """
+    header = struct.pack('>IIBBBBB', len(rows[0]), len(rows), 8, 3, 0, 0, 0)
+    raw = b''.join(b'\x00' + row for row in rows)
+    return b'\x89PNG\r\n\x1a\n' + _png_chunk(b'IHDR', header) \
+        + _png_chunk(b'PLTE', bytes(c for color in palette for c in color)) \
+        + _png_chunk(b'IDAT', zlib.compress(raw, 9)) + _png_chunk(b'IEND', b'')
+
+
+def export_png_sequence(recording_path: str, directory: str, scale: int = 8) -> int:
+    """ Writes one PNG per emulated frame and returns the number of files written """
+    reader = RecordingReader(recording_path)
+    os.makedirs(directory, exist_ok=True)
+    count = 0
+    for planes, duration in reader.durations():
+        png = encode_png(frame_indices(planes, scale), reader.palette)
+        for _ in range(duration):
+            with open(os.path.join(directory, 'frame_%06d.png' % count), 'wb') as f:
+                f.write(png)
+            count += 1
+    return count
+
+
+##############
+# GIF export #
+##############
+
+def lzw_encode(indices: bytes, min_code_size: int) -> bytes:
+    """ GIF flavoured LZW compression, codes are packed least significant bit first """
+    clear_code = 1 << min_code_size
+    end_code = clear_code + 1
+    code_size = min_code_size + 1
+
+    output = bytearray()
+    bit_buffer = 0
+    bit_count = 0
+
+    def emit(code: int) -> None:
+        nonlocal bit_buffer, bit_count
+        bit_buffer |= code << bit_count
+        bit_count += code_size
+        while bit_count >= 8:
+            output.append(bit_buffer & 0xFF)
+            bit_buffer >>= 8
+            bit_count -= 8
+
+    # Strings are identified by (code of their prefix, last index)
+    table: dict[Tuple[int, int], int] = {}
+    next_code = end_code + 1
+    emit(clear_code)
+    current: Optional[int] = None
+    for index in indices:
+        if current is None:
+            current = index
+            continue
+        code = table.get((current, index))
+        if code is not None:
+            current = code
+            continue
+        emit(current)
+        if next_code < 4096:
+            table[(current, index)] = next_code
+            if next_code == 1 << code_size:
+                code_size += 1
+            next_code += 1
+        else:
+            emit(clear_code)
+            table = {}
+            next_code = end_code + 1
+            code_size = min_code_size + 1
+        current = index
+    if current is not None:
+        emit(current)
+    emit(end_code)
+    if bit_count:
+        output.append(bit_buffer & 0xFF)
+    return bytes(output)
+
+
+def _gif_sub_blocks(data: bytes) -> bytes:
+    blocks = b''.join(bytes([len(data[i:i + 255])]) + data[i:i + 255] for i in range(0, len(data), 255))
+    return blocks + b'\x00'
+
+
+def export_gif(recording_path: str, output_path: str, scale: int = 8) -> int:
+    """ Writes an animated GIF of the recording and returns the number of GIF frames """
+    reader = RecordingReader(recording_path)
+    width, height = SCREEN_SIZE.x * scale, SCREEN_SIZE.y * scale
+    min_code_size = 2 # 4 colors
+
+    count = 0
+    # GIF delays are in hundredths of a second: carry the rounding error over to the next frame
+    elapsed = 0.0
+    shown = 0
+    with open(output_path, 'wb', buffering=DEFAULT_BUFFER_SIZE) as f:
+        f.write(b'GIF89a' + struct.pack('<HHBBB', width, height, 0xF1, 0, 0))
+        f.write(bytes(c for color in reader.palette for c in color))
+        # Loop forever
+        f.write(b'\x21\xFF\x0BNETSCAPE2.0\x03\x01\x00\x00\x00')
+        for planes, duration in reader.durations():
+            elapsed += duration * 100 / reader.fps
+            delay = round(elapsed) - shown
+            shown += delay
+            f.write(struct.pack('<BBBBHBB', 0x21, 0xF9, 4, 0, delay, 0, 0))
+            f.write(struct.pack('<BHHHHB', 0x2C, 0, 0, width, height, 0))
+            f.write(bytes([min_code_size]) + _gif_sub_blocks(lzw_encode(b''.join(frame_indices(planes, scale)), min_code_size)))
+            count += 1
+        f.write(b'\x3B')
+    return count
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Export a frame recording")
+    parser.add_argument('format', choices=['gif', 'png'])
+    parser.add_argument('recording')
+    parser.add_argument('output', help="GIF file, or directory for the PNG sequence")
+    parser.add_argument('--scale', type=int, default=8)
+    args = parser.parse_args()
+    if args.format == 'gif':
+        print("%d frames written" % export_gif(args.recording, args.output, args.scale))
+    else:
+        print("%d frames written" % export_png_sequence(args.recording, args.output, args.scale))
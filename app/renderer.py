@@ -1,40 +1,181 @@
+import copy
 import logging
-from typing import Mapping, Tuple
-from app.constants import SCREEN_SIZE
+import re
+from typing import Iterator, MutableMapping, Optional, Sequence, Tuple
+from app.constants import DEFAULT_PALETTE, PLANE_COUNT, SCREEN_SIZE
 from app.engine.engine_handler import EngineHandler
 from app.engine.vector2 import Vector2
 
+ROW_MASK: int = (1 << SCREEN_SIZE.x) - 1
+SPRITE_WIDTH: int = 8
+
+_RUN_PATTERN = re.compile('1+')
+
+
+class PixelView(MutableMapping):
+    """
+        Mapping view of a single plane keyed by position, kept for code that
+        reads or writes pixels one at a time.
+    """
+    def __init__(self, renderer: 'Renderer', plane: int = 0) -> None:
+        self.renderer = renderer
+        self.plane = plane
+
+    def _bit(self, pos: Vector2) -> int:
+        if not (0 <= pos.x < SCREEN_SIZE.x and 0 <= pos.y < SCREEN_SIZE.y):
+            raise KeyError(pos)
+        return 1 << (SCREEN_SIZE.x - 1 - pos.x)
+
+    def __getitem__(self, pos: Vector2) -> bool:
+        bit = self._bit(pos)
+        return bool(self.renderer.planes[self.plane][pos.y] & bit)
+
+    def __setitem__(self, pos: Vector2, value: bool) -> None:
+        bit = self._bit(pos)
+        rows = self.renderer.planes[self.plane]
+        rows[pos.y] = (rows[pos.y] | bit) if value else (rows[pos.y] & ~bit)
+        self.renderer.dirty = True
+
+    def __delitem__(self, pos: Vector2) -> None:
+        self[pos] = False
+
+    def __iter__(self) -> Iterator[Vector2]:
+        for y in range(SCREEN_SIZE.y):
+            for x in range(SCREEN_SIZE.x):
+                yield Vector2(x, y)
+
+    def __len__(self) -> int:
+        return SCREEN_SIZE.x * SCREEN_SIZE.y
+
+
 class Renderer():
-    def __init__(self, engine: EngineHandler, scale: int, color: Tuple[int, int, int]) -> None:
+    def __init__(self,
+        engine: EngineHandler,
+        scale: int,
+        color: Tuple[int, int, int],
+        palette: Optional[Sequence[Tuple[int, int, int]]] = None) -> None:
         self.engine = engine
         self.scale = Vector2(scale, scale)
         self.color = color
+        self.palette = list(palette or DEFAULT_PALETTE)
+        self.palette[1] = color
 
-        self.pixels: Mapping[Vector2, bool] = {}
+        # Each plane is a list of rows, each row packed into an int where
+        # the most significant bit is the leftmost pixel
+        self.planes: list[list[int]] = [[0] * SCREEN_SIZE.y for _ in range(PLANE_COUNT)]
+        self.plane_mask = 0b1 # XO-CHIP planes selected for drawing and clearing
+        self.dirty = True
+        self.pixels: MutableMapping[Vector2, bool] = PixelView(self)
         self.clear_pixels()
-    
+
+    def detached_copy(self, engine: EngineHandler) -> 'Renderer':
+        """ Copy of the screen state drawing to another engine """
+        renderer = copy.copy(self)
+        renderer.engine = engine
+        renderer.planes = [rows[:] for rows in self.planes]
+        renderer.pixels = PixelView(renderer)
+        return renderer
+
+    def select_planes(self, mask: int) -> None:
+        self.plane_mask = mask & ((1 << PLANE_COUNT) - 1)
+
+    def selected_planes(self) -> list[list[int]]:
+        return [rows for index, rows in enumerate(self.planes) if self.plane_mask & (1 << index)]
+
     def clear_pixels(self) -> None:
-        for x in range(SCREEN_SIZE.x):
-            for y in range(SCREEN_SIZE.y):
-                self.pixels[Vector2(x, y)] = False
+        """ Clears the selected planes """
+        for rows in self.selected_planes():
+            rows[:] = [0] * SCREEN_SIZE.y
+        self.dirty = True
         self.engine.clear_window()
-    
+
     def toggle_pixel(self, pos: Vector2) -> bool:
-        """ 
-            toggle pixel at position pos.
+        """
+            toggle pixel at position pos on every selected plane.
             Note that if pos is not contained in SCREEN_SIZE, this method will wrap it inside
             return True if pixel at pos was erased
         """
         logging.debug("toggle pixel at pos %s" % pos)
-        wrapped_pos = Vector2(pos.x % SCREEN_SIZE.x, pos.y % SCREEN_SIZE.y)
-        self.pixels[wrapped_pos] = not self.pixels.get(wrapped_pos, False)
-        return not self.pixels[wrapped_pos]
-    
+        bit = 1 << (SCREEN_SIZE.x - 1 - pos.x % SCREEN_SIZE.x)
+        y = pos.y % SCREEN_SIZE.y
+        erased = False
+        for rows in self.selected_planes():
+            if rows[y] & bit:
+                erased = True
+            rows[y] ^= bit
+        self.dirty = True
+        return erased
+
+    def draw_sprite(self, x: int, y: int, data: Sequence[int], rows: list[int]) -> bool:
+        """
+            XOR an 8 pixels wide sprite into a plane, one packed row at a time.
+            Coordinates wrap around the screen like toggle_pixel.
+            return True if any pixel was erased
+        """
+        width = SCREEN_SIZE.x
+        shift = x % width
+        erased = 0
+        for i, byte in enumerate(data):
+            if not byte:
+                continue
+            sprite = byte << (width - SPRITE_WIDTH)
+            sprite = ((sprite >> shift) | (sprite << (width - shift))) & ROW_MASK
+            row_index = (y + i) % SCREEN_SIZE.y
+            row = rows[row_index]
+            erased |= row & sprite
+            rows[row_index] = row ^ sprite
+        self.dirty = True
+        return erased != 0
+
+    def draw_sprite_clipped(self, x: int, y: int, data: Sequence[int], rows: list[int]) -> bool:
+        """
+            XOR an 8 pixels wide sprite into a plane like draw_sprite. The sprite origin wraps around the screen
+            but the pixels beyond the right and bottom edges are dropped.
+            return True if any pixel was erased
+        """
+        width = SCREEN_SIZE.x
+        shift = x % width
+        top = y % SCREEN_SIZE.y
+        erased = 0
+        for i, byte in enumerate(data[:SCREEN_SIZE.y - top]):
+            if not byte:
+                continue
+            sprite = (byte << (width - SPRITE_WIDTH)) >> shift
+            row = rows[top + i]
+            erased |= row & sprite
+            rows[top + i] = row ^ sprite
+        self.dirty = True
+        return erased != 0
+
+    def color_masks(self, y: int) -> list[Tuple[int, int]]:
+        """ Composites the planes of row y into (palette index, pixel mask) pairs """
+        bits = [rows[y] for rows in self.planes]
+        if not any(bits):
+            return []
+
+        masks = []
+        for index in range(1, 1 << PLANE_COUNT):
+            mask = ROW_MASK
+            for plane, row in enumerate(bits):
+                mask &= row if index & (1 << plane) else ~row
+            if mask:
+                masks.append((index, mask))
+        return masks
+
     def render(self) -> None:
         logging.debug("render()")
-        self.engine.clear_window()
-        for pos, value in self.pixels.items():
-            if value:
-                self.engine.draw_rect(pos * self.scale, self.scale, self.color)
+        if self.engine.headless:
+            return
+        if self.dirty:
+            self.engine.clear_window()
+            width = '0%db' % SCREEN_SIZE.x
+            for y in range(SCREEN_SIZE.y):
+                for index, mask in self.color_masks(y):
+                    color = self.palette[index]
+                    # Draw each horizontal run of same colored pixels as a single rectangle
+                    for run in _RUN_PATTERN.finditer(format(mask, width)):
+                        pos = Vector2(run.start(), y) * self.scale
+                        size = Vector2(run.end() - run.start(), 1) * self.scale
+                        self.engine.draw_rect(pos, size, color)
+            self.dirty = False
         self.engine.draw()
-        
@@ -0,0 +1,194 @@
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+from enum import Enum
+from typing import Iterable, NamedTuple, Optional
+from app.constants import MEMORY_PROGRAM_START
+
+CHIP8_MAX_ROM_SIZE: int = 0x1000 - MEMORY_PROGRAM_START
+
+ARCHIVE_MAGIC: bytes = b'CH8LIB01'
+# Magic, then offset and size of the JSON index stored after the ROM data
+ARCHIVE_HEADER = struct.Struct('>8sQQ')
+
+
+class Platform(Enum):
+    CHIP8 = 'chip-8'
+    SCHIP = 'schip'
+    XOCHIP = 'xo-chip'
+
+
+class RomEntry(NamedTuple):
+    name: str
+    sha1: str
+    size: int
+    platform: Platform
+    offset: int
+
+
+class RomLibraryError(RuntimeError):
+    pass
+
+
+def rom_hash(rom: bytes) -> str:
+    return hashlib.sha1(rom).hexdigest()
+
+
+def reachable_instructions(rom: bytes) -> list[int]:
+    """
+        Follows the control flow from the program start and returns the offsets (relative to the ROM start)
+        of every instruction that can be reached. Computed jumps (BNNN) are not followed.
+    """
+    seen: set[int] = set()
+    pending = [0]
+    while pending:
+        offset = pending.pop()
+        if offset in seen or offset < 0 or offset + 1 >= len(rom):
+            continue
+        seen.add(offset)
+        high, low = rom[offset], rom[offset + 1]
+        family = high >> 4
+        address = ((high & 0xF) << 8 | low) - MEMORY_PROGRAM_START
+        if family == 0x0 and low in (0xEE, 0xFD):
+            continue
+        elif family == 0x1:
+            pending.append(address)
+        elif family == 0x2:
+            pending.extend((address, offset + 2))
+        elif family == 0xB:
+            continue
+        elif high == 0xF0 and low == 0x00:
+            pending.append(offset + 4)
+        elif family in (0x3, 0x4, 0x5, 0x9) or (family == 0xE and low in (0x9E, 0xA1)):
+            next_is_long = rom[offset + 2:offset + 4] == b'\xF0\x00'
+            pending.extend((offset + 2, offset + (6 if next_is_long else 4)))
+        else:
+            pending.append(offset + 2)
+    return sorted(seen)
+
+
+def detect_platform(rom: bytes) -> Platform:
+    """
+        Guesses the platform a ROM was written for from its size and the opcodes it contains.
+        Only instructions reachable from the program start are looked at, so sprite data is not mistaken for code.
+    """
+    if len(rom) > CHIP8_MAX_ROM_SIZE:
+        return Platform.XOCHIP
+
+    platform = Platform.CHIP8
+    for offset in reachable_instructions(rom):
+        high, low = rom[offset], rom[offset + 1]
+        if (high == 0xF0 and low in (0x00, 0x02)) or (high & 0xF0 == 0xF0 and low in (0x01, 0x3A)) \
+                or (high & 0xF0 == 0x50 and low & 0xF in (0x2, 0x3)):
+            return Platform.XOCHIP
+        if (high == 0x00 and (low in (0xFB, 0xFC, 0xFD, 0xFE, 0xFF) or low & 0xF0 == 0xC0)) \
+                or (high & 0xF0 == 0xF0 and low in (0x30, 0x75, 0x85)):
+            platform = Platform.SCHIP
+    return platform
+
+
+class RomLibrary:
+    """
+        Read-only archive holding many ROMs in a single memory-mapped file.
+        ROMs are stored once per content hash and can be looked up by name or SHA-1
+        without copying them out of the mapping.
+    """
+
+    def __init__(self, archive_path: str) -> None:
+        self.path = archive_path
+        self._file = open(archive_path, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise RomLibraryError("%s is not a rom archive" % archive_path)
+
+        if len(self._map) < ARCHIVE_HEADER.size or self._map[:len(ARCHIVE_MAGIC)] != ARCHIVE_MAGIC:
+            self.close()
+            raise RomLibraryError("%s is not a rom archive" % archive_path)
+
+        _, index_offset, index_size = ARCHIVE_HEADER.unpack_from(self._map, 0)
+        index = json.loads(self._map[index_offset:index_offset + index_size])
+        self.entries: list[RomEntry] = [
+            RomEntry(name, sha1, size, Platform(platform), offset) for name, sha1, size, platform, offset in index
+        ]
+        self._by_name = {entry.name: entry for entry in self.entries}
+        self._by_hash = {entry.sha1: entry for entry in self.entries}
+
+    @classmethod
+    def build(cls, archive_path: str, directories: Iterable[str]) -> 'RomLibrary':
+        """ Scans directories recursively and packs every file found into a new archive """
+        index: list[tuple] = []
+        offsets: dict[str, int] = {}
+        with open(archive_path, 'wb') as f:
+            f.write(ARCHIVE_HEADER.pack(ARCHIVE_MAGIC, 0, 0))
+            for path in cls._scan(directories):
+                if os.path.abspath(path) == os.path.abspath(archive_path):
+                    continue
+                with open(path, 'rb') as rom_file:
+                    rom = rom_file.read()
+                sha1 = rom_hash(rom)
+                if sha1 not in offsets:
+                    offsets[sha1] = f.tell()
+                    f.write(rom)
+                index.append((path, sha1, len(rom), detect_platform(rom).value, offsets[sha1]))
+
+            index_offset = f.tell()
+            data = json.dumps(index).encode()
+            f.write(data)
+            f.seek(0)
+            f.write(ARCHIVE_HEADER.pack(ARCHIVE_MAGIC, index_offset, len(data)))
+
+        logging.info("Packed %d roms (%d unique) into %s" % (len(index), len(offsets), archive_path))
+        return cls(archive_path)
+
+    @staticmethod
+    def _scan(directories: Iterable[str]) -> list[str]:
+        paths = []
+        for directory in directories:
+            for root, dirs, files in os.walk(directory):
+                dirs.sort()
+                paths.extend(os.path.join(root, name) for name in sorted(files))
+        return paths
+
+    def find(self, key: str) -> Optional[RomEntry]:
+        """ Looks an entry up by the path it was packed from, its file name or its SHA-1 """
+        entry = self._by_name.get(key) or self._by_hash.get(key)
+        if entry is None:
+            entry = next((e for e in self.entries if os.path.basename(e.name) == key), None)
+        return entry
+
+    def view(self, entry: RomEntry) -> memoryview:
+        """ Zero-copy view of a ROM. It must be released before closing the library """
+        return memoryview(self._map)[entry.offset:entry.offset + entry.size]
+
+    def read(self, entry: RomEntry) -> bytes:
+        return self._map[entry.offset:entry.offset + entry.size]
+
+    def close(self) -> None:
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self) -> 'RomLibrary':
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 3 and sys.argv[1] == 'build':
+        RomLibrary.build(sys.argv[2], sys.argv[3:]).close()
+    elif len(sys.argv) == 3 and sys.argv[1] == 'list':
+        with RomLibrary(sys.argv[2]) as library:
+            for entry in library.entries:
+                print("%s  %6d  %-7s  %s" % (entry.sha1, entry.size, entry.platform.value, entry.name))
+    else:
+        print("Usage: %s build <archive> <rom_directory>... | list <archive>" % sys.argv[0])
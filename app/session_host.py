@@ -0,0 +1,150 @@
+import asyncio
+import logging
+from itertools import count
+from typing import Optional, Tuple
+from app.constants import SCREEN_SIZE
+from app.cpu import CPU
+from app.engine.headless_engine_handler import HeadlessEngineHandler
+from app.frame_codec import copy_frame, encode_frame
+from app.key import Key
+from app.keyboard import Keyboard
+from app.renderer import Renderer
+from app.speaker import Speaker
+
+DEFAULT_OUTPUT_QUEUE_SIZE: int = 8
+
+KeyEvent = Tuple[Key, bool] # Key and whether it is pressed
+
+
+class TimerWheel:
+    """
+        Single timer shared by every session. A frame is split into slots and each session is
+        woken up on its own slot once per frame, which spreads the work of many sessions over the frame.
+    """
+
+    def __init__(self, fps: int = 60, slots: int = 4) -> None:
+        self.fps = fps
+        self.slots = slots
+        self.tick_count = 0
+        self._waiters: list[Optional[asyncio.Future]] = [None] * slots
+
+    def wait(self, slot: int) -> asyncio.Future:
+        """ Future resolved on the next tick of slot, shared by every session of that slot """
+        waiter = self._waiters[slot]
+        if waiter is None:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters[slot] = waiter
+        return waiter
+
+    def tick(self) -> None:
+        slot = self.tick_count % self.slots
+        waiter = self._waiters[slot]
+        self._waiters[slot] = None
+        if waiter is not None and not waiter.done():
+            waiter.set_result(self.tick_count)
+        self.tick_count += 1
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        interval = 1.0 / (self.fps * self.slots)
+        deadline = loop.time()
+        while True:
+            self.tick()
+            deadline += interval
+            delay = deadline - loop.time()
+            if delay < 0:
+                # Running late: don't try to catch up with a burst of ticks
+                deadline = loop.time()
+                delay = 0
+            await asyncio.sleep(delay)
+
+
+class Session:
+    """
+        One headless emulator fed by an input queue of key events.
+        Frames are published on the output queue encoded with app.frame_codec, only when the screen changed.
+    """
+
+    def __init__(self, session_id: int, cpu_cycles_per_frame: int, output_queue_size: int = DEFAULT_OUTPUT_QUEUE_SIZE) -> None:
+        self.id = session_id
+        self.engine = HeadlessEngineHandler(size=SCREEN_SIZE)
+        renderer = Renderer(self.engine, 1, (255, 255, 255))
+        self.cpu = CPU(cpu_cycles_per_frame, renderer, Keyboard(self.engine), Speaker(self.engine, 440))
+
+        self.input: asyncio.Queue[KeyEvent] = asyncio.Queue()
+        self.output: asyncio.Queue[bytes] = asyncio.Queue(output_queue_size)
+        self.frame_number = 0
+        self.error: Optional[Exception] = None
+        self.task: Optional[asyncio.Task] = None
+        self._previous_frame: Optional[list[list[int]]] = None
+
+    def step_frame(self) -> None:
+        while not self.input.empty():
+            key, down = self.input.get_nowait()
+            if down:
+                self.engine.press(key)
+            else:
+                self.engine.release(key)
+
+        self.cpu.update()
+        self._publish_frame()
+        self.frame_number += 1
+
+    def _publish_frame(self) -> None:
+        planes = self.cpu.renderer.planes
+        if self._previous_frame is not None and planes == self._previous_frame:
+            return
+        if self.output.full():
+            # The consumer is lagging: drop this frame and send a key frame once there is room
+            self._previous_frame = None
+            return
+
+        self.output.put_nowait(encode_frame(self.frame_number, planes, self._previous_frame))
+        self._previous_frame = copy_frame(planes)
+
+    async def run(self, wheel: TimerWheel, slot: int) -> None:
+        try:
+            while True:
+                # The waiter is shared by the sessions of the slot: cancelling this session must not cancel it
+                await asyncio.shield(wheel.wait(slot))
+                self.step_frame()
+        except Exception as e:
+            # CPU errors, or any other error raised by a bad ROM, only stop this session
+            logging.warning("Session %d stopped: %r" % (self.id, e))
+            self.error = e
+
+
+class SessionHost:
+    """ Runs many sessions as tasks of a single event loop, all ticked by one TimerWheel """
+
+    def __init__(self, fps: int = 60, slots: int = 4) -> None:
+        self.wheel = TimerWheel(fps, slots)
+        self.sessions: dict[int, Session] = {}
+        self._ids = count()
+        self._wheel_task: Optional[asyncio.Task] = None
+
+    def add_session(self, rom: bytes, cpu_cycles_per_frame: int = 10) -> Session:
+        session = Session(next(self._ids), cpu_cycles_per_frame)
+        session.cpu.load_rom_bytes(rom)
+        session.task = asyncio.get_running_loop().create_task(session.run(self.wheel, session.id % self.wheel.slots))
+        self.sessions[session.id] = session
+        return session
+
+    def remove_session(self, session_id: int) -> None:
+        session = self.sessions.pop(session_id)
+        if session.task is not None:
+            session.task.cancel()
+
+    def start(self) -> None:
+        if self._wheel_task is None:
+            self._wheel_task = asyncio.get_running_loop().create_task(self.wheel.run())
+
+    async def stop(self) -> None:
+        tasks = [session.task for session in self.sessions.values() if session.task is not None]
+        if self._wheel_task is not None:
+            tasks.append(self._wheel_task)
+            self._wheel_task = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.sessions.clear()
@@ -0,0 +1,269 @@
+import argparse
+import json
+import logging
+import os
+import random
+import resource
+import sys
+import tracemalloc
+from statistics import median
+from time import monotonic
+from typing import Callable, NamedTuple, Optional, Sequence, TextIO, Union
+from app.emulator import Emulator
+from app.engine import ENGINE_BACKENDS
+from app.engine.engine_handler import EngineHandler
+from app.golden import InputEvent, parse_input_script
+from app.input_recording import InputRecorder
+from app.key import Key
+from app.metrics import EmulatorMetrics
+from app.quirks import QUIRK_PROFILES
+from app.recorder import FrameRecorder
+
+DEFAULT_INTERVAL: float = 60.0 # Seconds between samples
+# Samples forming the baseline the later samples are compared to, after the first one which includes the warm-up
+BASELINE_SAMPLES: int = 3
+DEFAULT_SLOWDOWN: float = 0.2 # Instructions per second lost, as a fraction of the baseline
+DEFAULT_MEMORY_GROWTH: float = 0.2 # RSS or allocated blocks gained, as a fraction of the baseline
+TRACEMALLOC_TOP: int = 5
+
+
+class SoakSample(NamedTuple):
+    elapsed: float # Seconds since the start
+    frames: int
+    instructions_per_second: float
+    frame_time: dict[str, float] # Percentiles in seconds over the metrics window
+    rss: int # Bytes
+    allocated_blocks: int
+    sizes: dict[str, int] # Lengths of the watched containers
+
+    def to_json(self) -> str:
+        return json.dumps(self._asdict())
+
+
+class SoakWarning(NamedTuple):
+    metric: str
+    message: str
+
+
+def resident_set_size() -> int:
+    """ Current RSS in bytes, the peak RSS where /proc isn't available """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Kilobytes on Linux, bytes on macOS
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class RandomInput:
+    """ Presses a random key with probability rate each frame, releasing it after 1 to max_hold frames """
+
+    def __init__(self, seed: int = 0, rate: float = 0.05, max_hold: int = 30) -> None:
+        self.rng = random.Random(seed)
+        self.rate = rate
+        self.max_hold = max_hold
+        self._releases: dict[Key, int] = {}
+
+    def apply(self, engine: EngineHandler, frame: int) -> None:
+        for key, release_frame in list(self._releases.items()):
+            if release_frame <= frame:
+                del self._releases[key]
+                engine._handle_key_press(key, down=False)
+        if self.rng.random() < self.rate:
+            key = Key(self.rng.randrange(16))
+            if key not in self._releases:
+                engine._handle_key_press(key)
+                self._releases[key] = frame + self.rng.randint(1, self.max_hold)
+
+
+class ScriptedInput:
+    """ Input script events (see app.golden), played again every period frames """
+
+    def __init__(self, events: Sequence[InputEvent], period: Optional[int] = None) -> None:
+        self.period = period or max((event.frame for event in events), default=0) + 1
+        self.events_by_frame: dict[int, list[InputEvent]] = {}
+        for event in events:
+            self.events_by_frame.setdefault(event.frame % self.period, []).append(event)
+
+    def apply(self, engine: EngineHandler, frame: int) -> None:
+        for event in self.events_by_frame.get(frame % self.period, ()):
+            engine._handle_key_press(event.key, event.down)
+
+
+def default_watches(emulator: Emulator) -> dict[str, Callable[[], int]]:
+    """ Containers of the emulator that must not grow while it runs """
+    watches = {
+        'cpu.decoded': lambda: len(emulator.cpu.decoded),
+        'cpu.fused': lambda: len(emulator.cpu.fused),
+        'keyboard.pressed_keys': lambda: len(emulator.cpu.keyboard.pressed_keys),
+        'engine.keydown_callbacks': lambda: len(emulator.engine.keydown_callbacks),
+    }
+    if hasattr(emulator.engine, 'shapes'):
+        watches['engine.shapes'] = lambda: len(emulator.engine.shapes)
+    return watches
+
+
+def keeps_growing(values: list[float], threshold: float = 0.0) -> bool:
+    """ Ends over the first value by more than threshold (a fraction of it) after rising in at least half the intervals """
+    rises = sum(1 for previous, value in zip(values, values[1:]) if value > previous)
+    return len(values) > 1 and values[-1] > values[0] * (1 + threshold) and rises >= (len(values) - 1) / 2
+
+
+def detect_degradation(samples: list[SoakSample],
+    slowdown: float = DEFAULT_SLOWDOWN,
+    memory_growth: float = DEFAULT_MEMORY_GROWTH,
+    baseline_samples: int = BASELINE_SAMPLES) -> list[SoakWarning]:
+    """
+        Compares the samples to a baseline taken once warmed up, leaving out the first sample:
+        throughput lost, RSS or allocated blocks growing, and watched containers growing steadily.
+    """
+    samples = samples[1:]
+    if len(samples) <= baseline_samples:
+        return []
+    baseline, latest = samples[:baseline_samples], samples[-baseline_samples:]
+    warnings = []
+
+    baseline_ips = median(sample.instructions_per_second for sample in baseline)
+    latest_ips = median(sample.instructions_per_second for sample in latest)
+    if baseline_ips > 0 and latest_ips < baseline_ips * (1 - slowdown):
+        warnings.append(SoakWarning('instructions_per_second', "Throughput went from %.0f to %.0f instructions per second" % (baseline_ips, latest_ips)))
+    baseline_p99 = median(sample.frame_time.get('p99', 0.0) for sample in baseline)
+    latest_p99 = median(sample.frame_time.get('p99', 0.0) for sample in latest)
+    if baseline_p99 > 0 and latest_p99 > baseline_p99 / (1 - slowdown):
+        warnings.append(SoakWarning('frame_time', "p99 frame time went from %.2f to %.2f ms" % (baseline_p99 * 1000, latest_p99 * 1000)))
+
+    measured = samples[baseline_samples - 1:]
+    for metric, unit in (('rss', 'bytes'), ('allocated_blocks', 'blocks')):
+        values = [getattr(sample, metric) for sample in measured]
+        if keeps_growing(values, memory_growth):
+            warnings.append(SoakWarning(metric, "%s grew from %d to %d %s" % (metric, values[0], values[-1], unit)))
+    for name in measured[0].sizes:
+        values = [sample.sizes.get(name, 0) for sample in measured]
+        if keeps_growing(values):
+            warnings.append(SoakWarning(name, "%s keeps growing: %d to %d entries" % (name, values[0], values[-1])))
+    return warnings
+
+
+class SoakRunner:
+    """
+        Runs an emulator headlessly (or on any engine) as fast as it goes, feeding it random or scripted input,
+        and samples its throughput, frame times, memory and the size of the watched containers at each interval.
+        Samples are written as JSON lines, followed by a {"warnings": [...]} line.
+    """
+
+    def __init__(self,
+        emulator: Emulator,
+        input_source: Union[RandomInput, ScriptedInput, None] = None,
+        interval: float = DEFAULT_INTERVAL,
+        output: Optional[TextIO] = None,
+        watches: Optional[dict[str, Callable[[], int]]] = None,
+        trace_allocations: bool = False) -> None:
+        if emulator.metrics is None:
+            raise ValueError("The soak runner reads the metrics of the emulator, create it with metrics")
+        self.emulator = emulator
+        self.metrics = emulator.metrics
+        self.input_source = input_source if input_source is not None else RandomInput()
+        self.interval = interval
+        self.output = output
+        self.watches = watches if watches is not None else default_watches(emulator)
+        self.trace_allocations = trace_allocations
+        self.samples: list[SoakSample] = []
+        self.frame = 0
+        # Allocation snapshots at the baseline and at the latest sample, with trace_allocations
+        self._baseline_trace: Optional[tracemalloc.Snapshot] = None
+        self._latest_trace: Optional[tracemalloc.Snapshot] = None
+
+    def sample(self, elapsed: float) -> SoakSample:
+        snapshot = self.metrics.snapshot()
+        sample = SoakSample(elapsed, self.frame, snapshot['instructions_per_second'], snapshot['frame_time'],
+            resident_set_size(), sys.getallocatedblocks(), {name: size() for name, size in self.watches.items()})
+        self.samples.append(sample)
+        if self.output is not None:
+            self.output.write(sample.to_json() + '\n')
+            self.output.flush()
+        if self.trace_allocations:
+            self._latest_trace = tracemalloc.take_snapshot()
+            if len(self.samples) == BASELINE_SAMPLES + 1:
+                self._baseline_trace = self._latest_trace
+        return sample
+
+    def run(self, duration: float) -> list[SoakWarning]:
+        """ Runs until the first sample past duration seconds, or until the engine quits """
+        if self.trace_allocations:
+            tracemalloc.start()
+        start = monotonic()
+        next_sample = start + self.interval
+        engine = self.emulator.engine
+        try:
+            running = True
+            while running:
+                self.input_source.apply(engine, self.frame)
+                running = self.emulator.run_frame()
+                self.frame += 1
+                now = monotonic()
+                if now >= next_sample:
+                    self.sample(now - start)
+                    next_sample += self.interval
+                    if now - start >= duration:
+                        break
+        finally:
+            if self.trace_allocations:
+                tracemalloc.stop()
+        warnings = detect_degradation(self.samples)
+        if any(warning.metric in ('rss', 'allocated_blocks') for warning in warnings):
+            warnings += self.allocation_growth()
+        if self.output is not None:
+            self.output.write(json.dumps({'warnings': [warning._asdict() for warning in warnings]}) + '\n')
+        for warning in warnings:
+            logging.warning("Soak: %s" % warning.message)
+        return warnings
+
+    def allocation_growth(self) -> list[SoakWarning]:
+        """ With trace_allocations, the source lines whose allocations grew the most since the baseline, besides the soak's own """
+        if self._baseline_trace is None or self._latest_trace is self._baseline_trace:
+            return []
+        own = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+        statistics = self._latest_trace.filter_traces(own).compare_to(self._baseline_trace.filter_traces(own), 'lineno')
+        return [SoakWarning('allocations', "%s: %+d bytes in %+d blocks" % (statistic.traceback, statistic.size_diff, statistic.count_diff))
+            for statistic in statistics[:TRACEMALLOC_TOP] if statistic.size_diff > 0]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run a ROM for a long time and flag slowdowns and memory growth")
+    parser.add_argument('rom_path')
+    parser.add_argument('cpu_cycles_per_frame', nargs='?', type=int, default=10)
+    parser.add_argument('--duration', type=float, default=3600.0, help="Seconds to run (default one hour)")
+    parser.add_argument('--interval', type=float, default=DEFAULT_INTERVAL, help="Seconds between samples")
+    parser.add_argument('--output', metavar='PATH', help="JSON lines time series, standard output by default")
+    parser.add_argument('--script', metavar='PATH', help="Input script played in loop, see app/golden.py, random input by default")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the random input")
+    parser.add_argument('--engine', choices=sorted(ENGINE_BACKENDS), default='headless')
+    parser.add_argument('--quirks', choices=sorted(QUIRK_PROFILES))
+    parser.add_argument('--record', metavar='PATH', help="Record the frames as well, to soak the recorder")
+    parser.add_argument('--record-input', metavar='PATH', help="Record the input as well, to soak the input recorder")
+    parser.add_argument('--trace-allocations', action='store_true', help="Report the source lines allocating the most, slows the emulator down")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    emulator = Emulator(args.cpu_cycles_per_frame, engine=args.engine, decode_cache=None, quirks=args.quirks,
+        recorder=FrameRecorder(args.record) if args.record else None, metrics=EmulatorMetrics(),
+        input_recorder=InputRecorder(args.record_input) if args.record_input else None)
+    emulator.load_rom(args.rom_path)
+    if args.script:
+        with open(args.script) as f:
+            input_source = ScriptedInput(parse_input_script(f.read()))
+    else:
+        input_source = RandomInput(args.seed)
+    output = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        runner = SoakRunner(emulator, input_source, args.interval, output, trace_allocations=args.trace_allocations)
+        warnings = runner.run(args.duration)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+        if emulator.recorder is not None:
+            emulator.recorder.close()
+        if emulator.input_recorder is not None:
+            emulator.input_recorder.close()
+    raise SystemExit(1 if warnings else 0)
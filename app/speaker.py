@@ -1,12 +1,30 @@
+from typing import Optional
+from app.constants import AUDIO_DEFAULT_PITCH, AUDIO_PATTERN_SIZE
 from app.engine.engine_handler import EngineHandler
 
 class Speaker:
     def __init__(self, engine: EngineHandler, pitch: int) -> None:
         self.engine = engine
         self.pitch = 440 # Hz
+
+        # XO-CHIP audio pattern buffer, played instead of the square wave once loaded
+        self.pattern: Optional[bytes] = None
+        self.pattern_pitch = AUDIO_DEFAULT_PITCH
     
+    def load_pattern(self, pattern: bytes) -> None:
+        self.pattern = bytes(pattern[:AUDIO_PATTERN_SIZE])
+
+    def set_pattern_pitch(self, pitch: int) -> None:
+        self.pattern_pitch = pitch
+
+    def pattern_sample_rate(self) -> float:
+        return 4000 * 2 ** ((self.pattern_pitch - AUDIO_DEFAULT_PITCH) / 48)
+
     def play(self) -> None:
-        self.engine.play_sound(self.pitch)
+        if self.pattern is not None:
+            self.engine.play_pattern(self.pattern, self.pattern_sample_rate())
+        else:
+            self.engine.play_sound(self.pitch)
     
     def stop(self) -> None:
         self.engine.stop_sound()
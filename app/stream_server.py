@@ -0,0 +1,230 @@
+import asyncio
+import base64
+import hashlib
+import logging
+import struct
+from typing import Optional
+from app.decode_cache import DecodeCache
+from app.emulator import Emulator
+from app.engine.headless_engine_handler import HeadlessEngineHandler
+from app.frame_codec import copy_frame, encode_frame
+from app.key import Key
+
+TCP_HELLO: bytes = b'CH8S'
+TCP_LENGTH = struct.Struct('>I')
+# Keypad event sent by clients: 1 for a key press and 0 for a release, then the key value
+KEY_EVENT = struct.Struct('>BB')
+
+WEBSOCKET_GUID: bytes = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+WEBSOCKET_BINARY: int = 0x2
+WEBSOCKET_CLOSE: int = 0x8
+WEBSOCKET_PING: int = 0x9
+WEBSOCKET_PONG: int = 0xA
+
+DEFAULT_PORT: int = 8964
+# A client with more pending bytes than this skips frames and gets a key frame once it caught up
+DEFAULT_MAX_CLIENT_BUFFER: int = 256 * 1024
+
+
+class StreamClosed(Exception):
+    pass
+
+
+def tcp_frame(message: bytes) -> bytes:
+    return TCP_LENGTH.pack(len(message)) + message
+
+
+def websocket_frame(message: bytes, opcode: int = WEBSOCKET_BINARY) -> bytes:
+    length = len(message)
+    if length < 126:
+        header = struct.pack('>BB', 0x80 | opcode, length)
+    elif length < 0x10000:
+        header = struct.pack('>BBH', 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack('>BBQ', 0x80 | opcode, 127, length)
+    return header + message
+
+
+class StreamClient:
+    TCP = 'tcp'
+    WEBSOCKET = 'websocket'
+
+    def __init__(self, kind: str, writer: asyncio.StreamWriter) -> None:
+        self.kind = kind
+        self.writer = writer
+        self.needs_key_frame = True
+
+    def pending_bytes(self) -> int:
+        return self.writer.transport.get_write_buffer_size()
+
+
+class StreamServer:
+    """
+        Runs a headless emulator and streams its framebuffer to any number of clients over TCP or WebSocket.
+        Each frame is encoded once and the same bytes are written to every client;
+        clients send keypad events back.
+
+        TCP clients start by sending TCP_HELLO, then every message is prefixed by its length.
+        WebSocket clients connect to the same port and use binary messages.
+    """
+
+    def __init__(self,
+        emulator: Emulator,
+        host: str = '127.0.0.1',
+        port: int = DEFAULT_PORT,
+        max_client_buffer: int = DEFAULT_MAX_CLIENT_BUFFER) -> None:
+        if not isinstance(emulator.engine, HeadlessEngineHandler):
+            raise ValueError("The stream server needs an emulator running the headless engine")
+        self.emulator = emulator
+        self.engine: HeadlessEngineHandler = emulator.engine
+        self.host = host
+        self.port = port
+        self.max_client_buffer = max_client_buffer
+        self.clients: set[StreamClient] = set()
+        self.frame_number = 0
+        self.previous_frame: Optional[list[list[int]]] = None
+        self.server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self) -> None:
+        self.server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        logging.info("Streaming on %s:%d" % (self.host, self.port))
+
+    async def stop(self) -> None:
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        for client in list(self.clients):
+            client.writer.close()
+        self.clients.clear()
+
+    async def run(self) -> None:
+        await self.start()
+        step = 1.0 / self.emulator.fps
+        loop = asyncio.get_running_loop()
+        try:
+            while self.engine.update():
+                start = loop.time()
+                self.step_frame()
+                await asyncio.sleep(max(0, step - (loop.time() - start)))
+        finally:
+            await self.stop()
+
+    def step_frame(self) -> None:
+        self.emulator.cpu.update()
+        self.broadcast()
+
+    def broadcast(self) -> None:
+        planes = self.emulator.cpu.renderer.planes
+        delta: Optional[bytes] = None
+        if self.previous_frame is None:
+            self.previous_frame = copy_frame(planes)
+        elif planes != self.previous_frame:
+            delta = encode_frame(self.frame_number, planes, self.previous_frame)
+            self.previous_frame = copy_frame(planes)
+
+        # Encoded messages are shared by every client using the same transport
+        messages: dict[tuple[str, bool], bytes] = {}
+        for client in list(self.clients):
+            if client.writer.is_closing():
+                self.clients.discard(client)
+                continue
+            if client.pending_bytes() > self.max_client_buffer:
+                client.needs_key_frame = True
+                continue
+            if not client.needs_key_frame and delta is None:
+                continue
+
+            key = (client.kind, client.needs_key_frame)
+            if key not in messages:
+                message = encode_frame(self.frame_number, planes) if client.needs_key_frame else delta
+                messages[key] = tcp_frame(message) if client.kind == StreamClient.TCP else websocket_frame(message)
+            client.writer.write(messages[key])
+            client.needs_key_frame = False
+
+        self.frame_number += 1
+
+    def handle_key_event(self, event: bytes) -> None:
+        down, value = KEY_EVENT.unpack(event)
+        if value > Key.F.value:
+            logging.warning("Ignoring unknown key %d from client" % value)
+            return
+        if down:
+            self.engine.press(Key(value))
+        else:
+            self.engine.release(Key(value))
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        client: Optional[StreamClient] = None
+        try:
+            start = await reader.readexactly(len(TCP_HELLO))
+            if start == TCP_HELLO:
+                client = StreamClient(StreamClient.TCP, writer)
+                self.clients.add(client)
+                while True:
+                    self.handle_key_event(await reader.readexactly(KEY_EVENT.size))
+            elif start == b'GET ':
+                await self._websocket_handshake(reader, writer)
+                client = StreamClient(StreamClient.WEBSOCKET, writer)
+                self.clients.add(client)
+                while True:
+                    payload = await self._read_websocket_message(reader, writer)
+                    for offset in range(0, len(payload) - KEY_EVENT.size + 1, KEY_EVENT.size):
+                        self.handle_key_event(payload[offset:offset + KEY_EVENT.size])
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError, StreamClosed):
+            pass
+        finally:
+            if client is not None:
+                self.clients.discard(client)
+            writer.close()
+
+    async def _websocket_handshake(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        request = await reader.readuntil(b'\r\n\r\n')
+        headers = {}
+        for line in request.decode('latin-1').split('\r\n')[1:]:
+            if ':' in line:
+                name, value = line.split(':', 1)
+                headers[name.strip().lower()] = value.strip()
+        if 'sec-websocket-key' not in headers:
+            writer.write(b'HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\n\r\n')
+            raise StreamClosed()
+
+        accept = base64.b64encode(hashlib.sha1(headers['sec-websocket-key'].encode() + WEBSOCKET_GUID).digest())
+        writer.write(
+            b'HTTP/1.1 101 Switching Protocols\r\n'
+            b'Upgrade: websocket\r\n'
+            b'Connection: Upgrade\r\n'
+            b'Sec-WebSocket-Accept: ' + accept + b'\r\n\r\n'
+        )
+
+    async def _read_websocket_message(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> bytes:
+        while True:
+            first, second = await reader.readexactly(2)
+            opcode = first & 0xF
+            length = second & 0x7F
+            if length == 126:
+                length, = struct.unpack('>H', await reader.readexactly(2))
+            elif length == 127:
+                length, = struct.unpack('>Q', await reader.readexactly(8))
+            mask = await reader.readexactly(4) if second & 0x80 else None
+            payload = await reader.readexactly(length)
+            if mask is not None:
+                payload = bytes(byte ^ mask[i % 4] for i, byte in enumerate(payload))
+
+            if opcode == WEBSOCKET_CLOSE:
+                writer.write(websocket_frame(b'', WEBSOCKET_CLOSE))
+                raise StreamClosed()
+            elif opcode == WEBSOCKET_PING:
+                writer.write(websocket_frame(payload, WEBSOCKET_PONG))
+            elif opcode in (0x0, 0x1, WEBSOCKET_BINARY):
+                return payload
+
+
+def serve(rom_path: str, cpu_cycles_per_frame: int, host: str = '127.0.0.1', port: int = DEFAULT_PORT, quirks: Optional[str] = None) -> None:
+    emulator = Emulator(cpu_cycles_per_frame, decode_cache=DecodeCache(), engine='headless', quirks=quirks)
+    emulator.load_rom(rom_path)
+    server = StreamServer(emulator, host, port)
+    try:
+        asyncio.run(server.run())
+    finally:
+        emulator.cpu.save_decode_cache()
@@ -0,0 +1,115 @@
+from typing import TYPE_CHECKING, Callable, NamedTuple, Optional
+from app.constants import MEMORY_SIZE
+
+if TYPE_CHECKING:
+    from app.cpu import CPU
+
+# Runs the sequence given the number of cycles left in the run, returns the number of instructions executed
+FusedHandler = Callable[[int], int]
+
+# Names of the fused sequences, as counted in CPU.fusion_stats
+SUPERINSTRUCTIONS: tuple[str, ...] = ('load_pair', 'load_i_draw', 'counter_loop', 'timer_wait')
+INSTRUCTION_SIZE: int = 2
+
+
+class Superinstruction(NamedTuple):
+    """
+        A sequence of instructions run by a single handler. It stays valid while memory still holds code,
+        the bytes it was built from.
+    """
+    name: str
+    length: int # Instructions of one pass through the sequence, the most it can run without looping
+    code: bytes
+    handler: FusedHandler
+
+
+def _skip_condition(opcode: int) -> Optional[tuple[int, int, bool]]:
+    """ Register, byte and whether the skip happens on equality, for 3XNN and 4XNN """
+    family = opcode >> 12
+    if family not in (0x3, 0x4):
+        return None
+    return (opcode >> 8) & 0xF, opcode & 0xFF, family == 0x3
+
+
+def fuse(cpu: 'CPU', address: int) -> Optional[Superinstruction]:
+    """
+        Superinstruction starting at address, if the instructions there form one of the fused sequences:
+            6XNN 6YNN       two register loads
+            ANNN DXYN       sprite address and draw
+            7XNN 3YNN 1NNN  counter loop (or 4YNN)
+            FX07 3XNN 1NNN  wait for the delay timer (or 4XNN)
+        The handlers give the same results as running the instructions one by one: loops only run
+        whole passes that fit in the cycles left, and the CPU runs the last instructions one at a time.
+    """
+    memory = cpu.memory
+    if address + 3 * INSTRUCTION_SIZE > MEMORY_SIZE:
+        return None
+    first, second, third = ((memory[a] << 8) | memory[a + 1] for a in range(address, address + 6, INSTRUCTION_SIZE))
+    after_pair = address + 2 * INSTRUCTION_SIZE
+    after_triple = address + 3 * INSTRUCTION_SIZE
+
+    if first >> 12 == 0x6 and second >> 12 == 0x6:
+        x, x_byte = (first >> 8) & 0xF, first & 0xFF
+        y, y_byte = (second >> 8) & 0xF, second & 0xFF
+
+        def load_pair(_: int) -> int:
+            registers = cpu.registers
+            registers[x] = x_byte
+            registers[y] = y_byte
+            cpu.pc = after_pair
+            return 2
+        return Superinstruction('load_pair', 2, bytes(memory[address:after_pair]), load_pair)
+
+    if first >> 12 == 0xA and second >> 12 == 0xD:
+        sprite_address = first & 0xFFF
+        # The draw handler of the quirks profile, DRW or DRW_clipped
+        draw = cpu.decode(second)
+
+        def load_i_draw(_: int) -> int:
+            cpu.i = sprite_address
+            cpu.pc = after_pair
+            draw(second)
+            return 2
+        return Superinstruction('load_i_draw', 2, bytes(memory[address:after_pair]), load_i_draw)
+
+    condition = _skip_condition(second)
+    if condition is None or third >> 12 != 0x1:
+        return None
+    reg, byte, skip_if_equal = condition
+    target = third & 0xFFF
+    code = bytes(memory[address:after_triple])
+
+    if first >> 12 == 0x7:
+        x, increment = (first >> 8) & 0xF, first & 0xFF
+
+        def counter_loop(budget: int) -> int:
+            registers = cpu.registers
+            executed = 0
+            while True:
+                registers[x] = (registers[x] + increment) & 0xFF
+                if (registers[reg] == byte) == skip_if_equal:
+                    # The jump is skipped
+                    cpu.pc = after_triple
+                    return executed + 2
+                executed += 3
+                cpu.pc = target
+                if target != address or budget - executed < 3:
+                    return executed
+        return Superinstruction('counter_loop', 3, code, counter_loop)
+
+    if first & 0xF0FF == 0xF007 and (first >> 8) & 0xF == reg:
+
+        def timer_wait(budget: int) -> int:
+            delay_timer = cpu.delay_timer
+            cpu.registers[reg] = delay_timer
+            if (delay_timer == byte) == skip_if_equal:
+                cpu.pc = after_triple
+                return 2
+            cpu.pc = target
+            if target != address:
+                return 3
+            # Timers only change between frames: the loop spins for every whole pass left in the run
+            return budget - budget % 3
+        return Superinstruction('timer_wait', 3, code, timer_wait)
+
+    return None
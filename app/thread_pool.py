@@ -0,0 +1,134 @@
+import argparse
+import logging
+import os
+import sys
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+from typing import Optional
+from app.decode_cache import DecodedRom
+from app.golden import GoldenRun, GoldenSuite
+from app.job_queue import JOB_ERROR, Job, JobResult, golden_jobs, run_job
+from app.quirks import get_quirks
+from app.rom_library import rom_hash
+
+# Frames run to find the instructions of a ROM before sharing them
+WARM_UP_FRAMES: int = 120
+
+
+def gil_enabled() -> bool:
+    """ False on free-threaded builds running without the GIL """
+    is_gil_enabled = getattr(sys, '_is_gil_enabled', None)
+    return True if is_gil_enabled is None else is_gil_enabled()
+
+
+def default_thread_count() -> int:
+    """ A thread per core without the GIL. With it, threads only take turns: run the jobs one after the other """
+    return 1 if gil_enabled() else os.cpu_count() or 1
+
+
+def decode_rom(rom: bytes, quirks: Optional[str] = None, frames: int = WARM_UP_FRAMES) -> DecodedRom:
+    """
+        Instructions a scratch CPU decodes running the ROM without input, to warm start the CPUs running it,
+        like the decode cache does across runs. Instructions reached later are decoded by each CPU.
+        The warm-up stops at the first error, which the jobs running the ROM report
+    """
+    cpu = GoldenRun(rom).cpu
+    try:
+        if quirks is not None:
+            cpu.set_quirks(get_quirks(quirks))
+        for _ in range(frames):
+            cpu.update()
+    except Exception:
+        pass
+    return cpu.decoded_rom()
+
+
+class ThreadPoolRunner:
+    """
+        Runs jobs (see app.job_queue) on a pool of threads in this process, each job on its own CPU.
+        CPUs share nothing writable: each has its own memory, registers, random generator and engine.
+        ROM images and their decoded instructions are built once per ROM before the threads start and
+        are only read afterwards.
+
+        Jobs run in parallel on free-threaded builds. With the GIL they still give the same results,
+        one thread at a time.
+    """
+
+    def __init__(self, threads: Optional[int] = None) -> None:
+        self.threads = threads or default_thread_count()
+        if self.threads > 1 and gil_enabled():
+            logging.info("The GIL is enabled, %d threads won't run in parallel" % self.threads)
+        self.decoded_roms: dict[tuple[str, Optional[str]], DecodedRom] = {}
+
+    @staticmethod
+    def _rom_key(job: Job) -> tuple[str, Optional[str]]:
+        # Handlers depend on the quirks profile
+        return rom_hash(job.rom), job.quirks
+
+    def _run(self, job: Job, decoded_rom: DecodedRom) -> JobResult:
+        hashes: dict[int, str] = {}
+        start = perf_counter()
+        try:
+            status, error = run_job(job, hashes.__setitem__, decoded_rom)
+        except Exception:
+            # executor.map would raise it, losing the results of the other jobs
+            status, error = JOB_ERROR, traceback.format_exc()
+        return JobResult(job.job_id, status, hashes, 1, threading.current_thread().name, error, perf_counter() - start)
+
+    def prepare(self, jobs: list[Job]) -> list[DecodedRom]:
+        """ Decoded instructions of the ROM of each job, decoding the ROMs not seen yet """
+        decoded_roms = []
+        for job in jobs:
+            key = self._rom_key(job)
+            if key not in self.decoded_roms:
+                self.decoded_roms[key] = decode_rom(job.rom, job.quirks)
+            decoded_roms.append(self.decoded_roms[key])
+        return decoded_roms
+
+    def run(self, jobs: list[Job]) -> list[JobResult]:
+        """ Results in the order of jobs """
+        decoded_roms = self.prepare(jobs)
+        with ThreadPoolExecutor(self.threads, thread_name_prefix='chip8') as executor:
+            return list(executor.map(self._run, jobs, decoded_roms))
+
+
+def scaling_benchmark(jobs: list[Job], thread_counts: list[int], repeat: int = 3) -> list[tuple[int, float]]:
+    """ Seconds taken to run jobs with each thread count, the best of repeat runs """
+    timings = []
+    # ROMs are decoded once, outside of the measure
+    decoded_roms = ThreadPoolRunner(1)
+    decoded_roms.prepare(jobs)
+    for threads in thread_counts:
+        runner = ThreadPoolRunner(threads)
+        runner.decoded_roms = decoded_roms.decoded_roms
+        best = float('inf')
+        for _ in range(repeat):
+            start = perf_counter()
+            runner.run(jobs)
+            best = min(best, perf_counter() - start)
+        timings.append((threads, best))
+    return timings
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run the golden suite ROMs on a thread pool and report how it scales with the thread count")
+    parser.add_argument('--golden-directory', default=os.path.join('tests', 'golden'))
+    parser.add_argument('--rom-directory', default='roms')
+    parser.add_argument('--frames', type=int, default=600, help="Frames run by each job")
+    parser.add_argument('--cycles', type=int, default=100, help="Cycles per frame")
+    parser.add_argument('--copies', type=int, default=2, help="Jobs per ROM")
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per thread count, the fastest is kept")
+    args = parser.parse_args()
+
+    suite = GoldenSuite(args.golden_directory, args.rom_directory)
+    jobs = [job._replace(job_id='%s-%d' % (job.job_id, copy), checkpoints=[args.frames], cycles_per_frame=args.cycles)
+        for job in golden_jobs(suite) for copy in range(args.copies)]
+    frames = len(jobs) * args.frames
+    print("%d jobs of %d frames, GIL %s" % (len(jobs), args.frames, 'enabled' if gil_enabled() else 'disabled'))
+    timings = scaling_benchmark(jobs, args.threads, args.repeat)
+    base = timings[0][1]
+    for threads, seconds in timings:
+        print("%3d threads: %6.2fs %9.0f frames/s  x%.2f" % (threads, seconds, frames / seconds, base / seconds))
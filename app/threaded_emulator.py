@@ -0,0 +1,182 @@
+import logging
+import threading
+from collections import deque
+from time import perf_counter, sleep
+from typing import Any, Optional, Tuple
+from app.emulator import Emulator
+from app.engine.engine_handler import EngineHandler
+from app.engine.headless_engine_handler import HeadlessEngineHandler
+from app.frame_codec import FrameRows, empty_frame
+from app.key import Key
+from app.renderer import Renderer
+
+KeyEvent = Tuple[Key, bool] # Key and whether it is pressed
+
+
+class FrameExchange:
+    """
+        Hands frames from the CPU thread to the render thread without either side waiting on the other.
+        The double buffer has a spare slot: the writer fills its back buffer then swaps it with the spare one,
+        the reader swaps the spare one with its front buffer when a newer frame is there.
+        The lock only guards those swaps, never the copies or the rendering.
+    """
+
+    def __init__(self) -> None:
+        self._back = empty_frame()
+        self._spare = empty_frame()
+        self.front = empty_frame()
+        self._fresh = False
+        self._lock = threading.Lock()
+        self.published = 0
+
+    def publish(self, planes: FrameRows) -> None:
+        """ Called from the CPU thread """
+        for rows, source in zip(self._back, planes):
+            rows[:] = source
+        with self._lock:
+            self._back, self._spare = self._spare, self._back
+            self._fresh = True
+        self.published += 1
+
+    def take(self) -> bool:
+        """ Called from the render thread: moves the latest frame to front, returns False if there was none """
+        with self._lock:
+            if not self._fresh:
+                return False
+            self.front, self._spare = self._spare, self.front
+            self._fresh = False
+        return True
+
+
+class SoundRelay:
+    """
+        Stands in for the engine of the speaker on the CPU thread. Only the last requested state is kept,
+        the render thread applies it to the real engine when it changed.
+    """
+
+    def __init__(self) -> None:
+        self.state: Tuple[str, Tuple[Any, ...]] = ('stop_sound', ())
+        self._applied: Optional[Tuple[str, Tuple[Any, ...]]] = None
+
+    def play_sound(self, frequency: int) -> None:
+        self.state = ('play_sound', (frequency,))
+
+    def play_pattern(self, pattern: bytes, sample_rate: float) -> None:
+        self.state = ('play_pattern', (pattern, sample_rate))
+
+    def stop_sound(self) -> None:
+        self.state = ('stop_sound', ())
+
+    def apply(self, engine: EngineHandler) -> None:
+        state = self.state
+        if state != self._applied:
+            name, arguments = state
+            getattr(engine, name)(*arguments)
+            self._applied = state
+
+
+class ThreadedEmulator:
+    """
+        Runs the CPU of an emulator on its own thread, paced on its own clock, while the calling thread
+        handles the window: input, rendering and sound. Frames go through a FrameExchange and key events
+        the other way through a deque, whose append and popleft need no lock.
+    """
+
+    def __init__(self, emulator: Emulator) -> None:
+        if emulator.tuner is not None:
+            raise ValueError("Auto-tuning measures renders on the emulation thread and can't be threaded")
+        self.emulator = emulator
+        self.engine = emulator.engine
+        self.cpu = emulator.cpu
+        self.fps = emulator.fps
+        self.frames = FrameExchange()
+        self.input_events: deque[KeyEvent] = deque()
+        self.sound = SoundRelay()
+        self.error: Optional[BaseException] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        # The render thread draws the exchanged frames, the CPU one draws into a renderer without display
+        cpu_renderer = self.cpu.renderer
+        self.renderer = Renderer(self.engine, cpu_renderer.scale.x, cpu_renderer.color, cpu_renderer.palette)
+        cpu_renderer.engine = HeadlessEngineHandler(size=self.engine.size)
+        self.cpu.speaker.engine = self.sound
+
+        # Key callbacks (the keyboard) now run on the CPU thread, the engine only queues the events
+        self._keydown_callbacks = list(self.engine.keydown_callbacks)
+        self._keyup_callbacks = list(self.engine.keyup_callbacks)
+        self.engine.keydown_callbacks[:] = [lambda key: self.input_events.append((key, True))]
+        self.engine.keyup_callbacks[:] = [lambda key: self.input_events.append((key, False))]
+
+    def _apply_input(self) -> None:
+        events = self.input_events
+        while events:
+            key, down = events.popleft()
+            for callback in self._keydown_callbacks if down else self._keyup_callbacks:
+                callback(key)
+
+    def step_frame(self) -> None:
+        """ One frame of the CPU thread """
+        self._apply_input()
+        self.cpu.update()
+        planes = self.cpu.renderer.planes
+        self.frames.publish(planes)
+        if self.emulator.recorder is not None:
+            self.emulator.recorder.capture(planes)
+
+    def _cpu_loop(self) -> None:
+        step = 1.0 / self.fps
+        deadline = perf_counter()
+        try:
+            while not self._stop.is_set():
+                self.step_frame()
+                deadline += step
+                delay = deadline - perf_counter()
+                if delay > 0:
+                    sleep(delay)
+                elif delay < -step:
+                    # More than a frame late: drop the backlog instead of running a burst of frames
+                    deadline = perf_counter()
+        except BaseException as e:
+            logging.error("Emulation thread stopped: %r" % e)
+            self.error = e
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._cpu_loop, name='chip8-cpu', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def render_frame(self) -> bool:
+        """ One frame of the render thread, returns False once the window is closed """
+        running = self.engine.update()
+        if self.frames.take():
+            for rows, source in zip(self.renderer.planes, self.frames.front):
+                rows[:] = source
+            self.renderer.dirty = True
+        self.renderer.render()
+        self.sound.apply(self.engine)
+        return running
+
+    def run_rom(self, rom_path: str) -> None:
+        self.emulator.load_rom(rom_path)
+        self.engine.start()
+        self.start()
+        step = 1.0 / self.fps
+        try:
+            while self._thread is not None and self._thread.is_alive():
+                start = perf_counter()
+                if not self.render_frame():
+                    break
+                sleep(max(0, step - (perf_counter() - start)))
+        finally:
+            self.stop()
+            self.cpu.save_decode_cache()
+            if self.emulator.recorder is not None:
+                self.emulator.recorder.close()
+        if self.error is not None:
+            raise self.error
@@ -1,20 +1,117 @@
 #! python3
 
+import argparse
+import logging
+import os
 import sys
+import time
+from typing import Optional
 
+_import_start = time.perf_counter()
+from app.autotune import DEFAULT_TARGET_IPS
+from app.cpu import RomTooLargeError
+from app.decode_cache import DecodeCache
 from app.emulator import Emulator
+from app.engine import ENGINE_BACKENDS
+from app.input_recording import DEFAULT_KEYFRAME_INTERVAL, InputRecorder
+from app.metrics import EmulatorMetrics, MetricsServer
+from app.quirks import QUIRK_PROFILES
+from app.recorder import FrameRecorder
+IMPORT_TIME = time.perf_counter() - _import_start
 
-def run_emulation(path: str, cpu_cycles_per_frame: int) -> None:
-    emulator: Emulator = Emulator(cpu_cycles_per_frame)
+def run_emulation(path: str,
+    cpu_cycles_per_frame: int,
+    engine: str = 'pyglet',
+    record_path: Optional[str] = None,
+    quirks: Optional[str] = None,
+    target_ips: Optional[int] = None,
+    threaded: bool = False,
+    out_of_process: bool = False,
+    coverage_path: Optional[str] = None,
+    metrics_port: Optional[int] = None,
+    metrics_log: Optional[str] = None,
+    metrics_host: str = '127.0.0.1',
+    input_record_path: Optional[str] = None,
+    keyframe_interval: int = DEFAULT_KEYFRAME_INTERVAL) -> None:
+    recorder = FrameRecorder(record_path) if record_path else None
+    input_recorder = InputRecorder(input_record_path, keyframe_interval) if input_record_path else None
+    metrics = EmulatorMetrics(log_path=metrics_log) if metrics_port is not None or metrics_log else None
+    emulator: Emulator = Emulator(cpu_cycles_per_frame, decode_cache=DecodeCache(), engine=engine, recorder=recorder, quirks=quirks, target_ips=target_ips, metrics=metrics,
+        input_recorder=input_recorder)
+    emulator.timings['import'] = IMPORT_TIME
+    metrics_server = None
+    if metrics is not None and metrics_port is not None:
+        metrics_server = MetricsServer(metrics, metrics_host, metrics_port)
+        metrics_server.start()
+    tracker = None
+    if coverage_path:
+        # Imported only when needed, the coverage module and its imports are slow to load
+        from app.coverage import CoverageTracker
+        tracker = CoverageTracker(emulator.cpu)
+        tracker.attach()
     try:
-        emulator.run_rom(path)
+        # Imported only when needed, like the coverage tracker: the process core pulls in multiprocessing
+        if out_of_process:
+            from app.process_core import ProcessEmulator
+            ProcessEmulator(emulator).run_rom(path)
+        elif threaded:
+            from app.threaded_emulator import ThreadedEmulator
+            ThreadedEmulator(emulator).run_rom(path)
+        else:
+            emulator.run_rom(path)
     except OSError:
         print("Can't open file %s" % path, file=sys.stderr)
+    except RomTooLargeError as e:
+        print("Can't load rom %s: %s" % (path, e), file=sys.stderr)
+    finally:
+        if metrics_server is not None:
+            metrics_server.stop()
+    if tracker is not None and os.path.isfile(path):
+        with open(coverage_path, 'w') as f:
+            f.write(tracker.report(os.path.getsize(path)) + '\n')
 
 
 if __name__ == '__main__':
-    if len(sys.argv) > 1:
-        run_emulation(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 10)
+    parser = argparse.ArgumentParser(description="Chip8 emulator")
+    parser.add_argument('rom_path')
+    parser.add_argument('cpu_cycles_per_frame', nargs='?', type=int, default=10)
+    parser.add_argument('--engine', choices=sorted(ENGINE_BACKENDS), default='pyglet')
+    parser.add_argument('--serve', metavar='PORT', type=int, help="Run headless and stream the screen over TCP/WebSocket")
+    parser.add_argument('--host', default='127.0.0.1', help="Address the stream and metrics servers listen on")
+    parser.add_argument('--record', metavar='PATH', help="Record every frame, see app/recorder.py to export it")
+    parser.add_argument('--record-input', metavar='PATH', help="Record the key events with keyframes, see app/input_recording.py to replay them")
+    parser.add_argument('--keyframe-interval', metavar='FRAMES', type=int, default=DEFAULT_KEYFRAME_INTERVAL,
+        help="Frames between the keyframes of --record-input (default %d)" % DEFAULT_KEYFRAME_INTERVAL)
+    parser.add_argument('--debug', action='store_true', help="Start paused in the interactive debugger")
+    parser.add_argument('--quirks', choices=sorted(QUIRK_PROFILES), help="Compatibility profile, guessed from the ROM by default")
+    parser.add_argument('--auto-tune', metavar='IPS', type=int, nargs='?', const=DEFAULT_TARGET_IPS,
+        help="Adjust the cycles per frame to run IPS instructions per second (default %d)" % DEFAULT_TARGET_IPS)
+    parser.add_argument('--threaded', action='store_true', help="Run the CPU on its own thread, apart from rendering and input")
+    parser.add_argument('--process', action='store_true', help="Run the CPU in a child process sharing the screen through shared memory")
+    parser.add_argument('--coverage', metavar='PATH', help="Count executed instructions and data accesses, write the coverage report to PATH on exit")
+    parser.add_argument('--metrics-port', metavar='PORT', type=int, help="Serve Prometheus metrics at http://HOST:PORT/metrics")
+    parser.add_argument('--metrics-log', metavar='PATH', help="Append the metrics as JSON lines to PATH every 10 seconds")
+    args = parser.parse_args()
+    if (args.metrics_port is not None or args.metrics_log) and (args.threaded or args.process):
+        parser.error("Metrics are measured by the main loop and can't be combined with --threaded or --process")
+    if args.record_input and (args.threaded or args.process or args.auto_tune):
+        parser.error("--record-input can't be combined with --threaded, --process or --auto-tune")
+    if args.keyframe_interval < 1:
+        parser.error("--keyframe-interval must be at least 1")
+    if args.coverage and args.process:
+        parser.error("--coverage can't be combined with --process")
+    if args.threaded and args.process:
+        parser.error("--threaded can't be combined with --process")
+    if (args.threaded or args.process) and args.auto_tune:
+        parser.error("--threaded and --process can't be combined with --auto-tune")
+    # Info lines would scroll the screen of the terminal engines away
+    logging.basicConfig(level=logging.WARNING if args.engine.startswith('terminal') and not args.debug else logging.INFO)
+    if args.debug:
+        from app.debugger import debug
+        debug(args.rom_path, args.cpu_cycles_per_frame, args.engine, args.quirks)
+    elif args.serve is not None:
+        from app.stream_server import serve
+        serve(args.rom_path, args.cpu_cycles_per_frame, args.host, args.serve, args.quirks)
     else:
-        print("Usage: %s <rom_path> [cpu_cycles_per_frame]" % sys.argv[0])
-
+        run_emulation(args.rom_path, args.cpu_cycles_per_frame, args.engine, args.record, args.quirks, args.auto_tune, args.threaded, args.process, args.coverage,
+            args.metrics_port, args.metrics_log, args.host, args.record_input, args.keyframe_interval)
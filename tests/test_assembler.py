@@ -0,0 +1,81 @@
+import re
+import unittest
+
+from app.assembler import INSTRUCTIONS, AssemblerError, assemble, benchmark, stress_rom, STRESS_SOURCES
+from app.constants import MEMORY_PROGRAM_START
+from app.golden import GoldenRun
+from app.quirks import Quirks
+
+class TestAssembler(unittest.TestCase):
+
+    def test_mnemonics_decode_to_their_handler(self):
+        cpu = GoldenRun(b'').cpu
+        cpu.set_quirks(Quirks())
+        for mnemonic, template in INSTRUCTIONS.items():
+            operands = ', '.join('V3' if field in ('X', 'Y') else '1' for field in re.findall(r'X|Y|N+', template))
+            rom = assemble('%s %s' % (mnemonic, operands))
+            self.assertEqual(len(rom), len(template) // 2)
+            opcode = int.from_bytes(rom[:2], 'big')
+            self.assertEqual(cpu.decode(opcode).__name__, 'opcode_' + mnemonic, mnemonic)
+
+    def test_encoding(self):
+        self.assertEqual(assemble('drw v1, VA, 0xF\nLD_i_long 0x1234\nPLANE 3'), bytes.fromhex('D1AF F000 1234 F301'))
+        self.assertEqual(assemble('DRW_clipped V1, VA, 15'), assemble('DRW V1, VA, 15'))
+
+    def test_labels_and_data(self):
+        rom = assemble('''
+            start: JMP end      ; forward reference
+            data:
+                db 1, 0b10, 0x3
+                dw 0xABCD, data
+            end:
+                LDI data        # labels are addresses
+                JMP start
+        ''')
+        data = MEMORY_PROGRAM_START + 2
+        end = data + 3 + 4
+        self.assertEqual(rom, bytes([0x10 | end >> 8, end & 0xFF, 1, 2, 3, 0xAB, 0xCD, data >> 8, data & 0xFF,
+            0xA0 | data >> 8, data & 0xFF, 0x12, 0x00]))
+
+    def test_errors(self):
+        for source, message in [
+            ('FOO V1', 'Unknown instruction'),
+            ('JMP nowhere', 'Unknown label'),
+            ('LD_byte V1, 256', 'fit'),
+            ('LD_byte 1, 2', 'register'),
+            ('CLR V1', 'operands'),
+            ('a:\na:', 'twice'),
+        ]:
+            with self.assertRaisesRegex(AssemblerError, message):
+                assemble(source)
+        with self.assertRaisesRegex(AssemblerError, 'line 3'):
+            assemble('CLR\n\nRET V0')
+
+    def test_stress_roms_run(self):
+        for kind in STRESS_SOURCES:
+            with self.subTest(kind=kind):
+                cpu = GoldenRun(stress_rom(kind), cycles_per_frame=500).cpu
+                for _ in range(20):
+                    cpu.update()
+                # Each program loops forever within the ROM
+                self.assertTrue(MEMORY_PROGRAM_START <= cpu.pc < MEMORY_PROGRAM_START + len(stress_rom(kind)))
+        cpu = GoldenRun(stress_rom('calls', depth=16)).cpu
+        for _ in range(5):
+            cpu.update()
+        with self.assertRaises(ValueError):
+            stress_rom('calls', depth=17)
+        with self.assertRaises(ValueError):
+            stress_rom('sound')
+
+    def test_stress_parameters(self):
+        self.assertGreater(len(stress_rom('draw', sprites=20)), len(stress_rom('draw', sprites=2)))
+        self.assertGreater(len(stress_rom('math', operations=64)), len(stress_rom('math', operations=8)))
+
+    def test_benchmark_fusion(self):
+        # The spin of the timer ROM is fused into one superinstruction, tens of times faster
+        rom = stress_rom('timer')
+        self.assertGreater(benchmark(rom, 10, fusion=True), 2 * benchmark(rom, 10, fusion=False))
+
+
+if __name__ == '__main__':
+    unittest.main()
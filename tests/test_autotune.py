@@ -0,0 +1,54 @@
+import unittest
+
+from app.autotune import MAX_SKIPPED_RENDERS, CycleTuner
+from app.emulator import Emulator
+
+class TestAutoTune(unittest.TestCase):
+
+    def test_fast_host_reaches_target(self):
+        tuner = CycleTuner(target_ips=1200, fps=60)
+        self.assertEqual(tuner.cycles_per_frame, 20)
+        for _ in range(10):
+            tuner.record(tuner.cycles_per_frame, 20 * 1e-6, 1e-3)
+        self.assertEqual(tuner.cycles_per_frame, 20)
+        self.assertEqual(tuner.render_interval, 1)
+        self.assertEqual(tuner.instructions_per_second, 1200)
+
+    def test_renders_are_skipped_before_cycles(self):
+        tuner = CycleTuner(target_ips=600, fps=60, budget_share=1.0)
+        # 10 cycles take 8 ms, a render 20 ms: renders every other frame would still overrun the 16.7 ms budget
+        for _ in range(50):
+            render = tuner.should_render()
+            tuner.record(tuner.cycles_per_frame, tuner.cycles_per_frame * 0.8e-3, 20e-3 if render else None)
+        self.assertEqual(tuner.cycles_per_frame, 10)
+        self.assertEqual(tuner.render_interval, 3)
+        self.assertLess(tuner.rendered_frames, tuner.frames)
+
+    def test_slow_host_lowers_cycles(self):
+        tuner = CycleTuner(target_ips=6000, fps=60, budget_share=1.0)
+        for _ in range(50):
+            render = tuner.should_render()
+            tuner.record(tuner.cycles_per_frame, tuner.cycles_per_frame * 1e-3, 10e-3 if render else None)
+        self.assertEqual(tuner.render_interval, MAX_SKIPPED_RENDERS + 1)
+        # 16.7 ms minus a fifth of a render leaves room for 14 cycles of 1 ms
+        self.assertEqual(tuner.cycles_per_frame, 14)
+        self.assertIn("14 cycles/frame", tuner.report())
+
+    def test_waiting_frames_are_not_measured(self):
+        tuner = CycleTuner()
+        tuner.record(0, 1.0, None)
+        self.assertIsNone(tuner.cycle_cost)
+        self.assertEqual(tuner.cycles_per_frame, 10)
+
+    def test_emulator(self):
+        emulator = Emulator(1, engine='headless', decode_cache=None, target_ips=300)
+        emulator.cpu.load_rom_bytes(bytes([0x70, 0x01, 0x12, 0x00])) # ADD V0, 1; JMP 0x200
+        for _ in range(3):
+            emulator.run_frame()
+        self.assertEqual(emulator.tuner.frames, 3)
+        self.assertEqual(emulator.cpu.cycles_per_frame, 5)
+        self.assertEqual(emulator.cpu.registers[0], 8)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import unittest
+
+from app.constants import SCREEN_SIZE
+from app.coverage import CoverageTracker, memory_read_ranges, run_coverage
+from app.cpu import CPU
+from app.engine.headless_engine_handler import HeadlessEngineHandler
+from app.golden import GoldenSuite
+from app.keyboard import Keyboard
+from app.renderer import Renderer
+from app.speaker import Speaker
+
+# 0x200 LD I, 0x20C; DRW V0, V0, 2; LD B, V0 (to 0x20C); JMP 0x208; SE V0, 1 (never run); data 0x80 0x80
+ROM = bytes([0xA2, 0x0C, 0xD0, 0x02, 0xF0, 0x33, 0x12, 0x06, 0x30, 0x01, 0x00, 0x00, 0x80, 0x80])
+
+class TestCoverage(unittest.TestCase):
+
+    def setUp(self):
+        engine = HeadlessEngineHandler(size=SCREEN_SIZE)
+        self.cpu = CPU(1, Renderer(engine, 1, (255, 255, 255)), Keyboard(engine), Speaker(engine, 440))
+        self.cpu.load_rom_bytes(ROM)
+        self.tracker = CoverageTracker(self.cpu)
+        self.tracker.attach()
+
+    def test_counts(self):
+        self.cpu.run_cycles(6)
+        self.assertEqual(self.tracker.executions[0x200:0x20A:2], [1, 1, 1, 3, 0])
+        self.assertEqual(self.tracker.reads[0x20C:0x20F], [1, 1, 0])
+        self.assertEqual(self.tracker.writes[0x20C:0x20F], [1, 1, 1])
+        self.assertEqual(self.tracker.hotspots(1)[0], (0x206, 3, 'opcode_JMP'))
+        self.tracker.detach()
+        self.cpu.run_cycles(2)
+        self.assertEqual(self.tracker.executions[0x206], 3)
+
+    def test_read_ranges(self):
+        self.cpu.i = 0x300
+        self.assertEqual(memory_read_ranges(self.cpu, 0xD125), [(0x300, 0x305)])
+        self.cpu.renderer.select_planes(0b11)
+        self.assertEqual(memory_read_ranges(self.cpu, 0xD125), [(0x300, 0x30A)])
+        self.assertEqual(memory_read_ranges(self.cpu, 0xD120), [])
+        self.assertEqual(memory_read_ranges(self.cpu, 0xF365), [(0x300, 0x304)])
+        self.assertEqual(memory_read_ranges(self.cpu, 0x5313), [(0x300, 0x303)])
+        self.assertEqual(memory_read_ranges(self.cpu, 0xF002), [(0x300, 0x310)])
+        self.assertEqual(memory_read_ranges(self.cpu, 0xF355), [])
+        # Loads wrap around the end of memory, sprites are cut there
+        self.cpu.i = 0xFFFE
+        self.assertEqual(memory_read_ranges(self.cpu, 0xF365), [(0xFFFE, 0x10000), (0x0000, 0x0002)])
+        self.assertEqual(memory_read_ranges(self.cpu, 0xF002), [(0xFFFE, 0x10000), (0x0000, 0x000E)])
+        self.assertEqual(memory_read_ranges(self.cpu, 0xD125), [(0xFFFE, 0x10000)])
+
+    def test_accesses_across_the_end_of_memory(self):
+        # LD I, 0xFFFF; LD [I], V0-V1; LD V0-V1, [I]
+        self.cpu.load_rom_bytes(bytes([0xF0, 0x00, 0xFF, 0xFF, 0xF1, 0x55, 0xF1, 0x65]))
+        self.cpu.run_cycles(3)
+        self.assertEqual((self.tracker.writes[0xFFFF], self.tracker.writes[0]), (1, 1))
+        self.assertEqual((self.tracker.reads[0xFFFF], self.tracker.reads[0]), (1, 1))
+        # LD V0, 7 split by the end of memory
+        self.cpu.memory[0xFFFF], self.cpu.memory[0] = 0x60, 0x07
+        self.cpu.pc = 0xFFFF
+        self.cpu.run_cycles(1)
+        self.assertEqual((self.tracker.executions[0xFFFF], self.cpu.registers[0], self.cpu.pc), (1, 7, 0x0001))
+        self.assertEqual(self.tracker.byte_executions()[0], 1)
+
+    def test_report(self):
+        self.cpu.run_cycles(6)
+        self.assertEqual(self.tracker.uncovered_ranges(0x200, 0x200 + len(ROM)), [(0x208, 0x20C)])
+        report = self.tracker.report(len(ROM))
+        self.assertIn("Executed: 8 bytes (57.1%)", report)
+        # The third BCD digit is written after the end of the ROM
+        self.assertIn("Data read: 2 bytes, written: 2 bytes", report)
+        self.assertIn("0x0208-0x020B", report)
+        self.assertIn("0x0200 |........    dd ", report)
+
+    def test_heat_map_png(self):
+        self.cpu.run_cycles(6)
+        png = self.tracker.heat_map_png(0x200, 0x200 + len(ROM), scale=2)
+        self.assertTrue(png.startswith(b'\x89PNG'))
+        # 32 bytes of 2 pixels per row, a single row
+        self.assertEqual(png[16:24], (64).to_bytes(4, 'big') + (2).to_bytes(4, 'big'))
+
+    def test_golden_script_coverage(self):
+        suite = GoldenSuite('tests/golden', 'roms')
+        with open('roms/PONG', 'rb') as f:
+            rom = f.read()
+        tracker = run_coverage(rom, 120, suite.input_events('PONG'))
+        executed = {address for address, count in enumerate(tracker.executions) if count}
+        # The paddle moves: the input handling code after SKNP runs
+        self.assertGreater(len(executed), 50)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import unittest
+
+from app.cpu import CPU
+from app.debugger import Debugger, DebuggerError, RegisterCondition, memory_ranges
+from app.engine.headless_engine_handler import HeadlessEngineHandler
+from app.engine.vector2 import Vector2
+from app.keyboard import Keyboard
+from app.renderer import Renderer
+from app.speaker import Speaker
+
+# LD V0, 5; LD I, 0x300; CALL 0x210; ADD V0, 1; JMP 0x204; ...; 0x210: LD B, V0; RET
+ROM = bytes([0x60, 0x05, 0xA3, 0x00, 0x22, 0x10, 0x70, 0x01, 0x12, 0x04] + [0] * 6 + [0xF0, 0x33, 0x00, 0xEE])
+
+class TestDebugger(unittest.TestCase):
+
+    def setUp(self) -> None:
+        engine = HeadlessEngineHandler(size=Vector2(64, 32))
+        self.cpu = CPU(10, Renderer(engine, 1, (255, 255, 255)), Keyboard(engine), Speaker(engine, 440))
+        self.cpu.load_rom_bytes(ROM)
+        self.debugger = Debugger(self.cpu)
+
+    def test_fast_path_without_breakpoints(self):
+        self.assertNotIn('run_cycles', self.cpu.__dict__)
+        self.debugger.add_breakpoint(0x206)
+        self.debugger.add_watchpoint(0x300)
+        self.assertTrue(self.debugger.checking)
+        self.debugger.remove_breakpoint(0x206)
+        self.assertTrue(self.debugger.checking)
+        self.debugger.remove_watchpoint(0x300)
+        self.assertFalse(self.debugger.checking)
+        self.assertEqual(self.cpu.run_cycles.__func__, CPU.run_cycles)
+        with self.assertRaises(DebuggerError):
+            self.debugger.remove_breakpoint(0x206)
+
+    def test_breakpoint(self):
+        self.debugger.add_breakpoint(0x206)
+        self.cpu.update()
+        self.assertTrue(self.debugger.paused)
+        self.assertEqual(self.cpu.pc, 0x206)
+        self.assertEqual(self.debugger.last_event.reason, 'breakpoint')
+        self.assertEqual(self.cpu.registers[0], 5, "The instruction at the breakpoint should not have run")
+
+        self.debugger.resume()
+        self.cpu.update()
+        self.assertEqual(self.cpu.pc, 0x206)
+        self.assertEqual(self.cpu.registers[0], 6)
+
+    def test_conditional_breakpoint(self):
+        self.debugger.add_breakpoint(0x206, RegisterCondition.parse('v0 >= 0x8'))
+        for _ in range(3):
+            self.cpu.update()
+        self.assertTrue(self.debugger.paused)
+        self.assertEqual(self.cpu.registers[0], 8)
+        self.assertEqual(self.debugger.last_event.detail, 'V0 >= 0x08')
+        with self.assertRaises(DebuggerError):
+            RegisterCondition.parse('v0 = 1')
+
+    def test_watchpoint(self):
+        self.debugger.add_watchpoint(0x301, 0x302)
+        self.cpu.update()
+        event = self.debugger.last_event
+        self.assertEqual(event.reason, 'watchpoint')
+        self.assertEqual(event.pc, 0x210)
+        self.assertEqual(self.cpu.pc, 0x212, "Watchpoints pause after the write")
+        self.assertEqual(event.detail, '0x0301-0x0301: 00 -> 00')
+        self.debugger.resume()
+        self.cpu.update()
+        self.assertEqual(self.debugger.last_event.detail, '0x0301-0x0301: 00 -> 00')
+        self.assertEqual(self.cpu.memory[0x302], 6)
+
+    def test_watchpoint_across_the_end_of_memory(self):
+        # LD I, 0xFFFE; LD V2, 7; LD [I], V0-V2: V2 is stored at address 0
+        self.cpu.load_rom_bytes(bytes([0xF0, 0x00, 0xFF, 0xFE, 0x62, 0x07, 0xF2, 0x55]))
+        self.debugger.add_watchpoint(0x0000, 0x0002)
+        self.cpu.update()
+        event = self.debugger.last_event
+        self.assertEqual(event.reason, 'watchpoint')
+        self.assertEqual(event.pc, 0x206)
+        self.assertEqual(event.detail, '0x0000-0x0000: f0 -> 07')
+
+    def test_memory_ranges(self):
+        self.assertEqual(memory_ranges(0x300, 3), [(0x300, 0x303)])
+        self.assertEqual(memory_ranges(0xFFFE, 3), [(0xFFFE, 0x10000), (0x0000, 0x0001)])
+        self.assertEqual(memory_ranges(0x10001, 2), [(0x0001, 0x0003)])
+
+    def test_step_and_step_over(self):
+        self.debugger.step()
+        self.debugger.step()
+        self.assertEqual(self.cpu.pc, 0x204)
+        self.assertIsNone(self.debugger.step_over())
+        self.cpu.update()
+        self.assertEqual(self.cpu.pc, 0x206)
+        self.assertEqual(self.debugger.last_event.reason, 'step')
+        self.assertEqual(self.cpu.memory[0x302], 5, "The subroutine should have run")
+        self.assertFalse(self.debugger.checking)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from app.cpu import CPU
+from app.decode_cache import DecodeCache, DecodedRom
+from app.emulator import Emulator
+from app.engine.headless_engine_handler import HeadlessEngineHandler
+from app.engine.vector2 import Vector2
+from app.keyboard import Keyboard
+from app.renderer import Renderer
+from app.speaker import Speaker
+
+# 0x200: LD V0, 0 ; 0x202: ADD V0, 1 ; 0x204: SE V0, 5 ; 0x206: JMP 0x202 ; 0x208: JMP 0x208
+ROM = bytes([0x60, 0x00, 0x70, 0x01, 0x30, 0x05, 0x12, 0x02, 0x12, 0x08])
+
+class TestDecodeCache(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = DecodeCache(self.directory.name)
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def create_cpu(self) -> CPU:
+        engine = HeadlessEngineHandler(size=Vector2(64, 32))
+        renderer: Renderer = Renderer(engine, 10, (100, 100, 100))
+        return CPU(20, renderer, Keyboard(engine), Speaker(engine, 440), self.cache)
+
+    def test_store_and_load(self):
+        decoded_rom = DecodedRom({0x200: (0x1200, 'opcode_JMP')})
+        self.cache.store('abc', decoded_rom)
+        self.assertEqual(self.cache.load('abc'), decoded_rom)
+        self.assertIsNone(self.cache.load('def'))
+
+    def test_version_mismatch(self):
+        self.cache.store('abc', DecodedRom({0x200: (0x1200, 'opcode_JMP')}))
+        self.assertIsNone(DecodeCache(self.directory.name, version='0.0.0').load('abc'))
+
+    def test_invalid_entry_is_dropped(self):
+        with open(self.cache.path('abc'), 'w') as f:
+            f.write('{"sha1": "abc"')
+        self.assertIsNone(self.cache.load('abc'))
+        self.assertFalse(os.path.exists(self.cache.path('abc')))
+
+    def test_entry_evicted_while_loading(self):
+        self.cache.store('abc', DecodedRom({0x200: (0x1200, 'opcode_JMP')}))
+        # Another process evicts the entry between the read and the access time update
+        with patch('app.decode_cache.os.utime', side_effect=FileNotFoundError()):
+            self.assertIsNone(self.cache.load('abc'))
+
+    def test_lru_eviction(self):
+        decoded_rom = DecodedRom({address: (0x1200, 'opcode_JMP') for address in range(0x200, 0x300, 2)})
+        self.cache.store('a', decoded_rom)
+        self.cache.max_size = os.path.getsize(self.cache.path('a')) * 2
+        os.utime(self.cache.path('a'), (0, 0))
+        self.cache.store('b', decoded_rom)
+        os.utime(self.cache.path('b'), (1, 1))
+        self.cache.load('a') # a is now the most recently used
+        self.cache.store('c', decoded_rom)
+        self.assertTrue(os.path.exists(self.cache.path('a')))
+        self.assertFalse(os.path.exists(self.cache.path('b')))
+        self.assertTrue(os.path.exists(self.cache.path('c')))
+
+    def test_cpu_warm_start(self):
+        cpu = self.create_cpu()
+        cpu.load_rom_bytes(ROM)
+        cpu.update()
+        cpu.save_decode_cache()
+        self.assertEqual(sorted(cpu.decoded), [0x200, 0x202, 0x204, 0x206, 0x208])
+
+        cpu = self.create_cpu()
+        cpu.load_rom_bytes(ROM)
+        self.assertEqual(sorted(cpu.decoded), [0x200, 0x202, 0x204, 0x206, 0x208])
+        self.assertEqual(cpu.decoded[0x206], (0x1202, cpu.opcode_JMP))
+
+        # Entries not matching memory are ignored
+        cpu = self.create_cpu()
+        cpu.load_rom_bytes(ROM[:6] + bytes([0x00, 0xE0]) + ROM[8:])
+        self.assertNotIn(0x206, cpu.decoded)
+
+    def test_self_modifying_code(self):
+        cpu = self.create_cpu()
+        cpu.load_rom_bytes(ROM)
+        cpu.execute_cycle()
+        self.assertEqual(cpu.registers[0], 0)
+        cpu.memory[0x201] = 0x42
+        cpu.pc = 0x200
+        cpu.execute_cycle()
+        self.assertEqual(cpu.registers[0], 0x42)
+
+    def test_emulator_has_no_cache_by_default(self):
+        # Only the command line entry points write to the user cache directory
+        self.assertIsNone(Emulator(10, engine='headless').cpu.decode_cache)
+
+
+if __name__ == '__main__':
+    unittest.main()
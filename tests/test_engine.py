@@ -0,0 +1,133 @@
+import io
+import logging
+import os
+import subprocess
+import sys
+import unittest
+from unittest.mock import patch
+
+from app.engine import UnknownEngineError, create_engine_handler
+from app.engine.headless_engine_handler import HeadlessEngineHandler
+from app.engine.terminal_engine_handler import KEY_HOLD_TIME, KEY_REPEAT_DELAY, BrailleTerminalEngineHandler, QuadrantTerminalEngineHandler, TerminalEngineHandler
+from app.engine.vector2 import Vector2
+from app.key import Key
+from app.keyboard import Keyboard
+from app.renderer import Renderer
+
+class TestEngine(unittest.TestCase):
+
+    def test_core_does_not_import_backends(self):
+        code = "import sys, app.cpu, app.emulator; print(sorted(m for m in sys.modules if m.startswith('pyglet')))"
+        output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout
+        self.assertEqual(output.strip(), '[]')
+
+    def test_main_does_not_import_optional_cores(self):
+        code = "import sys, main; print(sorted(m for m in ('multiprocessing', 'app.process_core', 'app.threaded_emulator', 'app.coverage') if m in sys.modules))"
+        output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout
+        self.assertEqual(output.strip(), '[]')
+
+    def test_create_engine_handler(self):
+        engine = create_engine_handler('headless', Vector2(64, 32))
+        self.assertIsInstance(engine, HeadlessEngineHandler)
+        with self.assertRaises(UnknownEngineError):
+            create_engine_handler('unknown', Vector2(64, 32))
+
+    def test_headless_input(self):
+        engine = HeadlessEngineHandler(Vector2(64, 32))
+        keyboard = Keyboard(engine)
+        engine.press(Key.A)
+        self.assertTrue(keyboard.is_key_pressed(Key.A))
+        engine.release(Key.A)
+        self.assertFalse(keyboard.is_key_pressed(Key.A))
+
+    def test_terminal_diff_output(self):
+        output = io.StringIO()
+        engine = TerminalEngineHandler(Vector2(640, 320), output=output)
+        renderer = Renderer(engine, 10, (200, 40, 40))
+        renderer.draw_sprite(0, 0, [0xC0, 0x80], renderer.planes[0])
+        renderer.render()
+        first = output.getvalue()
+        # Every cell is drawn once, pixels (0, 0) and (0, 1) share a cell
+        self.assertEqual(first.count('\x1b[1;1H'), 1)
+        self.assertIn('\x1b[48;2;200;40;40m ', first)
+        self.assertIn('\x1b[38;2;200;40;40m\x1b[48;2;0;0;0m▀', first)
+
+        output.truncate(0)
+        output.seek(0)
+        renderer.render()
+        self.assertEqual(output.getvalue(), '')
+
+        renderer.draw_sprite(10, 20, [0x80], renderer.planes[0])
+        renderer.dirty = True
+        renderer.render()
+        update = output.getvalue()
+        self.assertEqual(update, '\x1b[11;11H\x1b[38;2;200;40;40m\x1b[48;2;0;0;0m▀\x1b[0m')
+        self.assertLess(engine.bytes_written, 2 * len(first))
+
+    def test_terminal_braille(self):
+        output = io.StringIO()
+        engine = BrailleTerminalEngineHandler(Vector2(64, 32))
+        engine.output = output
+        renderer = Renderer(engine, 1, (255, 255, 255))
+        renderer.draw_sprite(0, 0, [0x80, 0x40, 0x00, 0x40], renderer.planes[0])
+        renderer.render()
+        # Dots (0, 0), (1, 1) and (1, 3) of the first cell
+        self.assertIn(chr(0x2800 + 0x01 + 0x10 + 0x80), output.getvalue())
+        self.assertEqual(engine.columns, 32)
+        self.assertEqual(engine.lines, 8)
+
+    def test_terminal_quadrant(self):
+        output = io.StringIO()
+        engine = QuadrantTerminalEngineHandler(Vector2(64, 32))
+        engine.output = output
+        renderer = Renderer(engine, 1, (255, 255, 255))
+        renderer.draw_sprite(0, 0, [0x90, 0x60], renderer.planes[0])
+        renderer.render()
+        # Top left and bottom right pixels of the first cell, top right and bottom left ones of the second
+        self.assertIn('▚▞', output.getvalue())
+        self.assertEqual(engine.columns, 32)
+        self.assertEqual(engine.lines, 16)
+        self.assertIsInstance(create_engine_handler('terminal-quadrant', Vector2(64, 32)), QuadrantTerminalEngineHandler)
+
+    def test_terminal_input(self):
+        engine = TerminalEngineHandler(Vector2(64, 32), output=io.StringIO())
+        keyboard = Keyboard(engine)
+        engine.read_input('wq', 10.0)
+        self.assertTrue(keyboard.is_key_pressed(Key.FIVE))
+        self.assertTrue(keyboard.is_key_pressed(Key.FOUR))
+        # Held keys are only repeated by the terminal after its repeat delay
+        engine.release_keys(10.0 + KEY_HOLD_TIME + 0.01)
+        self.assertTrue(keyboard.is_key_pressed(Key.FIVE))
+        self.assertTrue(keyboard.is_key_pressed(Key.FOUR))
+        # Key repeats keep the key held
+        engine.read_input('w', 10.6)
+        engine.release_keys(10.0 + KEY_REPEAT_DELAY + 0.01)
+        self.assertTrue(keyboard.is_key_pressed(Key.FIVE))
+        self.assertFalse(keyboard.is_key_pressed(Key.FOUR))
+        # Repeats come quickly, the key is released soon after they stop
+        engine.release_keys(10.6 + KEY_HOLD_TIME + 0.01)
+        self.assertFalse(keyboard.is_key_pressed(Key.FIVE))
+        self.assertFalse(keyboard.is_key_pressed(Key.FIVE))
+        engine.read_input('\x1b', 11.0)
+        self.assertFalse(engine.update())
+
+    def test_terminal_leaves_logging_alone(self):
+        level = logging.root.level
+        # A pipe is not a terminal: no keyboard input
+        read_fd, write_fd = os.pipe()
+        self.addCleanup(os.close, read_fd)
+        self.addCleanup(os.close, write_fd)
+        engine = TerminalEngineHandler(Vector2(64, 32), output=io.StringIO(), input_fd=read_fd)
+        logging.root.setLevel(logging.DEBUG)
+        self.addCleanup(logging.root.setLevel, level)
+        with patch('app.engine.terminal_engine_handler.atexit'), patch('logging.warning') as warning:
+            engine.start()
+        warning.assert_called_once()
+        self.assertEqual(logging.root.level, logging.DEBUG)
+
+    def test_create_terminal_engine(self):
+        self.assertIsInstance(create_engine_handler('terminal', Vector2(64, 32)), TerminalEngineHandler)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+import unittest
+
+from app.frame_codec import FrameCodecError, FrameDecoder, copy_frame, decode_row, empty_frame, encode_frame, encode_row
+
+class TestFrameCodec(unittest.TestCase):
+
+    def test_row_round_trip(self):
+        for row in [0, (1 << 64) - 1, 1, 1 << 63, 0xF0F0F0F0F0F0F0F0, 0x0123456789ABCDEF]:
+            self.assertEqual(decode_row(encode_row(row)), row, "Row %x did not survive encoding" % row)
+        self.assertEqual(encode_row(0), bytes([64]))
+        self.assertEqual(encode_row(0xFF << 56), bytes([0, 8, 56]))
+
+    def test_delta_frame_contains_changed_rows_only(self):
+        frame = empty_frame()
+        previous = copy_frame(frame)
+        frame[0][3] = 0xFF
+        frame[1][31] = 1
+        decoder = FrameDecoder()
+        decoder.apply(encode_frame(0, previous))
+        message = encode_frame(1, frame, previous)
+        self.assertEqual(len(message), len(encode_frame(1, empty_frame(), empty_frame())) + 2 * 3 + 2 + 2)
+        self.assertEqual(decoder.apply(message), 1)
+        self.assertEqual(decoder.planes, frame)
+
+    def test_key_frame_resets_state(self):
+        frame = empty_frame()
+        frame[0][0] = 0xABCDEF
+        decoder = FrameDecoder()
+        decoder.apply(encode_frame(0, frame))
+        self.assertEqual(decoder.planes, frame)
+        decoder.apply(encode_frame(1, empty_frame()))
+        self.assertEqual(decoder.planes, empty_frame())
+
+    def test_invalid_messages(self):
+        with self.assertRaises(FrameCodecError):
+            FrameDecoder().apply(encode_frame(1, empty_frame(), empty_frame()))
+        with self.assertRaises(FrameCodecError):
+            FrameDecoder().apply(encode_frame(0, empty_frame())[:-3])
+        with self.assertRaises(FrameCodecError):
+            FrameDecoder().apply(b'\x07')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import random
+import unittest
+from unittest.mock import patch
+
+from app.fuzz import CPUEngine, FUZZ_ENGINES, Fuzzer, random_case
+
+class CarrylessCPUEngine(CPUEngine):
+    """ Engine with a deliberate bug: 8XY4 never sets the carry """
+
+    def __init__(self) -> None:
+        super().__init__()
+        cpu = self.cpu
+
+        def add_without_carry(opcode: int) -> None:
+            regx = (opcode & 0xF00) >> 8
+            regy = (opcode & 0xF0) >> 4
+            cpu.registers[regx] = (cpu.registers[regx] + cpu.registers[regy]) & 0xFF
+        cpu.opcode_ADD_reg = add_without_carry
+
+
+class TestFuzz(unittest.TestCase):
+
+    def test_engines_agree(self):
+        fuzzer = Fuzzer(['reference', 'cpu', 'direct'], seed=1)
+        failures = fuzzer.run(500)
+        self.assertEqual(failures, [], failures and failures[0].report())
+        self.assertEqual(fuzzer.cases, 500)
+        self.assertGreater(fuzzer.steps, 500)
+
+    def test_cases_are_reproducible(self):
+        self.assertEqual(random_case(random.Random(3)), random_case(random.Random(3)))
+
+    def test_divergence_is_minimised(self):
+        with patch.dict(FUZZ_ENGINES, {'carryless': CarrylessCPUEngine}):
+            fuzzer = Fuzzer(['reference', 'carryless'], seed=2)
+            failures = fuzzer.run(2000)
+        self.assertEqual(len(failures), 1)
+        failure = failures[0]
+        self.assertEqual(failure.opcode & 0xF00F, 0x8004)
+        self.assertEqual(len(failure.case.program), 1)
+        self.assertEqual(failure.step, 0)
+        self.assertTrue(any(difference.startswith('registers') for difference in failure.differences))
+
+    def test_memory_wraps_around(self):
+        # Register stores and loads, BCD and audio pattern loads crossing the end of memory
+        program = (0xFE55, 0x6000, 0xFE65, 0x50F2, 0x5F03, 0xF002, 0xF533)
+        fuzzer = Fuzzer(['reference', 'cpu', 'direct'])
+        for i in (0xFFF8, 0xFFFE, 0xFFFF):
+            case = random_case(random.Random(i))._replace(program=program, i=i)
+            divergence = fuzzer.run_case(case)
+            self.assertIsNone(divergence, divergence and divergence.report())
+
+    def test_needs_two_engines(self):
+        with self.assertRaises(ValueError):
+            Fuzzer(['cpu'])
+
+
+if __name__ == '__main__':
+    unittest.main()
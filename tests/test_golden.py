@@ -0,0 +1,50 @@
+import os
+import unittest
+
+from app.frame_codec import empty_frame
+from app.golden import GoldenRun, GoldenSuite, InputEvent, InputScriptError, dump_frame, frame_hash, parse_input_script
+from app.key import Key
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GOLDEN_DIRECTORY = os.path.join(ROOT, 'tests', 'golden')
+ROM_DIRECTORY = os.path.join(ROOT, 'roms')
+
+# Draws a random byte as a sprite at 0/0 every frame: RND V0, FF; LD I, 0x300; LD [I], V0; DRW V1, V1, 1; JMP 0x200
+RANDOM_ROM = bytes([0xC0, 0xFF, 0xA3, 0x00, 0xF0, 0x55, 0xD1, 0x11, 0x12, 0x00])
+
+class TestGolden(unittest.TestCase):
+
+    def test_parse_input_script(self):
+        events = parse_input_script("# comment\n\n12 -a\n10 +A  # press\n")
+        self.assertEqual(events, [InputEvent(10, Key.A, True), InputEvent(12, Key.A, False)])
+        for invalid in ["10", "10 5", "x +5", "10 +G"]:
+            with self.assertRaises(InputScriptError):
+                parse_input_script(invalid)
+
+    def test_seeded_runs_are_deterministic(self):
+        first = GoldenRun(RANDOM_ROM, seed=1).run([5, 10])
+        self.assertEqual(GoldenRun(RANDOM_ROM, seed=1).run([5, 10]), first)
+        self.assertNotEqual(GoldenRun(RANDOM_ROM, seed=2).run([5, 10]), first)
+
+    def test_dump_frame(self):
+        planes = empty_frame()
+        planes[0][0] = 0b11 << 62
+        planes[1][0] = 0b01 << 62
+        planes[1][1] = 1
+        lines = dump_frame(planes).splitlines()
+        self.assertEqual(len(lines), 32)
+        self.assertEqual(lines[0][:3], '#@.')
+        self.assertEqual(lines[1][-1], 'o')
+        self.assertNotEqual(frame_hash(planes), frame_hash(empty_frame()))
+
+    def test_corpus(self):
+        suite = GoldenSuite(GOLDEN_DIRECTORY, ROM_DIRECTORY)
+        self.assertEqual(sorted(suite.hashes), suite.rom_names(), "Every ROM of the corpus should have golden hashes")
+        for rom_name in sorted(suite.hashes):
+            with self.subTest(rom=rom_name):
+                mismatch = suite.check(rom_name)
+                self.assertIsNone(mismatch, mismatch and mismatch.report())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import os
+import random
+import tempfile
+import unittest
+
+from app.emulator import Emulator
+from app.golden import GoldenSuite
+from app.input_recording import InputRecorder, InputRecordingReader, InputReplay, decode_keyframe, encode_keyframe
+from app.key import Key
+from app.recorder import RecordingError
+
+FRAMES = 400
+INTERVAL = 50
+
+class TestInputRecording(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'session.ch8i')
+        with open('roms/PONG', 'rb') as f:
+            self.rom = f.read()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def record(self, close: bool = True) -> list:
+        """ Runs PONG with its golden input script, returns the snapshot before each frame and after the last one """
+        events = GoldenSuite('tests/golden', 'roms').input_events('PONG')
+        recorder = InputRecorder(self.path, keyframe_interval=INTERVAL)
+        emulator = Emulator(10, engine='headless', decode_cache=None, quirks='modern', input_recorder=recorder)
+        emulator.cpu.load_rom_bytes(self.rom)
+        recorder.start(emulator.cpu, self.rom)
+        emulator.cpu.rng.seed(7)
+        snapshots = []
+        for frame in range(FRAMES):
+            for event in events:
+                if event.frame == frame:
+                    (emulator.engine.press if event.down else emulator.engine.release)(event.key)
+            # As in Emulator.run_frame, after the engine update
+            recorder.capture()
+            snapshots.append(emulator.cpu.snapshot())
+            emulator.cpu.update()
+        snapshots.append(emulator.cpu.snapshot())
+        if close:
+            recorder.close()
+        else:
+            recorder.file.flush()
+        return snapshots
+
+    def test_keyframe_round_trip(self):
+        self.record()
+        reader = InputRecordingReader(self.path)
+        state, keys = reader.read_keyframe(reader.keyframes[1][1])
+        self.assertEqual(decode_keyframe(encode_keyframe(state, keys)), (state, keys))
+        replay = InputReplay(self.path, self.rom)
+        self.assertEqual(replay.seek(INTERVAL).snapshot(), state)
+
+    def test_index(self):
+        self.record()
+        reader = InputRecordingReader(self.path)
+        self.assertTrue(reader.finished)
+        self.assertEqual(reader.frame_count, FRAMES)
+        self.assertEqual([frame for frame, _ in reader.keyframes], list(range(0, FRAMES, INTERVAL)))
+        events = list(reader.events(reader.keyframes[0][1]))
+        self.assertEqual([(event.frame, event.key, event.down) for event in events[:2]], [(60, Key.ONE, True), (120, Key.ONE, False)])
+
+    def test_seek(self):
+        snapshots = self.record()
+        replay = InputReplay(self.path, self.rom)
+        # In any order, replaying at most a keyframe interval
+        for frame in random.Random(1).sample(range(FRAMES + 1), 40) + [FRAMES, 0, 60, 61, 120, 250]:
+            self.assertEqual(replay.seek(frame).snapshot(), snapshots[frame], frame)
+            self.assertLessEqual(replay.frames_replayed, INTERVAL)
+        with self.assertRaises(RecordingError):
+            replay.seek(FRAMES + 1)
+
+    def test_unfinished_recording(self):
+        snapshots = self.record(close=False)
+        reader = InputRecordingReader(self.path)
+        self.assertFalse(reader.finished)
+        self.assertEqual(len(reader.keyframes), FRAMES // INTERVAL)
+        replay = InputReplay(self.path, self.rom)
+        self.assertEqual(replay.seek(reader.frame_count).snapshot(), snapshots[reader.frame_count])
+
+    def test_other_rom(self):
+        self.record()
+        with self.assertRaises(RecordingError):
+            InputReplay(self.path, self.rom[:-1])
+        with open(self.path, 'r+b') as f:
+            f.write(b'XXXX')
+        with self.assertRaises(RecordingError):
+            InputRecordingReader(self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+import asyncio
+import os
+import tempfile
+import unittest
+
+from app.golden import GoldenSuite
+from app.job_queue import JOB_DONE, JOB_ERROR, JOB_TIMEOUT, Job, JobCoordinator, ResultStore, encode_message, golden_jobs, read_message, start_local_workers
+
+# Returns with an empty stack
+CRASH_ROM = bytes([0x00, 0xEE])
+# Jumps to itself
+LOOP_ROM = bytes([0x12, 0x00])
+# LD V0, 0x20; SKP V0: 0x20 is not a key
+BAD_KEY_ROM = bytes([0x60, 0x20, 0xE0, 0x9E])
+
+class TestJobQueue(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = ResultStore(os.path.join(self.directory.name, 'results.jsonl'))
+        self.coordinator = JobCoordinator(self.store, port=0, max_attempts=2, timeout_grace=1.0)
+        await self.coordinator.start()
+        self.workers = []
+
+    async def asyncTearDown(self) -> None:
+        await self.coordinator.stop()
+        for worker in self.workers:
+            await asyncio.get_running_loop().run_in_executor(None, worker.wait, 10)
+            self.assertEqual(worker.returncode, 0)
+        self.directory.cleanup()
+
+    def start_workers(self, count: int) -> None:
+        self.workers += start_local_workers(count, self.coordinator.port)
+
+    async def test_golden_hashes_with_local_workers(self):
+        suite = GoldenSuite('tests/golden', 'roms')
+        jobs = golden_jobs(suite)[:9]
+        self.start_workers(3)
+        results = await asyncio.wait_for(asyncio.gather(*[self.coordinator.submit(job) for job in jobs]), 60)
+        for job, result in zip(jobs, results):
+            self.assertEqual(result.status, JOB_DONE)
+            self.assertEqual(result.hashes, suite.hashes[job.job_id], job.job_id)
+            self.assertEqual(result.attempts, 1)
+        self.assertEqual(len(self.coordinator.workers), 3)
+        # The results store survives the coordinator
+        self.assertEqual(ResultStore(self.store.path).get(jobs[0].job_id), results[0])
+
+    async def test_rom_error_is_not_retried(self):
+        self.start_workers(1)
+        result = await asyncio.wait_for(self.coordinator.submit(Job('crash', CRASH_ROM, [10])), 30)
+        self.assertEqual(result.status, JOB_ERROR)
+        self.assertIn('StackUnderflowError', result.error)
+        self.assertEqual(result.attempts, 1)
+
+    async def test_emulator_error_keeps_the_workers(self):
+        suite = GoldenSuite('tests/golden', 'roms')
+        jobs = golden_jobs(suite)[:2]
+        self.start_workers(2)
+        bad, *results = await asyncio.wait_for(asyncio.gather(
+            self.coordinator.submit(Job('bad-key', BAD_KEY_ROM, [10])), *[self.coordinator.submit(job) for job in jobs]), 60)
+        self.assertEqual(bad.status, JOB_ERROR)
+        self.assertIn('ValueError', bad.error)
+        self.assertEqual(bad.attempts, 1)
+        for job, result in zip(jobs, results):
+            self.assertEqual(result.status, JOB_DONE)
+            self.assertEqual(result.hashes, suite.hashes[job.job_id], job.job_id)
+        self.assertEqual(len(self.coordinator.workers), 2)
+
+    async def test_timeout_is_retried(self):
+        self.start_workers(2)
+        result = await asyncio.wait_for(self.coordinator.submit(Job('slow', LOOP_ROM, [10 ** 9], timeout=0.2)), 30)
+        self.assertEqual(result.status, JOB_TIMEOUT)
+        self.assertEqual(result.attempts, 2)
+
+    async def test_lost_worker(self):
+        # A worker that disconnects once it got the job
+        reader, writer = await asyncio.open_connection('127.0.0.1', self.coordinator.port)
+        writer.write(encode_message({'type': 'hello', 'worker': 'flaky'}))
+        future = self.coordinator.submit(Job('pong', open('roms/PONG', 'rb').read(), [60, 120]))
+        self.assertEqual((await read_message(reader))['job_id'], 'pong')
+        writer.close()
+        while not self.coordinator.pending:
+            await asyncio.sleep(0.01)
+        self.start_workers(1)
+        result = await asyncio.wait_for(future, 30)
+        self.assertEqual(result.status, JOB_DONE)
+        self.assertEqual(result.attempts, 2)
+        self.assertEqual(sorted(result.hashes), [60, 120])
+
+    async def test_unanswered_job(self):
+        # A worker that never answers, the coordinator gives up after the job timeout and grace period
+        reader, writer = await asyncio.open_connection('127.0.0.1', self.coordinator.port)
+        writer.write(encode_message({'type': 'hello', 'worker': 'stuck'}))
+        self.coordinator.max_attempts = 1
+        result = await asyncio.wait_for(self.coordinator.submit(Job('stuck', LOOP_ROM, [10], timeout=0.1)), 10)
+        self.assertEqual(result.status, JOB_TIMEOUT)
+        self.assertEqual(result.worker, 'stuck')
+        # and drops the connection
+        await reader.read()
+        self.assertTrue(reader.at_eof())
+        writer.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
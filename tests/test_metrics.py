@@ -0,0 +1,104 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+from app.emulator import Emulator
+from app.key import Key
+from app.metrics import EmulatorMetrics, MetricsServer, percentile
+
+class TestMetrics(unittest.TestCase):
+
+    def record_frames(self, durations, instructions=10, **options):
+        clock = [100.0]
+        with patch('app.metrics.monotonic', side_effect=lambda: clock[0]):
+            metrics = EmulatorMetrics(**options)
+            for duration in durations:
+                metrics.record_frame(instructions, 0.0, duration, 0.0, sound=False)
+                clock[0] += 0.5
+        return metrics
+
+    def test_percentile(self):
+        values = sorted(float(n) for n in range(1, 101))
+        self.assertEqual(percentile(values, 0.5), 50)
+        self.assertEqual(percentile(values, 0.99), 99)
+        self.assertEqual(percentile([], 0.5), 0)
+
+    def test_rates_and_overruns(self):
+        metrics = self.record_frames([0.001] * 9 + [0.1], fps=60)
+        metrics.record_input(Key.A)
+        snapshot = metrics.snapshot()
+        # One frame every half second
+        self.assertAlmostEqual(snapshot['fps'], 2)
+        self.assertAlmostEqual(snapshot['instructions_per_second'], 20)
+        self.assertEqual(snapshot['frame_time'], {'p50': 0.001, 'p99': 0.1})
+        self.assertEqual(snapshot['overruns'], 1)
+        self.assertEqual(snapshot['input_events'], 1)
+
+    def test_prometheus_text(self):
+        metrics = EmulatorMetrics(fps=60)
+        metrics.record_frame(10, 0.001, 0.002, 0.003, sound=True)
+        text = metrics.prometheus_text()
+        self.assertIn('# TYPE chip8_frame_seconds summary\n', text)
+        self.assertIn('chip8_frame_phase_seconds_total{phase="render"} 0.003\n', text)
+        self.assertIn('chip8_frame_seconds_count 1.0\n', text)
+        self.assertIn('chip8_instructions_total 10.0\n', text)
+        sound = next(line for line in text.splitlines() if line.startswith('chip8_sound_seconds_total'))
+        self.assertAlmostEqual(float(sound.split()[1]), 1 / 60)
+        for line in text.splitlines():
+            if not line.startswith('#'):
+                float(line.rsplit(' ', 1)[1])
+
+    def test_json_log(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'metrics.jsonl')
+            self.record_frames([0.001] * 5, log_path=path, log_interval=1.0)
+            with open(path) as f:
+                entries = [json.loads(line) for line in f]
+        # Frames every half second and a line at most every second
+        self.assertEqual([entry['frames'] for entry in entries], [3, 5])
+
+    def test_server(self):
+        metrics = EmulatorMetrics()
+        metrics.record_frame(10, 0.001, 0.002, 0.003, sound=False)
+        server = MetricsServer(metrics, port=0)
+        server.start()
+        try:
+            with urlopen('http://127.0.0.1:%d/metrics' % server.port) as response:
+                self.assertIn('text/plain', response.headers['Content-Type'])
+                self.assertIn('chip8_frames_total 1.0', response.read().decode())
+            with self.assertRaises(HTTPError):
+                urlopen('http://127.0.0.1:%d/other' % server.port)
+        finally:
+            server.stop()
+
+    def test_emulator(self):
+        metrics = EmulatorMetrics()
+        emulator = Emulator(4, engine='headless', decode_cache=None, metrics=metrics)
+        # LD V0, 5; LD ST, V0; JMP 0x204
+        emulator.cpu.load_rom_bytes(bytes([0x60, 0x05, 0xF0, 0x18, 0x12, 0x04]))
+        emulator.engine.press(Key.ONE)
+        emulator.engine.release(Key.ONE)
+        for _ in range(3):
+            emulator.run_frame()
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot['frames'], 3)
+        self.assertEqual(snapshot['instructions'], 12)
+        self.assertEqual(snapshot['input_events'], 2)
+        # The sound timer is set during the first frame and still on after the third
+        self.assertAlmostEqual(snapshot['sound_seconds'], 3 / 60)
+        self.assertIn('chip8_fused_instructions_total{sequence="counter_loop"}', metrics.prometheus_text())
+
+    def test_emulator_does_not_import_the_server(self):
+        code = "import sys, app.emulator; print('http.server' in sys.modules)"
+        output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout
+        self.assertEqual(output.strip(), 'False')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,9 @@
 import unittest
 from unittest.mock import Mock, call, patch
-from app.constants import SPRITE_BYTE_SIZE
+from app.constants import MEMORY_SIZE, SPRITE_BYTE_SIZE
 
-from app.cpu import CPU
-from app.engine.pyglet_engine_handler import PygletEngineHandler
+from app.cpu import CPU, RomTooLargeError
+from app.engine.headless_engine_handler import HeadlessEngineHandler
 from app.engine.vector2 import Vector2
 from app.key import Key
 from app.keyboard import Keyboard
@@ -14,7 +14,7 @@ from app.speaker import Speaker
 class TestCPUOpcodes(unittest.TestCase):
 
     def setUp(self) -> None:
-        engine = PygletEngineHandler(size=Vector2(64, 32))
+        engine = HeadlessEngineHandler(size=Vector2(64, 32))
         renderer: Renderer = Renderer(engine, 10, (100, 100, 100))
         keyboard: Keyboard = Keyboard(engine)
         speaker: Speaker = Speaker(engine, 440)
@@ -70,6 +70,12 @@ class TestCPUOpcodes(unittest.TestCase):
             0xF733: self.cpu.opcode_LD_bcd,
             0xF855: self.cpu.opcode_LD_reg_to_mem,
             0xF965: self.cpu.opcode_LD_mem_to_reg,
+            0x5122: self.cpu.opcode_LD_range_to_mem,
+            0x5343: self.cpu.opcode_LD_mem_to_range,
+            0xF000: self.cpu.opcode_LD_i_long,
+            0xF201: self.cpu.opcode_PLANE,
+            0xF002: self.cpu.opcode_LD_audio,
+            0xF43A: self.cpu.opcode_PITCH,
         }
 
         for opcode, m in calls.items():
@@ -77,6 +83,16 @@ class TestCPUOpcodes(unittest.TestCase):
             self.cpu.execute_opcode(opcode)
             mock.assert_called_once_with(opcode)
 
+    def test_load_rom_bytes(self):
+        rom = bytes([0x00, 0xE0, 0x12, 0x00])
+        self.cpu.load_rom_bytes(memoryview(rom))
+        self.assertEqual(self.cpu.memory[0x200:0x204], rom)
+        self.assertEqual(self.cpu.memory[0x204], 0)
+
+    def test_load_rom_too_large(self):
+        with self.assertRaises(RomTooLargeError):
+            self.cpu.load_rom_bytes(bytes(len(self.cpu.memory) - 0x200 + 1))
+
     ###################
     # Testing Opcodes #
     ###################
@@ -295,13 +311,11 @@ class TestCPUOpcodes(unittest.TestCase):
         self.assertEqual(self.cpu.pc, 0xFFF + 0xFF)
     
     def test_RND(self):
-        with patch('random.randint', return_value=0b10111) as mock_random:
+        with patch.object(self.cpu.rng, 'randint', return_value=0b10111) as mock_random:
             self.cpu.opcode_RND(0xC41A) # 0x1A == 26 == 0b11010
             self.assertEqual(self.cpu.registers[0x4], 0b10010)
 
     def test_DRW(self):
-        # You have to use the actual function to test the ability to set VF correctly
-        self.cpu.renderer.toggle_pixel = Mock(wraps=self.cpu.renderer.toggle_pixel)
         self.cpu.renderer.render = Mock()
         self.cpu.memory[0x900] = 0b11111111
         self.cpu.memory[0x901] = 0b10000001
@@ -327,19 +341,29 @@ class TestCPUOpcodes(unittest.TestCase):
         self.cpu.opcode_DRW(0xD987)
         self.assertEqual(self.cpu.registers[0xF], 0, "VF should not be set to 1 after a first call to DRW")
         self.assertEqual(self.cpu.renderer.render.call_count, 1, "renderer.render() should be called only once per DRW call")
-        calls = []
         for y in range(0, 7):
             for x in range(0, 8):
-                if lines[y][x]:
-                    calls.append(call(Vector2(self.cpu.registers[9]+x, self.cpu.registers[8]+y)))
-        self.cpu.renderer.toggle_pixel.assert_has_calls(calls, any_order=True)
+                pos = Vector2(self.cpu.registers[9]+x, self.cpu.registers[8]+y)
+                self.assertEqual(self.cpu.renderer.pixels[pos], bool(lines[y][x]), "Wrong pixel at %s" % pos)
+        self.assertEqual(sum(self.cpu.renderer.pixels.values()), sum(map(sum, lines)), "DRW should only draw the sprite")
 
         # Test to unset the first line
         self.cpu.opcode_DRW(0xD981)
         self.assertEqual(self.cpu.registers[0xF], 1, "VF should be set to 1 after a second call to DRW")
         self.assertEqual(self.cpu.renderer.render.call_count, 2, "renderer.render() should be called only once per DRW call")
-        calls = [call(Vector2(self.cpu.registers[9]+x, self.cpu.registers[8])) for x in range(0, 8)]
-        self.cpu.renderer.toggle_pixel.assert_has_calls(calls, any_order=True)
+        for x in range(0, 8):
+            self.assertFalse(self.cpu.renderer.pixels[Vector2(self.cpu.registers[9]+x, self.cpu.registers[8])])
+
+    def test_DRW_wrapping(self):
+        self.cpu.renderer.render = Mock()
+        self.cpu.memory[0x900] = 0b10000001
+        self.cpu.registers[0] = 60
+        self.cpu.registers[1] = 31
+        self.cpu.i = 0x900
+        self.cpu.opcode_DRW(0xD012)
+        self.assertTrue(self.cpu.renderer.pixels[Vector2(60, 31)])
+        self.assertTrue(self.cpu.renderer.pixels[Vector2(3, 31)], "Sprite should wrap horizontally")
+        self.assertFalse(self.cpu.renderer.pixels[Vector2(60, 0)], "Empty sprite row should not be drawn")
 
     def test_SKP(self):
         self.cpu._increment_pc = Mock(wraps=self.cpu._increment_pc)
@@ -457,6 +481,178 @@ class TestCPUOpcodes(unittest.TestCase):
         self.assertEqual(self.cpu.registers[3], 0x30)
         self.assertEqual(self.cpu.i, 0xAAA, "LD_mem_to_reg should not change the value of i")
 
+    ###########################
+    # Testing XO-CHIP Opcodes #
+    ###########################
+
+    def test_LD_range_to_mem(self):
+        self.cpu.registers[2:6] = [0x22, 0x33, 0x44, 0x55]
+        self.cpu.i = 0xE000
+        self.cpu.opcode_LD_range_to_mem(0x5242)
+        self.assertEqual(self.cpu.memory[0xE000:0xE004], bytes([0x22, 0x33, 0x44, 0]))
+        self.assertEqual(self.cpu.i, 0xE000, "LD_range_to_mem should not change the value of i")
+        self.cpu.opcode_LD_range_to_mem(0x5532)
+        self.assertEqual(self.cpu.memory[0xE000:0xE004], bytes([0x55, 0x44, 0x33, 0]), "Registers should be stored in reverse order")
+
+    def test_LD_mem_to_range(self):
+        self.cpu.memory[0xF000:0xF003] = bytes([0xA, 0xB, 0xC])
+        self.cpu.i = 0xF000
+        self.cpu.opcode_LD_mem_to_range(0x5793)
+        self.assertEqual(self.cpu.registers[7:10], [0xA, 0xB, 0xC])
+        self.assertEqual(self.cpu.registers[0xA], 0, "LD_mem_to_range should stop at VY")
+        self.cpu.opcode_LD_mem_to_range(0x5313)
+        self.assertEqual(self.cpu.registers[1:4], [0xC, 0xB, 0xA], "Registers should be loaded in reverse order")
+
+    def test_load_store_wrap_around_memory(self):
+        self.cpu.registers[:4] = [1, 2, 3, 4]
+        self.cpu.i = 0xFFFE
+        self.cpu.opcode_LD_reg_to_mem(0xF355)
+        self.assertEqual(len(self.cpu.memory), MEMORY_SIZE, "Memory should never grow")
+        self.assertEqual(self.cpu.memory[0xFFFE:], bytes([1, 2]))
+        self.assertEqual(self.cpu.memory[:2], bytes([3, 4]))
+        self.cpu.registers[:4] = [0, 0, 0, 0]
+        self.cpu.opcode_LD_mem_to_reg(0xF365)
+        self.assertEqual(self.cpu.registers[:4], [1, 2, 3, 4])
+        self.assertEqual(len(self.cpu.registers), 16, "Registers should never shrink")
+        self.cpu.opcode_LD_mem_to_range(0x5303)
+        self.assertEqual(self.cpu.registers[:4], [4, 3, 2, 1])
+        self.cpu.opcode_LD_range_to_mem(0x5032)
+        self.assertEqual(len(self.cpu.memory), MEMORY_SIZE)
+        self.assertEqual(self.cpu.memory[0xFFFE:] + self.cpu.memory[:2], bytes([4, 3, 2, 1]))
+        self.cpu.registers[0] = 123
+        self.cpu.i = 0xFFFF
+        self.cpu.opcode_LD_bcd(0xF033)
+        self.assertEqual((self.cpu.memory[0xFFFF], self.cpu.memory[0], self.cpu.memory[1]), (1, 2, 3))
+
+    def test_pc_wraps_around_memory(self):
+        cpu = self.cpu
+        cpu.memory[0xFFFE:] = bytes([0x60, 0x05])
+        cpu.pc = 0xFFFE
+        cpu.execute_cycle()
+        self.assertEqual((cpu.registers[0], cpu.pc), (5, 0))
+        # An instruction split by the end of memory
+        cpu.memory[0xFFFF], cpu.memory[0] = 0x61, 0x07
+        cpu.pc = 0xFFFF
+        cpu.run_cycles(1)
+        self.assertEqual((cpu.registers[1], cpu.pc), (7, 1))
+        # The address of a long load at the end of memory is read from its start
+        cpu.memory[0xFFFC:] = bytes([0x30, 0x05, 0xF0, 0x00])
+        cpu.memory[0:2] = bytes([0xBE, 0xEF])
+        cpu.registers[0] = 0
+        cpu.pc = 0xFFFC
+        cpu.execute_cycle()
+        self.assertEqual(cpu.pc, 0xFFFE)
+        cpu.execute_cycle()
+        self.assertEqual((cpu.i, cpu.pc), (0xBEEF, 0x0002))
+        cpu.memory[0xFFFC:] = bytes([0x30, 0x05, 0xF0, 0x00])
+        cpu.registers[0] = 5
+        cpu.pc = 0xFFFC
+        cpu.execute_cycle()
+        self.assertEqual(cpu.pc, 0x0002, "The long load should be skipped as a whole")
+
+    def test_run_past_the_end_of_memory(self):
+        # Jumps to empty memory, runs up to its end and wraps around
+        for fusion in (True, False):
+            engine = HeadlessEngineHandler(size=Vector2(64, 32))
+            cpu = CPU(1000, Renderer(engine, 1, (255, 255, 255)), Keyboard(engine), Speaker(engine, 440), fusion=fusion)
+            cpu.load_rom_bytes(bytes([0x13, 0x00]))
+            with self.assertLogs(level='WARNING'):
+                for _ in range(40):
+                    cpu.update()
+            self.assertLess(cpu.pc, MEMORY_SIZE)
+
+    def test_LD_i_long(self):
+        self.cpu.memory[0x200:0x206] = bytes([0xF0, 0x00, 0xBE, 0xEF, 0x00, 0xE0])
+        self.cpu.execute_cycle()
+        self.assertEqual(self.cpu.i, 0xBEEF)
+        self.assertEqual(self.cpu.pc, 0x204, "The address should be skipped")
+
+    def test_skip_long_instruction(self):
+        self.cpu.memory[0x200:0x208] = bytes([0x30, 0x00, 0xF0, 0x00, 0xBE, 0xEF, 0x00, 0xE0])
+        self.cpu.execute_cycle()
+        self.assertEqual(self.cpu.pc, 0x206, "Skipping F000 NNNN should skip 4 bytes")
+
+    def test_PLANE(self):
+        self.cpu.renderer.render = Mock()
+        self.cpu.opcode_PLANE(0xF301)
+        self.assertEqual(self.cpu.renderer.plane_mask, 3)
+        self.cpu.memory[0x900:0x902] = bytes([0b10000000, 0b01000000])
+        self.cpu.i = 0x900
+        self.cpu.opcode_DRW(0xD001)
+        self.assertEqual(self.cpu.renderer.planes[0][0], 1 << 63)
+        self.assertEqual(self.cpu.renderer.planes[1][0], 1 << 62, "Second plane should use the following sprite data")
+
+        self.cpu.opcode_PLANE(0xF201)
+        self.cpu.opcode_CLR(0x00E0)
+        self.assertEqual(self.cpu.renderer.planes[0][0], 1 << 63, "CLR should only clear the selected planes")
+        self.assertEqual(self.cpu.renderer.planes[1][0], 0)
+
+    def test_LD_audio(self):
+        pattern = bytes(range(0x10))
+        self.cpu.memory[0x900:0x910] = pattern
+        self.cpu.i = 0x900
+        self.cpu.opcode_LD_audio(0xF002)
+        self.assertEqual(self.cpu.speaker.pattern, pattern)
+        self.cpu.memory[0xFFF8:] = pattern[:8]
+        self.cpu.memory[:8] = pattern[8:]
+        self.cpu.i = 0xFFF8
+        self.cpu.opcode_LD_audio(0xF002)
+        self.assertEqual(self.cpu.speaker.pattern, pattern, "The pattern should wrap around the end of memory")
+        self.cpu.registers[4] = 112
+        self.cpu.opcode_PITCH(0xF43A)
+        self.assertEqual(self.cpu.speaker.pattern_sample_rate(), 8000)
+
+    def test_snapshot_restore(self):
+        # LD V1, 0x10; RND V2, 0xFF; LD I, sprite of 0; DRW V0, V0, 5; CALL 0x200
+        self.cpu.load_rom_bytes(bytes([0x61, 0x10, 0xC2, 0xFF, 0xA0, 0x00, 0xD0, 0x05, 0x22, 0x00]))
+        self.cpu.run_cycles(2)
+        state = self.cpu.snapshot()
+        self.cpu.run_cycles(5)
+        self.assertNotEqual(self.cpu.snapshot(), state)
+        after = self.cpu.snapshot()
+
+        self.cpu.restore(state)
+        self.assertEqual(self.cpu.snapshot(), state)
+        self.assertEqual(self.cpu.renderer.planes[0][0], 0)
+        # The random sequence is restored too
+        self.cpu.run_cycles(5)
+        self.assertEqual(self.cpu.snapshot(), after)
+
+    def test_clone(self):
+        # LD V1, 0x10; RND V2, 0xFF; LD I, sprite of 0; DRW V0, V0, 5; LD I, 0x300; LD B, V1; JMP 0x200
+        self.cpu.load_rom_bytes(bytes([0x61, 0x10, 0xC2, 0xFF, 0xA0, 0x00, 0xD0, 0x05, 0xA3, 0x00, 0xF1, 0x33, 0x12, 0x00]))
+        self.cpu.keyboard._on_key_pressed(Key.A)
+        self.cpu.run_cycles(2)
+        callbacks = len(self.cpu.renderer.engine.keydown_callbacks)
+        clone = self.cpu.clone()
+
+        self.assertEqual(clone.snapshot(), self.cpu.snapshot())
+        self.assertIsNot(clone.renderer.engine, self.cpu.renderer.engine)
+        self.assertEqual(len(self.cpu.renderer.engine.keydown_callbacks), callbacks)
+        self.assertTrue(clone.keyboard.is_key_pressed(Key.A))
+        self.assertIs(clone.memory, self.cpu.memory)
+
+        # Both run the same future from the same state, without touching each other
+        clone.run_cycles(6)
+        self.assertEqual(self.cpu.pc, 0x204)
+        self.assertEqual(self.cpu.renderer.planes[0][0], 0)
+        self.assertEqual(self.cpu.memory[0x300:0x303], bytes(3))
+        self.assertIsNot(clone.memory, self.cpu.memory)
+        self.assertEqual(clone.memory[0x300:0x303], bytes([0, 1, 6]))
+        self.cpu.run_cycles(6)
+        self.assertEqual(clone.snapshot(), self.cpu.snapshot())
+
+        clone.keyboard._on_key_pressed(Key.A, False)
+        self.assertTrue(self.cpu.keyboard.is_key_pressed(Key.A))
+
+    def test_clone_of_attached_cpu(self):
+        self.cpu.load_rom_bytes(bytes([0x70, 0x01, 0x12, 0x00])) # ADD V0, 1; JMP 0x200
+        self.cpu.run_cycles = Mock()
+        clone = self.cpu.clone()
+        clone.run_cycles(4)
+        self.assertEqual(clone.registers[0], 2)
+        self.assertEqual(self.cpu.registers[0], 0)
+
 
 
 if __name__ == '__main__':
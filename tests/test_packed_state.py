@@ -0,0 +1,76 @@
+import unittest
+from multiprocessing import shared_memory
+
+from app.golden import GoldenRun
+from app.packed_state import FIELD_OFFSETS, PACKED_STATE_SIZE, PackedState
+
+class TestPackedState(unittest.TestCase):
+
+    def setUp(self):
+        with open('roms/PONG', 'rb') as f:
+            self.cpu = GoldenRun(f.read()).cpu
+        self.cpu.speaker.pattern = bytes(range(16))
+        for _ in range(30):
+            self.cpu.update()
+
+    def test_state_round_trip(self):
+        state = self.cpu.snapshot()
+        packed = PackedState.from_cpu(self.cpu)
+        self.assertEqual(packed.to_state(), state)
+        self.assertEqual(PackedState.from_state(state).buffer, packed.buffer)
+        self.assertEqual(packed['pc'], self.cpu.pc)
+        self.assertEqual(list(packed.registers), self.cpu.registers)
+        self.assertEqual(list(packed.planes[:32]), self.cpu.renderer.planes[0])
+        self.assertEqual(packed.memory[0x200:0x210], self.cpu.memory[0x200:0x210])
+
+    def test_restore(self):
+        packed = PackedState.from_cpu(self.cpu)
+        state = self.cpu.snapshot()
+        for _ in range(30):
+            self.cpu.update()
+        self.assertNotEqual(self.cpu.snapshot(), state)
+        after = self.cpu.snapshot()
+        packed.restore(self.cpu)
+        self.assertEqual(self.cpu.snapshot(), state)
+        # The same future, random numbers included
+        for _ in range(30):
+            self.cpu.update()
+        self.assertEqual(self.cpu.snapshot(), after)
+
+    def test_diff_and_digest(self):
+        packed = PackedState.from_cpu(self.cpu)
+        copy = packed.copy()
+        self.assertEqual(copy.digest(), packed.digest())
+        self.assertEqual(copy.diff(packed), [])
+        self.cpu.registers[3] ^= 1
+        self.cpu.memory[0x300] ^= 1
+        copy.capture(self.cpu)
+        self.assertEqual(copy.diff(packed), ['registers', 'memory'])
+        self.assertNotEqual(copy.digest(), packed.digest())
+
+    def test_shared_memory(self):
+        memory = shared_memory.SharedMemory(create=True, size=PACKED_STATE_SIZE)
+        try:
+            shared = PackedState(memory.buf[:PACKED_STATE_SIZE])
+            shared.capture(self.cpu)
+            # Another process would attach to the same block
+            other = shared_memory.SharedMemory(memory.name)
+            try:
+                self.assertEqual(PackedState(bytearray(other.buf[:PACKED_STATE_SIZE])).to_state(), self.cpu.snapshot())
+            finally:
+                other.close()
+            del shared
+        finally:
+            memory.close()
+            memory.unlink()
+
+    def test_layout(self):
+        offset, size = FIELD_OFFSETS['planes']
+        self.assertEqual((offset, size), (0, 512))
+        self.assertEqual(FIELD_OFFSETS['memory'][0] + FIELD_OFFSETS['memory'][1], PACKED_STATE_SIZE)
+        with self.assertRaises(ValueError):
+            PackedState(bytearray(10))
+
+
+if __name__ == '__main__':
+    unittest.main()
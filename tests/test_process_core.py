@@ -0,0 +1,133 @@
+import unittest
+from multiprocessing.shared_memory import SharedMemory
+from time import perf_counter, sleep
+
+from app.emulator import Emulator
+from app.frame_codec import empty_frame
+from app.key import Key
+from app.process_core import SHARED_SIZE, CoreCrashedError, CoreProcess, CoreStatus, ProcessEmulator, SharedFrame
+
+COUNTER_ROM = bytes([0x70, 0x01, 0x12, 0x00]) # ADD V0, 1; JMP 0x200
+# LD I, sprite of 0; DRW V0, V0, 5; JMP 0x204
+DRAW_ROM = bytes([0xA0, 0x00, 0xD0, 0x05, 0x12, 0x04])
+CRASH_ROM = bytes([0x22, 0x00]) # CALL 0x200 until the stack overflows
+# LD V0, 5; SKP V0; JMP 0x202; LD V1, 1; JMP 0x208
+KEY_ROM = bytes([0x60, 0x05, 0xE0, 0x9E, 0x12, 0x02, 0x61, 0x01, 0x12, 0x08])
+
+def wait_for(condition, timeout=10.0):
+    deadline = perf_counter() + timeout
+    while not condition():
+        if perf_counter() > deadline:
+            raise AssertionError("Timed out")
+        sleep(0.01)
+
+
+class TestSharedFrame(unittest.TestCase):
+
+    def setUp(self):
+        self.memory = SharedMemory(create=True, size=SHARED_SIZE)
+        self.shared = SharedFrame(self.memory)
+
+    def tearDown(self):
+        self.memory.close()
+        self.memory.unlink()
+
+    def test_frame(self):
+        planes = empty_frame()
+        self.assertIsNone(self.shared.read_frame(planes, 0))
+        frame = empty_frame()
+        frame[0][0] = 1 << 63
+        frame[1][31] = 0xF0F0
+        self.shared.write_frame(frame)
+        self.assertEqual(self.shared.read_frame(planes, 0), 1)
+        self.assertEqual(planes, frame)
+        self.assertIsNone(self.shared.read_frame(planes, 1))
+
+    def test_torn_frame_is_retried(self):
+        planes = empty_frame()
+        self.shared.write_frame(empty_frame())
+        # Sequence number of a frame being written
+        self.memory.buf[0] = 3
+        self.assertIsNone(self.shared.read_frame(planes, 1))
+
+    def test_keypad_and_status(self):
+        self.shared.set_key(Key.A, True)
+        self.shared.set_key(Key.UNKNOWN, True)
+        self.assertTrue(self.shared.is_key_pressed(Key.A))
+        self.assertFalse(self.shared.is_key_pressed(Key.B))
+        self.shared.status = CoreStatus.PAUSED
+        self.assertEqual(self.shared.status, CoreStatus.PAUSED)
+
+
+class TestCoreProcess(unittest.TestCase):
+
+    def test_commands(self):
+        core = CoreProcess(COUNTER_ROM, 4)
+        try:
+            wait_for(lambda: core.shared.frame_count >= 3)
+            core.pause()
+            self.assertEqual(core.shared.status, CoreStatus.PAUSED)
+            state = core.snapshot()
+            self.assertGreaterEqual(state.registers[0], 6) # Two increments per frame
+            frames = core.shared.frame_count
+            sleep(0.05)
+            self.assertEqual(core.shared.frame_count, frames)
+
+            core.reset()
+            self.assertEqual(core.snapshot().registers[0], 0)
+            core.restore(state)
+            self.assertEqual(core.snapshot(), state)
+            core.resume()
+            wait_for(lambda: core.shared.frame_count > frames)
+        finally:
+            core.close()
+        self.assertFalse(core.process.is_alive())
+
+    def test_frame(self):
+        core = CoreProcess(DRAW_ROM, 4)
+        try:
+            planes = empty_frame()
+            # The blank screen is published before the first frame runs
+            wait_for(lambda: core.shared.read_frame(planes, 0) is not None and planes[0][0] != 0)
+            self.assertEqual(planes[0][:5], [0xF0 << 56, 0x90 << 56, 0x90 << 56, 0x90 << 56, 0xF0 << 56])
+        finally:
+            core.close()
+
+    def test_keys(self):
+        core = CoreProcess(KEY_ROM, 4)
+        try:
+            wait_for(lambda: core.shared.frame_count >= 2)
+            self.assertEqual(core.snapshot().registers[1], 0)
+            core.shared.set_key(Key.FIVE, True)
+            wait_for(lambda: core.snapshot().registers[1] == 1)
+        finally:
+            core.close()
+
+    def test_crash_is_contained(self):
+        core = CoreProcess(CRASH_ROM, 100)
+        try:
+            wait_for(lambda: core.check() is not None)
+            self.assertIn('StackOverflowError', core.error)
+            self.assertEqual(core.shared.status, CoreStatus.CRASHED)
+            with self.assertRaises(CoreCrashedError):
+                core.snapshot()
+        finally:
+            core.close()
+
+    def test_process_emulator(self):
+        emulator = Emulator(4, engine='headless', decode_cache=None, quirks='modern')
+        process_emulator = ProcessEmulator(emulator)
+        core = process_emulator.start(DRAW_ROM)
+        try:
+            emulator.engine.press(Key.C)
+            self.assertTrue(core.shared.is_key_pressed(Key.C))
+            # Keys no longer reach the CPU of this process
+            self.assertFalse(emulator.cpu.keyboard.is_key_pressed(Key.C))
+            wait_for(lambda: process_emulator.render_frame(core) and process_emulator.renderer.planes[0][0] != 0)
+            self.assertEqual(process_emulator.renderer.planes[0][0], 0xF0 << 56)
+        finally:
+            core.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
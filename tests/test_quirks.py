@@ -0,0 +1,116 @@
+import json
+import os
+import tempfile
+import unittest
+
+from app.cpu import CPU
+from app.engine.headless_engine_handler import HeadlessEngineHandler
+from app.engine.vector2 import Vector2
+from app.keyboard import Keyboard
+from app.quirks import QUIRK_PROFILES, Quirks, UnknownQuirksProfileError, get_quirks, load_quirks_database, profile_for_rom
+from app.renderer import Renderer
+from app.rom_library import rom_hash
+from app.speaker import Speaker
+
+class TestQuirks(unittest.TestCase):
+
+    def create_cpu(self, quirks: Quirks = Quirks()) -> CPU:
+        engine = HeadlessEngineHandler(size=Vector2(64, 32))
+        return CPU(1, Renderer(engine, 1, (255, 255, 255)), Keyboard(engine), Speaker(engine, 440), quirks=quirks)
+
+    def test_default_profile_keeps_handlers(self):
+        cpu = self.create_cpu()
+        self.assertEqual(cpu.decode(0x8126), cpu.opcode_SHR)
+        self.assertEqual(cpu.decode(0xF355), cpu.opcode_LD_reg_to_mem)
+        self.assertEqual(cpu.decode(0xB200), cpu.opcode_JMP_v0)
+        self.assertEqual(cpu.decode(0xD125), cpu.opcode_DRW)
+        self.assertEqual(cpu.decode(0x8121), cpu.opcode_OR)
+
+    def test_profile_tables(self):
+        cpu = self.create_cpu(get_quirks('cosmac'))
+        self.assertEqual(cpu.decode(0x8126), cpu.opcode_SHR_vy)
+        self.assertEqual(cpu.decode(0x812E), cpu.opcode_SHL_vy)
+        self.assertEqual(cpu.decode(0xF355), cpu.opcode_LD_reg_to_mem_increment)
+        self.assertEqual(cpu.decode(0xF365), cpu.opcode_LD_mem_to_reg_increment)
+        self.assertEqual(cpu.decode(0xD125), cpu.opcode_DRW_clipped)
+        self.assertEqual(cpu.decode(0x8123), cpu.opcode_XOR_reset_vf)
+        self.assertEqual(cpu.decode(0xB200), cpu.opcode_JMP_v0)
+
+        cpu.decoded[0x200] = (0x8126, cpu.opcode_SHR_vy)
+        cpu.set_quirks(get_quirks('schip'))
+        self.assertEqual(cpu.decoded, {}, "Instructions decoded with the previous profile should be dropped")
+        self.assertEqual(cpu.decode(0xB200), cpu.opcode_JMP_vx)
+        self.assertEqual(cpu.decode(0x8126), cpu.opcode_SHR)
+
+    def test_variants(self):
+        cpu = self.create_cpu()
+        cpu.registers[2] = 0b10000011
+        cpu.opcode_SHR_vy(0x8126)
+        self.assertEqual((cpu.registers[1], cpu.registers[0xF]), (0b1000001, 1))
+        cpu.opcode_SHL_vy(0x8126)
+        self.assertEqual((cpu.registers[1], cpu.registers[0xF]), (0b110, 1))
+
+        cpu.registers[0xF] = 1
+        cpu.opcode_AND_reset_vf(0x8122)
+        self.assertEqual((cpu.registers[1], cpu.registers[0xF]), (0b10, 0))
+
+        cpu.i = 0x300
+        cpu.opcode_LD_reg_to_mem_increment(0xF255)
+        self.assertEqual(cpu.i, 0x303)
+        self.assertEqual(cpu.memory[0x301], 0b10)
+        cpu.i = 0x300
+        cpu.opcode_LD_mem_to_reg_increment(0xF165)
+        self.assertEqual(cpu.i, 0x302)
+
+        cpu.registers[2] = 0x10
+        cpu.opcode_JMP_vx(0xB220)
+        self.assertEqual(cpu.pc, 0x230)
+
+    def test_clipped_sprites(self):
+        cpu = self.create_cpu(get_quirks('schip'))
+        cpu.memory[0x300:0x302] = bytes([0xFF, 0xFF])
+        cpu.i = 0x300
+        cpu.registers[0], cpu.registers[1] = 60, 31
+        cpu.execute_opcode(0xD012)
+        rows = cpu.renderer.planes[0]
+        self.assertEqual(rows[31], 0xF)
+        self.assertEqual(rows[0], 0, "Sprites should not wrap to the top")
+        self.assertEqual(sum(bin(row).count('1') for row in rows), 4)
+
+        # The origin still wraps
+        cpu.registers[0], cpu.registers[1] = 64 + 8, 32 + 2
+        cpu.execute_opcode(0xD011)
+        self.assertEqual(rows[2], 0xFF << 48)
+
+    def test_profile_for_rom(self):
+        chip8 = bytes([0x12, 0x00])
+        xochip = bytes([0xF0, 0x02, 0x12, 0x00])
+        self.assertEqual(profile_for_rom(chip8), 'modern')
+        self.assertEqual(profile_for_rom(xochip), 'xo-chip')
+        self.assertEqual(profile_for_rom(chip8, {rom_hash(chip8): 'cosmac'}), 'cosmac')
+
+    def test_database(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'quirks.json')
+            self.assertEqual(load_quirks_database(path), {})
+            with open(path, 'w') as f:
+                json.dump({'abc': 'schip'}, f)
+            self.assertEqual(load_quirks_database(path), {'abc': 'schip'})
+            with open(path, 'w') as f:
+                json.dump({'abc': 'schip', 'def': 'chip-9', 'ghi': 1}, f)
+            with self.assertLogs(level='WARNING') as logs:
+                self.assertEqual(load_quirks_database(path), {'abc': 'schip'})
+            self.assertEqual(len(logs.output), 2)
+            with open(path, 'w') as f:
+                f.write('[1, 2')
+            with self.assertLogs(level='WARNING'):
+                self.assertEqual(load_quirks_database(path), {})
+
+    def test_unknown_profile(self):
+        with self.assertRaises(UnknownQuirksProfileError):
+            get_quirks('chip-9')
+        self.assertEqual(len({quirks.key() for quirks in QUIRK_PROFILES.values()}), len(QUIRK_PROFILES))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+import os
+import struct
+import tempfile
+import unittest
+import zlib
+
+from app.frame_codec import empty_frame
+from app.recorder import FrameRecorder, RecordingError, RecordingReader, encode_png, export_gif, export_png_sequence, frame_indices, lzw_encode
+
+def lzw_decode(data: bytes, min_code_size: int) -> bytes:
+    """ Straightforward GIF LZW decoder following the specification """
+    clear_code = 1 << min_code_size
+    end_code = clear_code + 1
+    bits = int.from_bytes(data, 'little')
+    position = 0
+    code_size = min_code_size + 1
+    table: list[bytes] = []
+    previous = None
+    output = bytearray()
+    while True:
+        code = (bits >> position) & ((1 << code_size) - 1)
+        position += code_size
+        if code == clear_code:
+            table = [bytes([i]) for i in range(clear_code)] + [b'', b'']
+            code_size = min_code_size + 1
+            previous = None
+            continue
+        if code == end_code:
+            return bytes(output)
+        if previous is None:
+            entry = table[code]
+        else:
+            entry = table[code] if code < len(table) else table[previous] + table[previous][:1]
+            if len(table) < 4096:
+                table.append(table[previous] + entry[:1])
+        output += entry
+        previous = code
+        if len(table) == 1 << code_size and code_size < 12:
+            code_size += 1
+
+
+class TestRecorder(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'session.rec')
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def record(self) -> list[list[list[int]]]:
+        frames = []
+        frame = empty_frame()
+        with FrameRecorder(self.path) as recorder:
+            for i in range(10):
+                if i in (3, 4, 8):
+                    frame[0][i] = 0xFF << i
+                    frame[1][31 - i] = 1 << i
+                recorder.capture(frame)
+                frames.append([list(rows) for rows in frame])
+        return frames
+
+    def test_only_changed_frames_are_written(self):
+        self.record()
+        reader = RecordingReader(self.path)
+        self.assertEqual([number for number, _ in reader.frames()], [0, 3, 4, 8, 10])
+
+    def test_durations(self):
+        frames = self.record()
+        durations = list(RecordingReader(self.path).durations())
+        self.assertEqual([duration for _, duration in durations], [3, 1, 4, 2])
+        self.assertEqual(durations[2][0], frames[4])
+        self.assertEqual(sum(duration for _, duration in durations), len(frames))
+
+    def test_invalid_recording(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'not a recording')
+        with self.assertRaises(RecordingError):
+            RecordingReader(self.path)
+
+    def test_frame_indices(self):
+        frame = empty_frame()
+        frame[0][0] = 0b11 << 62
+        frame[1][0] = 0b01 << 62
+        rows = frame_indices(frame, 2)
+        self.assertEqual(len(rows), 64)
+        self.assertEqual(rows[0][:6], bytes([1, 1, 3, 3, 0, 0]))
+        self.assertEqual(rows[1], rows[0])
+
+    def test_lzw_round_trip(self):
+        for data in [bytes([0, 1, 2, 3] * 10), bytes(5000), bytes((i * 7 // 3) % 4 for i in range(20000))]:
+            self.assertEqual(lzw_decode(lzw_encode(data, 2), 2), data)
+
+    def test_png(self):
+        png = encode_png([bytes([0, 1]), bytes([2, 3])], [(0, 0, 0), (1, 1, 1), (2, 2, 2), (3, 3, 3)])
+        self.assertTrue(png.startswith(b'\x89PNG\r\n\x1a\n'))
+        width, height = struct.unpack('>II', png[16:24])
+        self.assertEqual((width, height), (2, 2))
+        idat = png.index(b'IDAT')
+        length, = struct.unpack('>I', png[idat - 4:idat])
+        self.assertEqual(zlib.decompress(png[idat + 4:idat + 4 + length]), b'\x00\x00\x01\x00\x02\x03')
+
+    def test_export(self):
+        self.record()
+        self.assertEqual(export_png_sequence(self.path, os.path.join(self.directory.name, 'png'), scale=1), 10)
+        self.assertEqual(len(os.listdir(os.path.join(self.directory.name, 'png'))), 10)
+        gif_path = os.path.join(self.directory.name, 'session.gif')
+        self.assertEqual(export_gif(self.path, gif_path, scale=3), 4)
+        with open(gif_path, 'rb') as f:
+            gif = f.read()
+        self.assertEqual(gif[:6], b'GIF89a')
+        self.assertEqual(struct.unpack('<HH', gif[6:10]), (64 * 3, 32 * 3))
+        self.assertEqual(gif[-1:], b'\x3B')
+
+
+if __name__ == '__main__':
+    unittest.main()
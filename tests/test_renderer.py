@@ -1,6 +1,7 @@
 import unittest
+from unittest.mock import Mock, call
 
-from app.engine.pyglet_engine_handler import PygletEngineHandler
+from app.engine.headless_engine_handler import HeadlessEngineHandler
 from app.engine.vector2 import Vector2
 from app.constants import SCREEN_SIZE
 
@@ -9,7 +10,7 @@ from app.renderer import Renderer
 class TestRenderer(unittest.TestCase):
 
     def setUp(self) -> None:
-        engine = PygletEngineHandler(size=Vector2(64, 32))
+        engine = HeadlessEngineHandler(size=Vector2(64, 32))
         self.renderer: Renderer = Renderer(engine, 10, (100, 100, 100))
     
     def tearDown(self) -> None:
@@ -37,3 +38,35 @@ class TestRenderer(unittest.TestCase):
         self.renderer.toggle_pixel(Vector2(-1, -1))
         self.assertNotEqual(self.renderer.pixels.get(Vector2(-1, -1)), True)
         self.assertEqual(self.renderer.pixels.get(SCREEN_SIZE - Vector2(1, 1)), True)
+
+    def test_draw_sprite(self):
+        rows = self.renderer.planes[0]
+        self.assertFalse(self.renderer.draw_sprite(62, 0, [0b11000011], rows))
+        self.assertEqual(rows[0], 0b11 | (0b11 << 58), "Sprite should wrap horizontally")
+        self.assertTrue(self.renderer.draw_sprite(62, 0, [0b10000000], rows))
+        self.assertEqual(rows[0], 0b01 | (0b11 << 58))
+
+    def test_render_composites_planes(self):
+        self.renderer.engine.headless = False
+        self.renderer.engine.draw_rect = Mock()
+        self.renderer.engine.draw = Mock()
+        self.renderer.planes[0][2] = 0b1100 << 60
+        self.renderer.planes[1][2] = 0b0110 << 60
+        self.renderer.render()
+        self.renderer.engine.draw_rect.assert_has_calls([
+            call(Vector2(0, 2) * 10, Vector2(1, 1) * 10, self.renderer.palette[1]),
+            call(Vector2(2, 2) * 10, Vector2(1, 1) * 10, self.renderer.palette[2]),
+            call(Vector2(1, 2) * 10, Vector2(1, 1) * 10, self.renderer.palette[3]),
+        ])
+        self.assertEqual(self.renderer.engine.draw_rect.call_count, 3)
+
+        # Nothing changed, the previous shapes are drawn again
+        self.renderer.render()
+        self.assertEqual(self.renderer.engine.draw_rect.call_count, 3)
+        self.assertEqual(self.renderer.engine.draw.call_count, 2)
+
+    def test_render_headless(self):
+        self.renderer.engine.draw_rect = Mock()
+        self.renderer.planes[0][0] = 1
+        self.renderer.render()
+        self.renderer.engine.draw_rect.assert_not_called()
@@ -0,0 +1,62 @@
+import os
+import tempfile
+import unittest
+
+from app.rom_library import Platform, RomLibrary, RomLibraryError, detect_platform, rom_hash
+
+class TestRomLibrary(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.roms = {
+            'A': bytes([0x00, 0xE0, 0x12, 0x00]),
+            'B': bytes([0x60, 0x01, 0x12, 0x02]),
+            'C': bytes([0x00, 0xE0, 0x12, 0x00]), # Same content as A
+        }
+        os.mkdir(os.path.join(self.directory.name, 'roms'))
+        for name, rom in self.roms.items():
+            with open(os.path.join(self.directory.name, 'roms', name), 'wb') as f:
+                f.write(rom)
+        self.archive_path = os.path.join(self.directory.name, 'roms.ch8lib')
+        self.library = RomLibrary.build(self.archive_path, [os.path.join(self.directory.name, 'roms')])
+
+    def tearDown(self) -> None:
+        self.library.close()
+        self.directory.cleanup()
+
+    def test_build(self):
+        self.assertEqual(len(self.library), 3)
+        for name, rom in self.roms.items():
+            entry = self.library.find(name)
+            self.assertEqual(entry.sha1, rom_hash(rom))
+            self.assertEqual(entry.size, len(rom))
+            self.assertEqual(self.library.read(entry), rom)
+        self.assertEqual(self.library.find('A').offset, self.library.find('C').offset, "Identical roms should be stored once")
+
+    def test_find_by_hash(self):
+        entry = self.library.find(rom_hash(self.roms['B']))
+        self.assertEqual(os.path.basename(entry.name), 'B')
+        self.assertIsNone(self.library.find('D'))
+
+    def test_reopen(self):
+        with RomLibrary(self.archive_path) as library:
+            view = library.view(library.find('B'))
+            self.assertEqual(bytes(view), self.roms['B'])
+            view.release()
+
+    def test_invalid_archive(self):
+        path = os.path.join(self.directory.name, 'roms', 'B')
+        with self.assertRaises(RomLibraryError):
+            RomLibrary(path)
+
+    def test_detect_platform(self):
+        self.assertEqual(detect_platform(bytes([0x00, 0xE0, 0x12, 0x00])), Platform.CHIP8)
+        self.assertEqual(detect_platform(bytes([0x00, 0xFF, 0x12, 0x00])), Platform.SCHIP)
+        self.assertEqual(detect_platform(bytes([0xF0, 0x00, 0x02, 0x00, 0x12, 0x00])), Platform.XOCHIP)
+        # Unreachable data looking like a XO-CHIP opcode
+        self.assertEqual(detect_platform(bytes([0x12, 0x00, 0xF0, 0x00])), Platform.CHIP8)
+        self.assertEqual(detect_platform(bytes(0x1000)), Platform.XOCHIP)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+import asyncio
+import unittest
+
+from app.cpu import StackUnderflowError
+from app.frame_codec import FrameDecoder
+from app.key import Key
+from app.session_host import SessionHost, TimerWheel
+
+# Draws the character of the pressed key at 0/0 in loop: CLR; LD V0, K; LD F, V0; DRW V1, V1, 5; JMP 0x200
+KEY_ROM = bytes([0x00, 0xE0, 0xF0, 0x0A, 0xF0, 0x29, 0xD1, 0x15, 0x12, 0x00])
+# Returns with an empty stack
+CRASH_ROM = bytes([0x00, 0xEE])
+# LD V0, 0x20; SKP V0: 0x20 is not a key
+BAD_KEY_ROM = bytes([0x60, 0x20, 0xE0, 0x9E])
+
+class TestSessionHost(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self) -> None:
+        self.host = SessionHost(fps=1000, slots=4)
+
+    async def asyncTearDown(self) -> None:
+        await self.host.stop()
+
+    async def test_timer_wheel_slots(self):
+        wheel = TimerWheel(slots=3)
+        first, second = wheel.wait(0), wheel.wait(1)
+        self.assertIs(wheel.wait(0), first, "Sessions of a slot should share the same waiter")
+        wheel.tick()
+        self.assertTrue(first.done())
+        self.assertFalse(second.done())
+        wheel.tick()
+        self.assertTrue(second.done())
+        self.assertIsNot(wheel.wait(0), first)
+
+    async def test_many_sessions(self):
+        sessions = [self.host.add_session(KEY_ROM) for _ in range(200)]
+        self.host.start()
+        for session in sessions:
+            await session.input.put((Key(session.id % 16), True))
+
+        async def wait_for_sprite(session):
+            decoder = FrameDecoder()
+            expected = [0xF0, 0x20, 0xF0, 0xF0, 0x90, 0xF0, 0xF0, 0xF0, 0xF0, 0xF0, 0xF0, 0xE0, 0xF0, 0xE0, 0xF0, 0xF0][session.id % 16]
+            while decoder.planes[0][0] >> 56 != expected:
+                decoder.apply(await session.output.get())
+                self.assertIn(decoder.planes[0][0] >> 56, [0, 0xF0, 0x20, 0x90, 0xE0])
+
+        # Every session ends up drawing the sprite of its own key
+        await asyncio.wait_for(asyncio.gather(*[wait_for_sprite(session) for session in sessions]), 10)
+
+    async def test_crashing_session_is_isolated(self):
+        crashing = self.host.add_session(CRASH_ROM)
+        running = self.host.add_session(KEY_ROM)
+        self.host.start()
+        await asyncio.wait_for(crashing.task, 5)
+        self.assertIsInstance(crashing.error, StackUnderflowError)
+        frame = running.frame_number
+        while running.frame_number == frame:
+            await asyncio.sleep(0.001)
+        self.assertFalse(running.task.done())
+
+    async def test_bad_rom_error_is_recorded(self):
+        session = self.host.add_session(BAD_KEY_ROM)
+        self.host.start()
+        await asyncio.wait_for(session.task, 5)
+        self.assertIsInstance(session.error, ValueError)
+
+    async def test_removing_a_session_keeps_its_slot_running(self):
+        host = SessionHost(slots=1)
+        removed = host.add_session(KEY_ROM)
+        kept = host.add_session(KEY_ROM)
+        try:
+            # Both sessions wait for the same tick of the wheel, ticked by hand
+            await asyncio.sleep(0)
+            host.remove_session(removed.id)
+            await asyncio.sleep(0)
+            for _ in range(3):
+                host.wheel.tick()
+                for _ in range(3):
+                    await asyncio.sleep(0)
+            self.assertFalse(kept.task.done())
+            self.assertEqual(kept.frame_number, 3)
+        finally:
+            await host.stop()
+
+    async def test_lagging_consumer(self):
+        session = self.host.add_session(KEY_ROM)
+        for i in range(session.output.maxsize + 5):
+            session.engine.press(Key(i % 16))
+            session.step_frame()
+            session.engine.release(Key(i % 16))
+        self.assertTrue(session.output.full())
+        while not session.output.empty():
+            session.output.get_nowait()
+        session.engine.press(Key.ONE)
+        session.step_frame()
+        self.assertEqual(session.output.get_nowait()[0], 0x02, "A key frame should be sent after dropped frames")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import io
+import json
+import unittest
+
+from app.emulator import Emulator
+from app.golden import GoldenSuite
+from app.metrics import EmulatorMetrics
+from app.soak import RandomInput, ScriptedInput, SoakRunner, SoakSample, detect_degradation, keeps_growing
+
+def sample(ips: float = 1000.0, rss: int = 1000, blocks: int = 100, p99: float = 0.001, **sizes: int) -> SoakSample:
+    return SoakSample(0.0, 0, ips, {'p50': p99 / 2, 'p99': p99}, rss, blocks, dict({'cpu.decoded': 10}, **sizes))
+
+class TestSoak(unittest.TestCase):
+
+    def create_emulator(self) -> Emulator:
+        emulator = Emulator(10, engine='headless', decode_cache=None, quirks='modern', metrics=EmulatorMetrics())
+        emulator.cpu.load_rom_bytes(open('roms/PONG', 'rb').read())
+        return emulator
+
+    def test_stable_run(self):
+        output = io.StringIO()
+        runner = SoakRunner(self.create_emulator(), RandomInput(seed=1), interval=0.05, output=output)
+        warnings = runner.run(0.5)
+        lines = [json.loads(line) for line in output.getvalue().splitlines()]
+        self.assertGreaterEqual(len(runner.samples), 10)
+        self.assertEqual(len(lines), len(runner.samples) + 1)
+        self.assertEqual(lines[-1], {'warnings': [warning._asdict() for warning in warnings]})
+        first = lines[0]
+        self.assertGreater(first['instructions_per_second'], 0)
+        self.assertGreater(first['rss'], 0)
+        self.assertEqual(sorted(first['frame_time']), ['p50', 'p99'])
+        self.assertFalse([warning for warning in warnings if warning.metric in ('keyboard.pressed_keys', 'engine.keydown_callbacks')])
+
+    def test_growing_container_is_flagged(self):
+        emulator = self.create_emulator()
+        leak = []
+        emulator.engine.keydown(lambda key: leak.append(key))
+        watches = {'leak': lambda: len(leak)}
+        # Keeps pressing keys
+        runner = SoakRunner(emulator, RandomInput(seed=2, rate=1.0, max_hold=1), interval=0.05, watches=watches)
+        warnings = runner.run(0.4)
+        self.assertIn('leak', [warning.metric for warning in warnings])
+
+    def test_scripted_input_loops(self):
+        events = GoldenSuite('tests/golden', 'roms').input_events('PONG')
+        script = ScriptedInput(events, period=1000)
+        emulator = self.create_emulator()
+        pressed = []
+        emulator.engine.keydown(pressed.append)
+        for frame in range(2000):
+            script.apply(emulator.engine, frame)
+        presses = [event.key for event in events if event.down and event.frame < 1000]
+        self.assertEqual(pressed, presses * 2)
+
+    def test_detect_degradation(self):
+        stable = [sample() for _ in range(10)]
+        self.assertEqual(detect_degradation(stable), [])
+        slower = stable[:5] + [sample(ips=700.0, p99=0.002) for _ in range(5)]
+        self.assertEqual([warning.metric for warning in detect_degradation(slower)], ['instructions_per_second', 'frame_time'])
+        growing = [sample(rss=1000 + 100 * n, blocks=100 + n, **{'engine.shapes': 64 * n}) for n in range(10)]
+        self.assertEqual([warning.metric for warning in detect_degradation(growing)], ['rss', 'engine.shapes'])
+        # The warm-up sample is left out
+        self.assertEqual(detect_degradation([sample(rss=10)] + stable), [])
+
+    def test_keeps_growing(self):
+        self.assertTrue(keeps_growing([1, 2, 3, 4]))
+        self.assertFalse(keeps_growing([1, 5, 1, 1, 1, 2]))
+        self.assertFalse(keeps_growing([100, 101, 102], 0.2))
+        self.assertFalse(keeps_growing([3]))
+
+    def test_needs_metrics(self):
+        with self.assertRaises(ValueError):
+            SoakRunner(Emulator(10, engine='headless', decode_cache=None))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+import asyncio
+import base64
+import os
+import struct
+import unittest
+
+from app.emulator import Emulator
+from app.frame_codec import FrameDecoder
+from app.key import Key
+from app.stream_server import KEY_EVENT, TCP_HELLO, TCP_LENGTH, StreamServer
+
+# Draws the 0 character at 0/0, then waits forever
+ROM = bytes([0x00, 0xE0, 0xA0, 0x00, 0xD0, 0x05, 0x12, 0x06])
+
+class TestStreamServer(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self) -> None:
+        self.emulator = Emulator(10, engine='headless', decode_cache=None)
+        self.emulator.cpu.load_rom_bytes(ROM)
+        self.server = StreamServer(self.emulator, port=0)
+        await self.server.start()
+
+    async def asyncTearDown(self) -> None:
+        await self.server.stop()
+
+    async def wait_for_clients(self, count: int) -> None:
+        while len(self.server.clients) < count:
+            await asyncio.sleep(0.001)
+
+    async def read_tcp_message(self, reader: asyncio.StreamReader) -> bytes:
+        length, = TCP_LENGTH.unpack(await reader.readexactly(TCP_LENGTH.size))
+        return await reader.readexactly(length)
+
+    async def test_tcp_client(self):
+        reader, writer = await asyncio.open_connection('127.0.0.1', self.server.port)
+        writer.write(TCP_HELLO)
+        await self.wait_for_clients(1)
+
+        decoder = FrameDecoder()
+        self.server.step_frame()
+        decoder.apply(await self.read_tcp_message(reader))
+        self.assertEqual(decoder.planes, self.emulator.cpu.renderer.planes)
+        self.assertEqual(decoder.planes[0][0] >> 60, 0xF)
+
+        # Input goes back to the emulator
+        writer.write(KEY_EVENT.pack(1, Key.A.value))
+        await writer.drain()
+        while not self.emulator.cpu.keyboard.is_key_pressed(Key.A):
+            await asyncio.sleep(0.001)
+        writer.close()
+
+    async def test_frame_shared_between_clients(self):
+        connections = []
+        for _ in range(3):
+            reader, writer = await asyncio.open_connection('127.0.0.1', self.server.port)
+            writer.write(TCP_HELLO)
+            connections.append((reader, writer))
+        await self.wait_for_clients(3)
+        self.server.step_frame()
+        messages = [await self.read_tcp_message(reader) for reader, _ in connections]
+        self.assertEqual(len(set(messages)), 1)
+
+        # Nothing changed on screen, so nothing is sent until the next change
+        self.server.step_frame()
+        self.emulator.cpu.renderer.planes[0][10] = 1
+        self.server.step_frame()
+        decoder = FrameDecoder()
+        decoder.apply(messages[0])
+        self.assertEqual(decoder.apply(await self.read_tcp_message(connections[0][0])), 2)
+        self.assertEqual(decoder.planes[0][10], 1)
+        for _, writer in connections:
+            writer.close()
+
+    async def test_websocket_client(self):
+        reader, writer = await asyncio.open_connection('127.0.0.1', self.server.port)
+        key = base64.b64encode(os.urandom(16))
+        writer.write(b'GET / HTTP/1.1\r\nHost: localhost\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+            b'Sec-WebSocket-Key: ' + key + b'\r\nSec-WebSocket-Version: 13\r\n\r\n')
+        response = await reader.readuntil(b'\r\n\r\n')
+        self.assertTrue(response.startswith(b'HTTP/1.1 101'))
+        await self.wait_for_clients(1)
+
+        self.server.step_frame()
+        first, length = await reader.readexactly(2)
+        self.assertEqual(first, 0x82)
+        if length == 126:
+            length, = struct.unpack('>H', await reader.readexactly(2))
+        decoder = FrameDecoder()
+        decoder.apply(await reader.readexactly(length))
+        self.assertEqual(decoder.planes, self.emulator.cpu.renderer.planes)
+
+        # Masked client frame with a key event
+        mask = b'\x01\x02\x03\x04'
+        payload = bytes(byte ^ mask[i % 4] for i, byte in enumerate(KEY_EVENT.pack(1, Key.FIVE.value)))
+        writer.write(struct.pack('>BB', 0x82, 0x80 | len(payload)) + mask + payload)
+        await writer.drain()
+        while not self.emulator.cpu.keyboard.is_key_pressed(Key.FIVE):
+            await asyncio.sleep(0.001)
+        writer.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
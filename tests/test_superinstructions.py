@@ -0,0 +1,148 @@
+import random
+import unittest
+
+from app.constants import MEMORY_PROGRAM_START, SCREEN_SIZE
+from app.cpu import CPU
+from app.engine.headless_engine_handler import HeadlessEngineHandler
+from app.fuzz import CPUEngine, compare, random_case, random_instruction
+from app.keyboard import Keyboard
+from app.renderer import Renderer
+from app.speaker import Speaker
+
+# Fused sequences with random operands, the jumps going back to the start of the sequence or anywhere
+SEQUENCE_TEMPLATES: list[list[str]] = [
+    ['6XNN', '6XNN'],
+    ['ANNN', 'DXYN'],
+    ['7XNN', '3XNN', '1NNN'],
+    ['7XNN', '4XNN', '1NNN'],
+    ['FX07', '3X00', '1NNN'],
+    ['FX07', '4XNN', '1NNN'],
+]
+
+
+def random_sequence(rng: random.Random, address: int, length: int) -> list[int]:
+    words = []
+    x = rng.randrange(0x10)
+    for template in rng.choice(SEQUENCE_TEMPLATES):
+        word = int(template.replace('X', '%X' % x).replace('Y', '%X' % rng.randrange(0x10)).replace('N', '0'), 16)
+        if template == '1NNN':
+            word |= address if rng.random() < 0.7 else MEMORY_PROGRAM_START + 2 * rng.randrange(length)
+        elif template.endswith('NNN'):
+            word |= rng.randrange(0x1000)
+        elif template.endswith('NN') and template != '3X00':
+            word |= rng.choice((0, 1, 0xFF, rng.randrange(0x100)))
+        elif template.endswith('N'):
+            word |= rng.randrange(0x10)
+        words.append(word)
+    return words
+
+
+class TestSuperinstructions(unittest.TestCase):
+
+    def make_cpu(self, fusion: bool = True) -> CPU:
+        engine = HeadlessEngineHandler(size=SCREEN_SIZE)
+        return CPU(10, Renderer(engine, 1, (255, 255, 255)), Keyboard(engine), Speaker(engine, 440), seed=0, fusion=fusion)
+
+    def test_load_pair(self):
+        cpu = self.make_cpu()
+        cpu.load_rom_bytes(bytes([0x61, 0x12, 0x62, 0x34, 0x63, 0x56])) # LD V1, 0x12; LD V2, 0x34; LD V3, 0x56
+        # The first pass decodes the instructions
+        cpu.run_cycles(3)
+        self.assertEqual(cpu.fusion_stats['load_pair'], 0)
+        cpu.registers = [0] * 16
+        cpu.pc = 0x200
+        cpu.run_cycles(3)
+        self.assertEqual(cpu.registers[1:4], [0x12, 0x34, 0x56])
+        self.assertEqual(cpu.pc, 0x206)
+        self.assertEqual(cpu.fusion_stats['load_pair'], 2)
+
+    def test_pair_doesnt_cross_the_end_of_the_run(self):
+        cpu = self.make_cpu()
+        cpu.load_rom_bytes(bytes([0x61, 0x12, 0x62, 0x34]))
+        cpu.run_cycles(2)
+        cpu.registers[2] = 0
+        cpu.pc = 0x200
+        cpu.run_cycles(1)
+        self.assertEqual(cpu.registers[1:3], [0x12, 0])
+        self.assertEqual(cpu.pc, 0x202)
+        self.assertEqual(cpu.fusion_stats['load_pair'], 0)
+
+    def test_timer_wait_spins_for_the_rest_of_the_run(self):
+        cpu = self.make_cpu()
+        # LD V0, DT; SE V0, 0; JMP 0x200; LD V1, 1
+        cpu.load_rom_bytes(bytes([0xF0, 0x07, 0x30, 0x00, 0x12, 0x00, 0x61, 0x01]))
+        cpu.delay_timer = 2
+        cpu.run_cycles(100)
+        # A decoding pass, 32 fused passes, then LD V0, DT alone
+        self.assertEqual(cpu.fusion_stats['timer_wait'], 96)
+        self.assertEqual(cpu.pc, 0x202)
+        self.assertEqual(cpu.registers[0], 2)
+        cpu.delay_timer = 0
+        cpu.run_cycles(5)
+        self.assertEqual(cpu.pc, 0x208)
+        self.assertEqual(cpu.registers[1], 1)
+
+    def test_counter_loop(self):
+        cpu = self.make_cpu()
+        # ADD V0, 1; SE V0, 10; JMP 0x200; LD V1, 1
+        cpu.load_rom_bytes(bytes([0x70, 0x01, 0x30, 0x0A, 0x12, 0x00, 0x61, 0x01]))
+        cpu.run_cycles(30)
+        self.assertEqual(cpu.registers[:2], [10, 1])
+        self.assertEqual(cpu.pc, 0x208)
+        # A decoding pass, 8 fused passes and the last one skipping the jump
+        self.assertEqual(cpu.fusion_stats['counter_loop'], 26)
+
+    def test_self_modifying_code(self):
+        cpu = self.make_cpu()
+        cpu.load_rom_bytes(bytes([0x61, 0x12, 0x62, 0x34, 0x12, 0x00])) # LD V1, 0x12; LD V2, 0x34; JMP 0x200
+        cpu.run_cycles(6)
+        self.assertEqual(cpu.fusion_stats['load_pair'], 2)
+        cpu.memory[0x203] = 0x99
+        cpu.run_cycles(3)
+        self.assertEqual(cpu.registers[2], 0x99)
+        self.assertEqual(cpu.fusion_stats['load_pair'], 2)
+        # Fused again from the new code
+        cpu.run_cycles(2)
+        self.assertEqual(cpu.fusion_stats['load_pair'], 4)
+
+    def test_clone_and_quirks_reset_the_superinstructions(self):
+        cpu = self.make_cpu()
+        cpu.load_rom_bytes(bytes([0x61, 0x12, 0x62, 0x34]))
+        cpu.run_cycles(2)
+        clone = cpu.clone()
+        self.assertEqual(clone.fused, {})
+        self.assertEqual(clone.fusion_stats['load_pair'], 0)
+        cpu.set_quirks(cpu.quirks)
+        self.assertEqual(cpu.fused, {})
+
+    def test_same_results_as_single_instructions(self):
+        rng = random.Random(4)
+        fused, single = CPUEngine(), CPUEngine()
+        single.cpu.fusion = False
+        for _ in range(300):
+            case = random_case(rng)
+            program: list[int] = []
+            length = len(case.program)
+            while len(program) < length:
+                if rng.random() < 0.4:
+                    program.extend(random_sequence(rng, MEMORY_PROGRAM_START + 2 * len(program), length))
+                else:
+                    program.extend(random_instruction(rng, length))
+            case = case._replace(program=tuple(program))
+            cycles = rng.randint(1, 4 * length)
+            errors = []
+            for engine in (fused, single):
+                engine.load(case)
+                try:
+                    engine.cpu.run_cycles(cycles)
+                    errors.append(None)
+                except Exception as e:
+                    errors.append(type(e))
+            self.assertEqual(errors[0], errors[1])
+            if errors[0] is None:
+                self.assertEqual(compare(single, fused), [], case)
+        self.assertGreater(sum(fused.cpu.fusion_stats.values()), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
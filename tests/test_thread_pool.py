@@ -0,0 +1,66 @@
+import logging
+import unittest
+
+from app.emulator import Emulator
+from app.golden import GoldenSuite
+from app.job_queue import JOB_DONE, JOB_ERROR, Job, golden_jobs, run_job
+from app.thread_pool import ThreadPoolRunner, decode_rom, default_thread_count, gil_enabled
+
+class TestThreadPool(unittest.TestCase):
+
+    def test_golden_hashes(self):
+        suite = GoldenSuite('tests/golden', 'roms')
+        # Several CPUs running the same ROM at once
+        jobs = [job._replace(job_id='%s-%d' % (job.job_id, copy)) for job in golden_jobs(suite)[:6] for copy in range(3)]
+        runner = ThreadPoolRunner(4)
+        results = runner.run(jobs)
+        self.assertEqual([result.job_id for result in results], [job.job_id for job in jobs])
+        for job, result in zip(jobs, results):
+            self.assertEqual(result.status, JOB_DONE)
+            self.assertEqual(result.hashes, suite.hashes[job.job_id.rsplit('-', 1)[0]], job.job_id)
+        self.assertEqual(len(runner.decoded_roms), 6)
+
+    def test_shared_decoded_rom_is_only_read(self):
+        with open('roms/BRIX', 'rb') as f:
+            job = Job('BRIX', f.read(), [60, 300], seed=3)
+        decoded_rom = decode_rom(job.rom)
+        instructions = dict(decoded_rom.instructions)
+        self.assertGreater(len(instructions), 10)
+        warm, cold = {}, {}
+        self.assertEqual(run_job(job, warm.__setitem__, decoded_rom), (JOB_DONE, None))
+        run_job(job, cold.__setitem__)
+        self.assertEqual(warm, cold)
+        self.assertEqual(decoded_rom.instructions, instructions)
+
+    def test_errors(self):
+        results = ThreadPoolRunner(2).run([Job('crash', bytes([0x00, 0xEE]), [10]), Job('loop', bytes([0x12, 0x00]), [10])])
+        self.assertEqual([result.status for result in results], [JOB_ERROR, JOB_DONE])
+
+    def test_emulator_error_keeps_the_other_results(self):
+        suite = GoldenSuite('tests/golden', 'roms')
+        jobs = golden_jobs(suite)[:3]
+        # LD V0, 0x20; SKP V0: 0x20 is not a key
+        bad = Job('bad-key', bytes([0x60, 0x20, 0xE0, 0x9E]), [10])
+        results = ThreadPoolRunner(2).run([jobs[0], bad] + jobs[1:])
+        self.assertEqual(results[1].status, JOB_ERROR)
+        self.assertIn('ValueError', results[1].error)
+        for job, result in zip(jobs, results[:1] + results[2:]):
+            self.assertEqual(result.status, JOB_DONE)
+            self.assertEqual(result.hashes, suite.hashes[job.job_id], job.job_id)
+
+    def test_fallback(self):
+        if gil_enabled():
+            self.assertEqual(default_thread_count(), 1)
+        else:
+            self.assertGreaterEqual(default_thread_count(), 1)
+
+    def test_emulator_leaves_logging_alone(self):
+        handlers = logging.root.handlers[:]
+        level = logging.root.level
+        Emulator(10, engine='headless', decode_cache=None)
+        self.assertEqual(logging.root.handlers, handlers)
+        self.assertEqual(logging.root.level, level)
+
+
+if __name__ == '__main__':
+    unittest.main()
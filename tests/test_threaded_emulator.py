@@ -0,0 +1,105 @@
+import threading
+import unittest
+
+from app.emulator import Emulator
+from app.frame_codec import empty_frame
+from app.key import Key
+from app.threaded_emulator import FrameExchange, SoundRelay, ThreadedEmulator
+
+class TestThreadedEmulator(unittest.TestCase):
+
+    def setUp(self):
+        self.emulator = Emulator(4, engine='headless', decode_cache=None)
+        self.threaded = ThreadedEmulator(self.emulator)
+
+    def test_frame_exchange(self):
+        frames = FrameExchange()
+        self.assertFalse(frames.take())
+        frame = empty_frame()
+        frame[0][3] = 0xFF
+        frames.publish(frame)
+        frame[0][3] = 0x0F
+        frames.publish(frame)
+        self.assertTrue(frames.take())
+        # Only the latest frame is kept, and it is a copy
+        self.assertEqual(frames.front[0][3], 0x0F)
+        frame[0][3] = 0
+        self.assertEqual(frames.front[0][3], 0x0F)
+        self.assertFalse(frames.take())
+        self.assertEqual(frames.published, 2)
+
+    def test_frame_exchange_concurrent(self):
+        frames = FrameExchange()
+        count = 2000
+        def writer():
+            for n in range(1, count + 1):
+                # Every row holds the frame number: a torn frame would mix numbers
+                frames.publish([[n] * 32, [n] * 32])
+        thread = threading.Thread(target=writer)
+        thread.start()
+        last = 0
+        while True:
+            alive = thread.is_alive()
+            if frames.take():
+                rows = frames.front[0] + frames.front[1]
+                self.assertEqual(len(set(rows)), 1)
+                self.assertGreaterEqual(rows[0], last)
+                last = rows[0]
+            elif not alive:
+                break
+        thread.join()
+        self.assertEqual(last, count)
+
+    def test_sound_relay(self):
+        engine = self.emulator.engine
+        relay = SoundRelay()
+        relay.play_sound(440)
+        self.assertFalse(engine.sound_playing)
+        relay.apply(engine)
+        self.assertTrue(engine.sound_playing)
+        relay.stop_sound()
+        relay.apply(engine)
+        self.assertFalse(engine.sound_playing)
+
+    def test_input_goes_through_queue(self):
+        cpu = self.emulator.cpu
+        self.emulator.engine.press(Key.FIVE)
+        self.assertFalse(cpu.keyboard.is_key_pressed(Key.FIVE))
+        self.assertEqual(len(self.threaded.input_events), 1)
+        cpu.load_rom_bytes(bytes([0x12, 0x00])) # JMP 0x200
+        self.threaded.step_frame()
+        self.assertTrue(cpu.keyboard.is_key_pressed(Key.FIVE))
+        self.emulator.engine.release(Key.FIVE)
+        self.threaded.step_frame()
+        self.assertFalse(cpu.keyboard.is_key_pressed(Key.FIVE))
+
+    def test_frames_reach_render_thread(self):
+        cpu = self.emulator.cpu
+        # LD I, sprite of 0; DRW V0, V0, 5; JMP 0x204
+        cpu.load_rom_bytes(bytes([0xA0, 0x00, 0xD0, 0x05, 0x12, 0x04]))
+        self.threaded.step_frame()
+        self.assertEqual(self.threaded.renderer.planes[0][0], 0)
+        self.assertTrue(self.threaded.render_frame())
+        self.assertEqual(self.threaded.renderer.planes[0][:5], cpu.renderer.planes[0][:5])
+        self.assertNotEqual(self.threaded.renderer.planes[0][0], 0)
+        # The CPU draws without touching the window engine
+        self.assertIsNot(cpu.renderer.engine, self.emulator.engine)
+
+    def test_thread_runs_and_stops(self):
+        cpu = self.emulator.cpu
+        cpu.load_rom_bytes(bytes([0x70, 0x01, 0x12, 0x00])) # ADD V0, 1; JMP 0x200
+        self.threaded.start()
+        while self.threaded.frames.published < 3:
+            self.threaded.render_frame()
+        self.threaded.stop()
+        self.assertIsNone(self.threaded.error)
+        self.assertGreaterEqual(self.threaded.frames.published, 3)
+        self.assertGreater(cpu.registers[0], 0)
+
+    def test_auto_tune_is_rejected(self):
+        with self.assertRaises(ValueError):
+            ThreadedEmulator(Emulator(1, engine='headless', decode_cache=None, target_ips=300))
+
+
+if __name__ == '__main__':
+    unittest.main()